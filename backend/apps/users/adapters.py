@@ -2,11 +2,18 @@ from allauth.socialaccount.adapter import DefaultSocialAccountAdapter
 from allauth.account.adapter import DefaultAccountAdapter
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+import itertools
 import random
 import string
+from .backends import usernames_starting_with
 
 User = get_user_model()
 
+USERNAME_MAX_LENGTH = User._meta.get_field('username').max_length
+# Signups racing for the same username retry with a fresh suffix this many times
+USERNAME_SAVE_ATTEMPTS = 3
+
 
 class SocialAccountAdapter(DefaultSocialAccountAdapter):
     """Custom adapter for social account handling"""
@@ -18,18 +25,28 @@ class SocialAccountAdapter(DefaultSocialAccountAdapter):
             sociallogin.connect(request, request.user)
     
     def _generate_unique_username(self, base_username):
-        """Generate a unique username by appending numbers if needed"""
-        username = base_username
-        counter = 1
-        while User.objects.filter(username=username).exists():
-            username = f"{base_username}{counter}"
-            counter += 1
-            # Safety limit to prevent infinite loops
-            if counter > 1000:
-                # If we hit the limit, add random string
-                random_suffix = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
-                username = f"{base_username}_{random_suffix}"
-                break
+        """
+        Return base_username, or base_username with the lowest free number appended.
+
+        All usernames sharing the prefix are fetched in one query (an index
+        range scan on PostgreSQL, see backends.usernames_starting_with) and the
+        suffix is picked in memory, ignoring case
+        like logins do. A concurrent signup can still take the name before
+        this user is saved; save_user() retries on the IntegrityError.
+        """
+        base_username = base_username[:USERNAME_MAX_LENGTH]
+        prefix = base_username.lower()
+        taken = usernames_starting_with(prefix)
+        if prefix not in taken:
+            return base_username
+
+        suffixes = {name[len(prefix):] for name in taken}
+        counter = next(n for n in itertools.count(1) if str(n) not in suffixes)
+        username = f"{base_username}{counter}"
+        if len(username) > USERNAME_MAX_LENGTH:
+            # No room for the number; fall back to a random string
+            random_suffix = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
+            username = f"{base_username[:USERNAME_MAX_LENGTH - 7]}_{random_suffix}"
         return username
     
     def populate_user(self, request, sociallogin, data):
@@ -53,18 +70,15 @@ class SocialAccountAdapter(DefaultSocialAccountAdapter):
                 # Fallback: use provider and uid
                 base_username = f"user_{sociallogin.account.provider}_{sociallogin.account.uid[:8]}"
                 user.username = self._generate_unique_username(base_username)
-        else:
-            # Ensure existing username is unique (in case of conflicts)
-            if User.objects.filter(username=user.username).exclude(pk=user.pk if user.pk else None).exists():
-                user.username = self._generate_unique_username(user.username)
+        elif not user.pk:
+            # Ensure existing username is unique, ignoring case (in case of conflicts)
+            user.username = self._generate_unique_username(user.username)
         
         return user
     
     def save_user(self, request, sociallogin, form=None):
-        """Save the user after social login"""
-        # Call parent to save user
-        user = super().save_user(request, sociallogin, form)
-        # Ensure username is set and unique
+        """Save the user after social login, retrying if the username was taken meanwhile"""
+        user = sociallogin.user
         if not user.username:
             # Generate username if not set
             if user.email:
@@ -73,8 +87,17 @@ class SocialAccountAdapter(DefaultSocialAccountAdapter):
                 user.username = self._generate_unique_username(base_username)
             else:
                 user.username = self._generate_unique_username(f"user_{sociallogin.account.provider}_{sociallogin.account.uid[:8]}")
-            user.save()
-        return user
+
+        base_username = user.username
+        for attempt in range(USERNAME_SAVE_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return super().save_user(request, sociallogin, form)
+            except IntegrityError:
+                # Only a failed user INSERT (a username collision) is worth retrying
+                if user.pk is not None or attempt == USERNAME_SAVE_ATTEMPTS - 1:
+                    raise
+                user.username = self._generate_unique_username(base_username)
     
     def get_connect_redirect_url(self, request, socialaccount):
         """Redirect after connecting social account"""
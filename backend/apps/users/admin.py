@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, QuestProgress
+from .models import User, QuestProgress, UserStats, StripeEvent
+from . import services
 
 
 @admin.register(User)
@@ -15,3 +16,39 @@ class QuestProgressAdmin(admin.ModelAdmin):
     search_fields = ('user__username', 'user__email')
     date_hierarchy = 'date'
 
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        services.rebuild_user_stats(obj.user)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        services.rebuild_user_stats(obj.user)
+
+
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'total_xp', 'current_streak', 'longest_streak', 'last_completed_date', 'updated_at')
+    search_fields = ('user__username', 'user__email')
+    readonly_fields = ('total_xp', 'current_streak', 'streak_start_date', 'longest_streak', 'last_completed_date', 'updated_at')
+    actions = ['recompute_from_history']
+
+    @admin.action(description='Recompute selected stats from quest history')
+    def recompute_from_history(self, request, queryset):
+        rows = services.bulk_rebuild_user_stats(queryset.values_list('user_id', flat=True))
+        self.message_user(request, f'Recomputed stats for {len(rows)} user(s).')
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'type', 'customer_id', 'created', 'status', 'attempts', 'stripe_calls', 'next_attempt_at', 'processed_at')
+    list_filter = ('status', 'type')
+    search_fields = ('event_id', 'customer_id')
+    readonly_fields = ('event_id', 'type', 'customer_id', 'created', 'payload', 'received_at', 'processed_at')
+    actions = ['retry_events']
+
+    @admin.action(description='Queue selected events for processing again')
+    def retry_events(self, request, queryset):
+        updated = queryset.update(status=StripeEvent.Status.PENDING, attempts=0, last_error='',
+                                   next_attempt_at=None)
+        self.message_user(request, f'Queued {updated} event(s) for processing.')
@@ -0,0 +1,78 @@
+"""
+Authentication by username or email, case-insensitively, in one query.
+
+Lookups compare lower(username) and lower(email), which are covered by the
+functional indexes on User, so logins, password resets and the social
+account adapter never scan the users table on PostgreSQL. The adapter's
+prefix match uses a separate text_pattern_ops index, created by migration
+0015. Passwords are verified on the bounded hashing pool (see hashing.py).
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+from django.db.models import Case, F, Q, When
+from django.db.models.functions import Lower
+from . import hashing
+
+User = get_user_model()
+
+
+def _folded():
+    return User.objects.alias(username_lower=Lower('username'), email_lower=Lower('email'))
+
+
+def find_user(identifier):
+    """
+    Return the user with this username or email, ignoring case, or None.
+
+    An exact username match wins, then a case-insensitive one, then email.
+    Several accounts may share an email; the most recently active is chosen.
+    """
+    folded = identifier.lower()
+    match = Q(username_lower=folded)
+    if '@' in identifier:
+        match |= Q(email_lower=folded)
+    return _folded().filter(match).order_by(
+        Case(When(username=identifier, then=0), When(username_lower=folded, then=1), default=2),
+        F('last_login').desc(nulls_last=True),
+        'pk',
+    ).first()
+
+
+def users_with_email(email):
+    """Return the active users with this email, ignoring case"""
+    return _folded().filter(email_lower=email.lower(), is_active=True)
+
+
+def usernames_starting_with(prefix):
+    """
+    Return the set of lowercased usernames that start with prefix, ignoring case.
+
+    On PostgreSQL, lower(username) LIKE 'prefix%' is a range scan over
+    users_user_username_lower_like_idx (text_pattern_ops); the plain lower()
+    index can't serve LIKE under a non-C collation. SQLite, used only for
+    development and tests, scans the table.
+    """
+    return set(
+        User.objects.annotate(username_lower=Lower('username'))
+        .filter(username_lower__startswith=prefix.lower())
+        .values_list('username_lower', flat=True)
+    )
+
+
+class UsernameOrEmailBackend(ModelBackend):
+    """ModelBackend that accepts a username or an email as the login"""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD) or kwargs.get('email')
+        if not username or password is None:
+            return None
+
+        user = find_user(username)
+        if user is None:
+            hashing.run_dummy_hash(password)
+        elif hashing.check_password(user, password) and self.user_can_authenticate(user):
+            return user
+        # Later backends would only look the same credentials up again
+        raise PermissionDenied
@@ -0,0 +1,114 @@
+"""
+Conditional GET support (ETag / Last-Modified) for polled read endpoints.
+
+Each validator computes an ETag and Last-Modified timestamp for a resource with
+one small query, so an unchanged resource is answered with 304 Not Modified
+before the view queries or serializes anything.
+"""
+import hashlib
+from calendar import timegm
+from datetime import date, timedelta
+from functools import wraps
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from .models import QuestProgress, Subscription, UserStats
+from .serializers import QuestHistoryQuerySerializer
+from .history_bitmap import HISTORY_BITMAP_CONTEXT
+from . import entitlements
+
+
+def _make_etag(*parts):
+    return quote_etag(hashlib.md5(repr(parts).encode()).hexdigest())
+
+
+def _timestamp(value):
+    return timegm(value.utctimetuple()) if value else None
+
+
+def _progress_state(queryset):
+    # Count is part of the validator so deleting a row changes the ETag
+    state = queryset.aggregate(last_modified=Max('updated_at'), count=Count('id'))
+    return state['last_modified'], state['count']
+
+
+def today_validator(request):
+    today = date.today()
+    last_modified, count = _progress_state(QuestProgress.objects.filter(user=request.user, date=today))
+    return _make_etag('today', request.user.pk, today, last_modified, count), _timestamp(last_modified)
+
+
+def _history_window_validator(name, context=None):
+    def validator(request):
+        queryset = QuestProgress.objects.filter(user=request.user)
+        params = QuestHistoryQuerySerializer(data=request.query_params, context=context or {})
+        window = None
+        if params.is_valid():
+            # Only the requested window matters; invalid params fall through to the view's 400
+            window = (params.validated_data['from'], params.validated_data['to'])
+            queryset = queryset.filter(date__range=window)
+        last_modified, count = _progress_state(queryset)
+        etag = _make_etag(name, request.user.pk, request.GET.urlencode(), window, last_modified, count)
+        return etag, _timestamp(last_modified)
+    return validator
+
+
+history_validator = _history_window_validator('history')
+history_bitmap_validator = _history_window_validator('history-bitmap', HISTORY_BITMAP_CONTEXT)
+
+
+def stats_validator(request):
+    # UserStats is saved in the same transaction as every progress write, so its
+    # updated_at stands in for the whole history at the cost of a primary-key read
+    last_modified = UserStats.objects.filter(pk=request.user.pk).values_list('updated_at', flat=True).first()
+    # Streak and momentum hours also change as time passes, so the resource is
+    # considered modified at the top of every hour.
+    hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+    etag = _make_etag('stats', request.user.pk, hour, last_modified)
+    return etag, _timestamp(max(last_modified, hour) if last_modified else hour)
+
+
+def subscription_validator(request):
+    entitlement = entitlements.get_entitlement(request)
+    last_modified = entitlement.updated_at
+    # A premium period lapses without any write (see has_premium_access), so the
+    # resource changes then too
+    active_premium = (entitlement.tier, entitlement.status) == (Subscription.Tier.PREMIUM, Subscription.Status.ACTIVE)
+    if active_premium and entitlement.current_period_end and not entitlement.is_premium:
+        lapsed_at = entitlement.current_period_end + timedelta(hours=settings.SUBSCRIPTION_EXPIRY_GRACE_HOURS)
+        last_modified = max(last_modified, lapsed_at) if last_modified else lapsed_at
+    etag = _make_etag('subscription', request.user.pk, entitlement.updated_at, entitlement.is_premium)
+    return etag, _timestamp(last_modified)
+
+
+def conditional(validator):
+    """
+    Answer GET/HEAD requests with 304 when the client's validators still match.
+
+    Apply below @api_view so the validator sees the authenticated user. Other
+    methods pass straight through to the view.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            etag, last_modified = validator(request)
+            # Cached views key their responses on it (see quest_cache.get_or_build)
+            request.etag = etag
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+
+            if response.status_code in (200, 304):
+                response.headers.setdefault('ETag', etag)
+                if last_modified is not None:
+                    response.headers.setdefault('Last-Modified', http_date(last_modified))
+                # Let browsers keep the body but revalidate on every request
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,140 @@
+"""
+Request-scoped premium entitlement resolution.
+
+A user's entitlement (tier, status, billing interval, period end) is read from
+their Subscription row once and kept in a bounded, process-local LRU cache,
+so premium checks cost no queries in steady state. Entries are evicted when a
+Subscription row is saved or deleted in this process (checkout, cancel,
+webhook handlers, reconciliation) and otherwise expire after
+ENTITLEMENT_CACHE_TTL_SECONDS. That TTL bounds how stale another process can
+be, e.g. a web worker after process_stripe_events applies a webhook.
+
+Lapsed periods need no invalidation: Entitlement.is_premium applies the same
+expiry cutoff as Subscription.is_premium at read time.
+
+EntitlementMiddleware exposes the entitlement lazily as request.entitlement;
+DRF views can use the IsPremium permission instead.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from rest_framework.permissions import BasePermission
+from .models import Subscription, has_premium_access
+
+
+class Entitlement(namedtuple('Entitlement', ['tier', 'status', 'billing_interval', 'current_period_end',
+                                             'updated_at'])):
+    __slots__ = ()
+
+    @property
+    def is_premium(self):
+        return has_premium_access(self.tier, self.status, self.current_period_end)
+
+
+# Users without a Subscription row
+FREE = Entitlement(Subscription.Tier.FREE, Subscription.Status.ACTIVE, None, None, None)
+
+
+class EntitlementCache:
+    """Thread-safe LRU of user ID -> Entitlement with a per-entry TTL"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation, so a read that raced a write is not cached
+        self.generation = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, entitlement = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entitlement
+
+    def set(self, user_id, entitlement, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[user_id] = (time.monotonic() + settings.ENTITLEMENT_CACHE_TTL_SECONDS, entitlement)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > settings.ENTITLEMENT_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self.generation += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = EntitlementCache()
+
+
+def resolve(user):
+    """Return the user's Entitlement, from the cache when possible"""
+    if not user.is_authenticated:
+        return FREE
+    entitlement = _cache.get(user.pk)
+    if entitlement is not None:
+        return entitlement
+
+    generation = _cache.generation
+    row = Subscription.objects.filter(user_id=user.pk).values_list(*Entitlement._fields).first()
+    entitlement = Entitlement(*row) if row is not None else FREE
+    _cache.set(user.pk, entitlement, generation)
+    return entitlement
+
+
+def invalidate(*user_ids):
+    """Drop cached entitlements, e.g. after writing Subscription rows without save()"""
+    _cache.invalidate(user_ids)
+
+
+def clear():
+    _cache.clear()
+
+
+def get_entitlement(request):
+    """Return the entitlement of request.user, resolved at most once per request"""
+    http_request = getattr(request, '_request', request)
+    user = request.user
+    cached = getattr(http_request, '_cached_entitlement', None)
+    if cached is None or cached[0] != user.pk:
+        # Keyed by user, since logging in or out swaps request.user mid-request
+        cached = http_request._cached_entitlement = (user.pk, resolve(user))
+    return cached[1]
+
+
+class EntitlementMiddleware:
+    """Attach the user's entitlement to the request as request.entitlement"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.entitlement = SimpleLazyObject(lambda: get_entitlement(request))
+        return self.get_response(request)
+
+
+class IsPremium(BasePermission):
+    """Allow access only to users with an active premium subscription"""
+
+    message = 'A premium subscription is required'
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and get_entitlement(request).is_premium)
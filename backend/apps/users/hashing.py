@@ -0,0 +1,131 @@
+"""
+Password hashing on a bounded worker pool.
+
+Password hashes are deliberately slow. Run inline, a burst of login attempts
+(e.g. credential stuffing) keeps every server thread busy hashing, and other
+requests wait behind it. Here hashes run on a per-process pool of
+PASSWORD_HASHING_WORKERS threads. hashlib releases the GIL while hashing, so
+the pool uses that many cores. At most PASSWORD_HASHING_QUEUE_DEPTH further
+hashes may wait for a free worker. Past that, or when a hash hasn't finished
+within PASSWORD_HASHING_TIMEOUT_SECONDS, HashingUnavailable is raised and the
+client gets 503 with Retry-After, without any hashing being done: from DRF's
+exception handler on API views, and from HashingUnavailableMiddleware on the
+rest (Django admin and allauth log in through the same auth backend).
+
+The request thread still waits for its own hash; what is bounded is how many
+threads per process can be hashing or waiting. That only matters on a threaded
+server with more threads than workers + queue depth, such as the gthread
+workers start.sh runs (8 threads against 2 + 4): the rest stay free for other
+requests. Sync workers handle one request at a time and never fill the pool.
+
+The pool only ever computes hashes; it never touches the database. Upgrading a
+stored hash to the preferred hasher (first in PASSWORD_HASHERS, e.g. scrypt)
+happens in check_password(), on the request's own thread and connection.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class HashingUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The server is busy. Please try again in a moment.'
+    default_code = 'hashing_unavailable'
+    # Sent as Retry-After by DRF's exception handler
+    wait = 1
+
+
+class HashingUnavailableMiddleware:
+    """Answer HashingUnavailable from non-DRF views with 503 and Retry-After instead of 500"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, HashingUnavailable):
+            return None
+        response = HttpResponse(exception.detail, status=exception.status_code,
+                                content_type='text/plain; charset=utf-8')
+        response['Retry-After'] = str(exception.wait)
+        return response
+
+
+class HashingExecutor:
+    """Thread pool that refuses work instead of queueing it without bound"""
+
+    def __init__(self, workers, queue_depth, timeout):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hashing')
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self.timeout = timeout
+
+    def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingUnavailable()
+        try:
+            future = self._pool.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Drop it if it hasn't started; a running hash finishes and frees its slot
+            future.cancel()
+            raise HashingUnavailable()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = HashingExecutor(
+                    settings.PASSWORD_HASHING_WORKERS,
+                    settings.PASSWORD_HASHING_QUEUE_DEPTH,
+                    settings.PASSWORD_HASHING_TIMEOUT_SECONDS,
+                )
+    return _executor
+
+
+def make_password(raw_password):
+    """Hash a password with the preferred hasher"""
+    return get_executor().run(hashers.make_password, raw_password)
+
+
+def set_password(user, raw_password):
+    """Like user.set_password(), hashing on the pool; the caller saves the user"""
+    user.password = make_password(raw_password)
+    # Lets AbstractBaseUser.save() notify the password validators
+    user._password = raw_password
+
+
+def check_password(user, raw_password):
+    """
+    Like user.check_password(), verifying on the pool.
+
+    A correct password stored with an outdated hasher or work factor is
+    re-hashed with the preferred hasher and saved.
+    """
+    outdated = []
+    valid = get_executor().run(hashers.check_password, raw_password, user.password, outdated.append)
+    if valid and outdated:
+        user.password = make_password(raw_password)
+        user.save(update_fields=['password'])
+    return valid
+
+
+def run_dummy_hash(raw_password):
+    """Hash once for an unknown account, so timing doesn't reveal it"""
+    make_password(raw_password)
@@ -0,0 +1,57 @@
+"""
+Compact bitmap encoding of quest history for the heatmap.
+
+Each quest on each day is packed into 2 bits:
+
+    bit 0: the quest has text
+    bit 1: the quest was completed
+
+Days run consecutively from `start`, three quests per day (6 bits), and bits
+are packed least-significant first: quest q of day d occupies bits
+2 * (3 * d + q) and 2 * (3 * d + q) + 1 of the byte stream. Days without a row
+are all zeros. A year is 274 bytes, 368 characters once base64-encoded.
+"""
+import base64
+from datetime import timedelta
+from django.db.models.functions import Length
+from .models import QuestProgress
+
+BITS_PER_QUEST = 2
+QUESTS_PER_DAY = 3
+HAS_TEXT = 0b01
+COMPLETED = 0b10
+
+# Query parameter defaults for the bitmap endpoint: a year by default, at most ten
+HISTORY_BITMAP_CONTEXT = {'default_days': 365, 'max_days': 3660}
+
+
+def encode_history(user, start, end):
+    """Return the base64 bitmap of the user's quest states from start to end inclusive"""
+    days = (end - start).days + 1
+    bitmap = bytearray((days * QUESTS_PER_DAY * BITS_PER_QUEST + 7) // 8)
+
+    rows = QuestProgress.objects.filter(user=user, date__range=(start, end)).order_by().values_list(
+        'date', 'completion_mask', Length('quest_1_text'), Length('quest_2_text'), Length('quest_3_text'),
+    )
+    for row_date, completion_mask, *text_lengths in rows.iterator():
+        day = (row_date - start).days
+        for quest in range(QUESTS_PER_DAY):
+            state = (HAS_TEXT if text_lengths[quest] else 0) | (COMPLETED if completion_mask >> quest & 1 else 0)
+            bit = (day * QUESTS_PER_DAY + quest) * BITS_PER_QUEST
+            bitmap[bit // 8] |= state << (bit % 8)
+
+    return base64.b64encode(bytes(bitmap)).decode('ascii')
+
+
+def decode_history(data, start, days):
+    """Inverse of encode_history: {date: [state, state, state]} for days with any state"""
+    bitmap = base64.b64decode(data)
+    history = {}
+    for day in range(days):
+        states = []
+        for quest in range(QUESTS_PER_DAY):
+            bit = (day * QUESTS_PER_DAY + quest) * BITS_PER_QUEST
+            states.append((bitmap[bit // 8] >> (bit % 8)) & 0b11)
+        if any(states):
+            history[start + timedelta(days=day)] = states
+    return history
@@ -0,0 +1,118 @@
+"""
+Idempotency-Key support for mutating endpoints.
+
+Clients on flaky networks retry requests they never saw an answer to. When a
+request carries an Idempotency-Key header, its response is stored per user and
+replayed for any retry with the same key and body, so the view (and any Stripe
+call it makes) runs once. Stored responses expire after IDEMPOTENCY_KEY_TTL_HOURS
+and are removed by the purge_idempotency_keys command.
+
+While the first request runs, retries get 409. A claim left unfinished for
+IDEMPOTENCY_LEASE_SECONDS, longer than a worker may run a request, belongs to
+a request that died (timed-out or killed worker, deploy) and is taken over by
+the next retry.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http.request import RawPostDataException
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def _request_hash(request):
+    try:
+        body = request.body
+    except RawPostDataException:
+        # A form body already consumed during authentication; hash the parsed form
+        body = json.dumps(request.POST, sort_keys=True).encode()
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def _is_stale(record):
+    now = timezone.now()
+    if record.created_at < now - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS):
+        # Not purged yet, but past its TTL
+        return True
+    # Still unfinished past the lease: the request that claimed it died
+    lease_expired_before = now - timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+    return record.status_code is None and record.created_at < lease_expired_before
+
+
+def _claim(user, key, request_hash):
+    """Record the key as in flight; returns (our claim or None, record already stored for it)"""
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(user=user, key=key, request_hash=request_hash), None
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if existing is None or not _is_stale(existing):
+                return None, existing
+            # The key is free to reuse; deleting by pk never removes a newer claim
+            existing.delete()
+    return None, None
+
+
+def _replay(record, request_hash):
+    if record is not None and record.request_hash != request_hash:
+        return Response({
+            'error': 'Idempotency-Key was already used for a different request'
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if record is None or record.status_code is None:
+        return Response({
+            'error': 'A request with this Idempotency-Key is still being processed'
+        }, status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'})
+    return Response(record.response_body, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view_func):
+    """
+    Store and replay responses for requests sent with an Idempotency-Key header.
+
+    Apply below @permission_classes so keys are scoped to the authenticated user.
+    Requests without the header, and GET/HEAD, pass straight through. Server
+    errors are not stored, so the client may retry them with the same key.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return view_func(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response({
+                'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        request_hash = _request_hash(request)
+        claim, existing = _claim(request.user, key, request_hash)
+        if claim is None:
+            return _replay(existing, request_hash)
+
+        # By pk, so a request that outlived its lease cannot touch a retry's claim
+        record = IdempotencyKey.objects.filter(pk=claim.pk)
+        try:
+            response = view_func(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 500 or not hasattr(response, 'data'):
+            record.delete()
+        else:
+            # Store exactly what the client receives, as plain JSON
+            body = None if response.data is None else json.loads(JSONRenderer().render(response.data))
+            record.update(status_code=response.status_code, response_body=body)
+        return response
+    return wrapper
@@ -0,0 +1,114 @@
+"""
+Django management command to benchmark Stripe webhook throughput.
+
+Seeds a large number of users with Stripe-linked subscriptions, then times the
+two halves of webhook handling separately: recording signed events (signature
+check + insert, what the webhook endpoint does) and applying them with the
+process_stripe_events worker (indexed, row-locked Subscription updates).
+Everything runs inside a transaction that is rolled back at the end, so the
+database is left as it was.
+
+Usage:
+    python manage.py benchmark_stripe_webhooks
+    python manage.py benchmark_stripe_webhooks --subscriptions 100000 --events 5000
+"""
+
+import json
+import random
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from apps.users.models import StripeEvent, Subscription, User
+from apps.users import stripe_service
+from .generate_stripe_events import fake_subscription_event, sign_payload
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark data"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmark Stripe webhook recording and processing against many subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--subscriptions',
+            type=int,
+            default=100_000,
+            help='Number of seeded subscriptions (default: 100000)',
+        )
+        parser.add_argument('--events', type=int, default=2000, help='Number of webhook events (default: 2000)')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per insert while seeding (default: 5000)',
+        )
+
+    def handle(self, *args, **options):
+        secret = settings.STRIPE_WEBHOOK_SECRET or 'whsec_benchmark'
+        try:
+            with override_settings(STRIPE_WEBHOOK_SECRET=secret), transaction.atomic():
+                self._seed(options['subscriptions'], options['batch_size'])
+                self._run(options['subscriptions'], options['events'], secret)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _seed(self, count, batch_size):
+        started = time.perf_counter()
+        first_pk = (User.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+        for offset in range(0, count, batch_size):
+            numbers = range(offset, min(offset + batch_size, count))
+            User.objects.bulk_create([
+                User(username=f'stripe_bench_{n}', email=f'stripe_bench_{n}@example.com', password='!')
+                for n in numbers
+            ])
+        user_ids = User.objects.filter(pk__gte=first_pk, username__startswith='stripe_bench_').values_list(
+            'pk', 'username'
+        )
+        Subscription.objects.bulk_create((
+            Subscription(
+                user_id=pk,
+                tier=Subscription.Tier.PREMIUM,
+                stripe_customer_id=f'cus_bench_{username.rsplit("_", 1)[1]}',
+                stripe_subscription_id=f'sub_bench_{username.rsplit("_", 1)[1]}',
+            )
+            for pk, username in user_ids.iterator(chunk_size=batch_size)
+        ), batch_size=batch_size)
+        self.stdout.write(f'Seeded {count} subscription(s) in {time.perf_counter() - started:.1f}s')
+
+    def _run(self, customers, count, secret):
+        base_time = int(time.time()) - count
+        deliveries = []
+        for number in range(count):
+            event = fake_subscription_event(number, random.randrange(customers), base_time + number, 'bench')
+            payload = json.dumps(event)
+            deliveries.append((payload.encode(), sign_payload(payload, secret, int(time.time()))))
+
+        started = time.perf_counter()
+        for payload, header in deliveries:
+            stripe_service.record_webhook_event(payload, header)
+        record_seconds = time.perf_counter() - started
+
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(None)
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count_query):
+            while stripe_service.process_stripe_events(limit=500)['processed']:
+                pass
+        process_seconds = time.perf_counter() - started
+        processed = StripeEvent.objects.filter(status=StripeEvent.Status.PROCESSED).count()
+
+        self.stdout.write(f'Recorded {count} event(s) in {record_seconds:.2f}s ({count / record_seconds:.0f}/s)')
+        self.stdout.write(
+            f'Applied {processed} event(s) in {process_seconds:.2f}s ({processed / process_seconds:.0f}/s, '
+            f'{len(queries) / max(processed, 1):.1f} queries/event)'
+        )
+        self.stdout.write(self.style.SUCCESS('✓ Benchmark complete; seeded data rolled back'))
@@ -0,0 +1,94 @@
+"""
+Django management command to benchmark unique username generation.
+
+Seeds --collisions users named like a common email prefix (john, john1,
+john2, ...). Then it times the social account adapter's set-based generator
+(one query, suffix picked in memory) against the previous approach, which ran
+one exists() query per candidate suffix and gave up after 1000. Everything
+runs inside a transaction that is rolled back at the end.
+
+Usage:
+    python manage.py benchmark_username_generation
+    python manage.py benchmark_username_generation --collisions 50000 --base alex
+"""
+
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from apps.users.adapters import SocialAccountAdapter
+from apps.users.models import User
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark data"""
+
+
+def per_candidate_username(base_username):
+    """The previous generator: one exists() query per candidate, up to 1000"""
+    username = base_username
+    counter = 1
+    while User.objects.filter(username=username).exists():
+        username = f"{base_username}{counter}"
+        counter += 1
+        if counter > 1000:
+            return None
+    return username
+
+
+class Command(BaseCommand):
+    help = 'Benchmark username generation against many colliding usernames'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--collisions',
+            type=int,
+            default=10_000,
+            help='Number of existing usernames sharing the base (default: 10000)',
+        )
+        parser.add_argument('--base', default='john', help='Colliding base username (default: john)')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per insert while seeding (default: 5000)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._seed(options['base'], options['collisions'], options['batch_size'])
+                self._run(options['base'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _seed(self, base, count, batch_size):
+        started = time.perf_counter()
+        names = [base] + [f'{base}{n}' for n in range(1, count)]
+        existing = set(User.objects.filter(username__in=names).values_list('username', flat=True))
+        User.objects.bulk_create(
+            (User(username=name, password='!') for name in names if name not in existing),
+            batch_size=batch_size,
+        )
+        self.stdout.write(f'Seeded {count} colliding username(s) in {time.perf_counter() - started:.1f}s')
+
+    def _run(self, base):
+        adapter = SocialAccountAdapter()
+        for label, generate in (
+            ('Set-based', adapter._generate_unique_username),
+            ('Per-candidate', per_candidate_username),
+        ):
+            queries = []
+
+            def count_query(execute, sql, params, many, context):
+                queries.append(None)
+                return execute(sql, params, many, context)
+
+            started = time.perf_counter()
+            with connection.execute_wrapper(count_query):
+                username = generate(base)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{label}: {username or "gave up"} in {elapsed * 1000:.1f}ms with {len(queries)} queries'
+            )
+        self.stdout.write(self.style.SUCCESS('✓ Benchmark complete; seeded data rolled back'))
@@ -0,0 +1,49 @@
+"""
+Django management command to downgrade lapsed subscriptions.
+
+A subscription whose current_period_end passed without a renewal or deletion
+webhook would otherwise stay premium. Each sweep is a single UPDATE, so it is
+cheap and safe to schedule on every node (e.g. cron every 15 minutes), or to
+keep running in-process with --loop.
+
+Usage:
+    python manage.py expire_subscriptions
+    python manage.py expire_subscriptions --loop --interval 900
+"""
+
+import logging
+import time
+from django.core.management.base import BaseCommand
+from apps.users import stripe_service
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Downgrade active subscriptions whose billing period has lapsed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep sweeping every --interval seconds instead of exiting',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=900,
+            help='Seconds between sweeps with --loop (default: 900)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            expired = stripe_service.expire_lapsed_subscriptions()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            logger.info('Subscription expiry sweep downgraded %d row(s) in %.1fms', expired, elapsed_ms)
+            self.stdout.write(self.style.SUCCESS(
+                f'✓ Downgraded {expired} lapsed subscription(s) in {elapsed_ms:.1f}ms'
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
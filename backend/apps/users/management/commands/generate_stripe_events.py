@@ -0,0 +1,133 @@
+"""
+Django management command to generate fake, correctly signed Stripe webhook events.
+
+Used to load-test webhook ingestion and the process_stripe_events worker
+locally, without a Stripe account. Events are signed with STRIPE_WEBHOOK_SECRET
+(or --secret) exactly as Stripe signs them. A share of them are sent twice to
+exercise redelivery deduplication.
+
+By default events are recorded in-process (signature check + insert). With
+--url they are POSTed to a running server's webhook endpoint instead. --seed
+creates a local user and Subscription for every fake customer, so the worker
+has real rows to update.
+
+Usage:
+    python manage.py generate_stripe_events --count 5000 --customers 200 --seed
+    python manage.py generate_stripe_events --url http://localhost:8000/api/users/webhook
+"""
+
+import hashlib
+import hmac
+import json
+import random
+import time
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from apps.users.models import Subscription, User
+from apps.users import stripe_service
+
+
+def fake_subscription_event(event_number, customer_number, created, prefix='fake'):
+    """Build a customer.subscription.* event payload for a fake customer"""
+    event_type = 'customer.subscription.deleted' if random.random() < 0.05 else 'customer.subscription.updated'
+    interval = random.choice(['month', 'year'])
+    return {
+        'id': f'evt_fake_{event_number}_{random.getrandbits(32):08x}',
+        'object': 'event',
+        'type': event_type,
+        'created': created,
+        'data': {'object': {
+            'id': f'sub_{prefix}_{customer_number}',
+            'object': 'subscription',
+            'customer': f'cus_{prefix}_{customer_number}',
+            'status': random.choice(['active', 'active', 'active', 'past_due']),
+            'current_period_start': created,
+            'current_period_end': created + (365 if interval == 'year' else 30) * 86400,
+            'items': {'data': [{'price': {'recurring': {'interval': interval}}}]},
+        }},
+    }
+
+
+def sign_payload(payload, secret, timestamp):
+    """Return a Stripe-Signature header value for the payload"""
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+class Command(BaseCommand):
+    help = 'Generate signed fake Stripe webhook events for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help='Number of events (default: 1000)')
+        parser.add_argument('--customers', type=int, default=50, help='Number of fake customers (default: 50)')
+        parser.add_argument(
+            '--duplicate-rate',
+            type=float,
+            default=0.1,
+            help='Share of events delivered twice (default: 0.1)',
+        )
+        parser.add_argument('--url', help='POST events to this webhook URL instead of recording them in-process')
+        parser.add_argument('--secret', help='Webhook signing secret (default: STRIPE_WEBHOOK_SECRET)')
+        parser.add_argument(
+            '--seed',
+            action='store_true',
+            help='Create a user and premium Subscription for every fake customer',
+        )
+
+    def handle(self, *args, **options):
+        secret = options['secret'] or settings.STRIPE_WEBHOOK_SECRET
+        if not secret:
+            raise CommandError('Set STRIPE_WEBHOOK_SECRET or pass --secret')
+        if not options['url'] and secret != settings.STRIPE_WEBHOOK_SECRET:
+            raise CommandError('--secret must match STRIPE_WEBHOOK_SECRET when recording in-process')
+
+        if options['seed']:
+            self._seed_customers(options['customers'])
+
+        session = requests.Session() if options['url'] else None
+        base_time = int(time.time()) - options['count']
+        sent = duplicates = errors = 0
+        started = time.perf_counter()
+
+        for number in range(options['count']):
+            event = fake_subscription_event(number, random.randrange(options['customers']), base_time + number)
+            payload = json.dumps(event)
+            deliveries = 2 if random.random() < options['duplicate_rate'] else 1
+            for _ in range(deliveries):
+                header = sign_payload(payload, secret, int(time.time()))
+                try:
+                    if session is not None:
+                        response = session.post(options['url'], data=payload, timeout=10, headers={
+                            'Content-Type': 'application/json', 'Stripe-Signature': header,
+                        })
+                        response.raise_for_status()
+                        created = not response.json().get('duplicate')
+                    else:
+                        _, created = stripe_service.record_webhook_event(payload.encode(), header)
+                except (requests.RequestException, ValueError) as e:
+                    errors += 1
+                    self.stderr.write(f'{event["id"]}: {e}')
+                    continue
+                sent += 1
+                duplicates += not created
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Delivered {sent} event(s) ({duplicates} duplicate, {errors} error(s)) '
+            f'in {elapsed:.2f}s, {sent / elapsed if elapsed else 0:.0f}/s'
+        ))
+
+    def _seed_customers(self, count):
+        for number in range(count):
+            user, _ = User.objects.get_or_create(
+                username=f'stripe_load_{number}',
+                defaults={'email': f'stripe_load_{number}@example.com'},
+            )
+            Subscription.objects.update_or_create(user=user, defaults={
+                'tier': Subscription.Tier.PREMIUM,
+                'status': Subscription.Status.ACTIVE,
+                'stripe_customer_id': f'cus_fake_{number}',
+                'stripe_subscription_id': f'sub_fake_{number}',
+            })
+        self.stdout.write(f'Seeded {count} fake customer(s)')
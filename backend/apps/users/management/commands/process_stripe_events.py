@@ -0,0 +1,64 @@
+"""
+Django management command to apply stored Stripe webhook events.
+
+The webhook endpoint only verifies and stores events, so it can acknowledge
+Stripe immediately. This worker applies them to Subscription records, oldest
+first and in order per customer. Several workers may run at once; a customer's
+events are serialized on its Subscription row lock. Failed attempts back off
+(STRIPE_EVENT_RETRY_SECONDS, doubling) before the event is picked up again.
+
+Usage:
+    python manage.py process_stripe_events
+    python manage.py process_stripe_events --loop --interval 2
+"""
+
+import time
+from django.core.management.base import BaseCommand
+from apps.users import stripe_service
+
+
+class Command(BaseCommand):
+    help = 'Apply pending Stripe webhook events'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Maximum number of customers handled per batch (default: 100)',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep polling for new events instead of exiting when none are pending',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=1.0,
+            help='Seconds to sleep between polls with --loop unless a full batch was handled (default: 1)',
+        )
+
+    def handle(self, *args, **options):
+        totals = {'processed': 0, 'retrying': 0, 'failed': 0}
+        while True:
+            counts = stripe_service.process_stripe_events(limit=options['batch_size'])
+            for outcome, count in counts.items():
+                totals[outcome] += count
+            handled = counts['processed'] + counts['failed']
+            if handled or counts['retrying']:
+                self.stdout.write(
+                    f"Processed {counts['processed']}, retrying {counts['retrying']}, failed {counts['failed']}"
+                )
+            if not options['loop']:
+                if not handled:
+                    break
+                continue
+            # Only a full batch suggests more events are already due; otherwise
+            # wait, so a failing event or an open Stripe circuit isn't polled hot
+            if handled < options['batch_size']:
+                time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Processed {totals['processed']} event(s), {totals['failed']} failed"
+        ))
@@ -0,0 +1,45 @@
+"""
+Django management command to delete expired Idempotency-Key records.
+
+Stored responses are only replayed for IDEMPOTENCY_KEY_TTL_HOURS; after that a
+retry is treated as a new request, so older records can be removed. Run it
+periodically (e.g. hourly) to keep the table small.
+
+Usage:
+    python manage.py purge_idempotency_keys
+    python manage.py purge_idempotency_keys --chunk-size 5000
+"""
+
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from apps.users.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete Idempotency-Key records older than the replay window'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of records deleted per query (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+        expired = IdempotencyKey.objects.filter(created_at__lt=cutoff)
+
+        purged_count = 0
+        while True:
+            ids = list(expired.values_list('pk', flat=True)[:options['chunk_size']])
+            if not ids:
+                break
+            deleted, _ = IdempotencyKey.objects.filter(pk__in=ids).delete()
+            purged_count += deleted
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Purged {purged_count} idempotency key(s) older than {cutoff:%Y-%m-%d %H:%M}'
+        ))
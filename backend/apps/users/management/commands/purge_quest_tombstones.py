@@ -0,0 +1,45 @@
+"""
+Django management command to delete expired QuestProgress tombstones.
+
+Tombstones only need to outlive the sync cursors that could still ask for them.
+Cursors older than QUEST_TOMBSTONE_RETENTION_DAYS are rejected with 410 Gone
+(forcing a full sync), so tombstones past that age can be removed.
+
+Usage:
+    python manage.py purge_quest_tombstones
+    python manage.py purge_quest_tombstones --chunk-size 5000
+"""
+
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from apps.users.models import QuestProgressTombstone
+
+
+class Command(BaseCommand):
+    help = 'Delete QuestProgress tombstones older than the retention window'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of tombstones deleted per query (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=settings.QUEST_TOMBSTONE_RETENTION_DAYS)
+        expired = QuestProgressTombstone.objects.filter(deleted_at__lt=cutoff)
+
+        purged_count = 0
+        while True:
+            ids = list(expired.values_list('pk', flat=True)[:options['chunk_size']])
+            if not ids:
+                break
+            deleted, _ = QuestProgressTombstone.objects.filter(pk__in=ids).delete()
+            purged_count += deleted
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Purged {purged_count} tombstone(s) older than {cutoff:%Y-%m-%d}'
+        ))
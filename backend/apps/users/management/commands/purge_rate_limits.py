@@ -0,0 +1,41 @@
+"""
+Django management command to delete idle rate limiter buckets.
+
+A bucket whose theoretical arrival time has passed is fully refilled, which is
+the same as having no row at all, so it can be removed. Run it periodically
+(e.g. hourly) to keep the table small.
+
+Usage:
+    python manage.py purge_rate_limits
+    python manage.py purge_rate_limits --chunk-size 5000
+"""
+
+import time
+from django.core.management.base import BaseCommand
+from apps.users.models import RateLimitBucket
+
+
+class Command(BaseCommand):
+    help = 'Delete rate limiter buckets that have fully refilled'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of buckets deleted per query (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        idle = RateLimitBucket.objects.filter(tat__lt=time.time())
+
+        purged_count = 0
+        while True:
+            ids = list(idle.order_by('tat').values_list('pk', flat=True)[:options['chunk_size']])
+            if not ids:
+                break
+            # Re-check, in case a client came back since the bucket was selected
+            deleted, _ = idle.filter(pk__in=ids).delete()
+            purged_count += deleted
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Purged {purged_count} idle rate limit bucket(s)'))
@@ -0,0 +1,42 @@
+"""
+Django management command to delete expired sessions.
+
+Like Django's clearsessions, but deletes in chunks walked along the
+expire_date index, so a large backlog never turns into one long-running
+DELETE that locks django_session. Run it periodically (e.g. daily).
+
+Usage:
+    python manage.py purge_sessions
+    python manage.py purge_sessions --chunk-size 5000
+"""
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of sessions deleted per query (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = Session.objects.filter(expire_date__lt=now)
+
+        purged_count = 0
+        while True:
+            keys = list(expired.order_by('expire_date').values_list('pk', flat=True)[:options['chunk_size']])
+            if not keys:
+                break
+            # Re-check expiry, in case a session was refreshed since it was selected
+            deleted, _ = expired.filter(pk__in=keys).delete()
+            purged_count += deleted
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Purged {purged_count} expired session(s)'))
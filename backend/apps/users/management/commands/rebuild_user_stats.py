@@ -0,0 +1,59 @@
+"""
+Django management command to rebuild the denormalized UserStats table.
+
+UserStats is maintained incrementally on every QuestProgress write. This command
+recomputes it from the full QuestProgress history, e.g. after a deploy that
+introduces the table, a manual data fix, or to repair drift. Users are processed
+in chunks; each chunk costs a fixed number of queries regardless of its size.
+
+Usage:
+    python manage.py rebuild_user_stats
+    python manage.py rebuild_user_stats --user alice --user bob
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from apps.users.models import User
+from apps.users import services
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-user quest statistics from QuestProgress history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            action='append',
+            dest='usernames',
+            default=[],
+            help='Only rebuild stats for this username (can be repeated)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of users rebuilt per batch (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f'Unknown user(s): {", ".join(sorted(missing))}')
+
+        rebuilt_count = 0
+        last_pk = 0
+        while True:
+            user_ids = list(users.filter(pk__gt=last_pk).values_list('pk', flat=True)[:options['chunk_size']])
+            if not user_ids:
+                break
+            with transaction.atomic():
+                services.bulk_rebuild_user_stats(user_ids)
+            rebuilt_count += len(user_ids)
+            last_pk = user_ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Rebuilt stats for {rebuilt_count} user(s)'
+        ))
@@ -0,0 +1,89 @@
+"""
+Django management command to reconcile local subscriptions with Stripe.
+
+Webhooks can be missed (downtime, expired endpoint secret, events older than
+Stripe's retry window). This command pages through every subscription in
+Stripe and repairs the matching Subscription rows in batches, one page at a
+time, so memory stays bounded however many customers there are.
+
+With --checkpoint, the last Stripe subscription ID of each committed page is
+saved to a file; rerunning with the same file resumes after it. The file is
+removed once the run completes. --api-base points the Stripe client at another
+server, such as a local stand-in for testing.
+
+Usage:
+    python manage.py reconcile_subscriptions
+    python manage.py reconcile_subscriptions --checkpoint /tmp/reconcile.json
+    python manage.py reconcile_subscriptions --dry-run --api-base http://localhost:12111
+"""
+
+import json
+import os
+import stripe
+from django.core.management.base import BaseCommand, CommandError
+from apps.users import stripe_service
+
+
+class Command(BaseCommand):
+    help = 'Repair Subscription rows from Stripe\'s subscription list'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=100,
+            help='Subscriptions fetched and reconciled per batch, at most 100 (default: 100)',
+        )
+        parser.add_argument('--checkpoint', help='File used to save progress and resume an interrupted run')
+        parser.add_argument('--api-base', help='Stripe API base URL (default: Stripe\'s live API)')
+        parser.add_argument('--dry-run', action='store_true', help='Report changes without saving them')
+
+    def handle(self, *args, **options):
+        if not 1 <= options['page_size'] <= 100:
+            raise CommandError('--page-size must be between 1 and 100')
+        if options['api_base']:
+            stripe.api_base = options['api_base']
+
+        checkpoint = options['checkpoint']
+        state = {'starting_after': None, 'seen': 0, 'changed': 0}
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state.update(json.load(f))
+            self.stdout.write(f"Resuming after {state['starting_after']} ({state['seen']} already checked)")
+
+        while True:
+            params = {'limit': options['page_size'], 'status': 'all'}
+            if state['starting_after']:
+                params['starting_after'] = state['starting_after']
+            try:
+                page = stripe.Subscription.list(**params)
+            except stripe.error.StripeError as e:
+                raise CommandError(f'Stripe request failed after {state["seen"]} subscription(s): {e}')
+
+            batch = [subscription.to_dict() for subscription in page.data]
+            changed = stripe_service.reconcile_subscription_batch(batch, dry_run=options['dry_run'])
+            for row in changed:
+                self.stdout.write(f'  {row.stripe_customer_id}: {row.tier}/{row.status} ({row.stripe_subscription_id})')
+
+            state['seen'] += len(batch)
+            state['changed'] += len(changed)
+            if batch:
+                state['starting_after'] = batch[-1]['id']
+                if checkpoint and not options['dry_run']:
+                    self._save_checkpoint(checkpoint, state)
+            if not page.has_more:
+                break
+
+        if checkpoint and os.path.exists(checkpoint) and not options['dry_run']:
+            os.remove(checkpoint)
+        verb = 'Would update' if options['dry_run'] else 'Updated'
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Checked {state['seen']} Stripe subscription(s). {verb} {state['changed']} local row(s)"
+        ))
+
+    def _save_checkpoint(self, path, state):
+        # Write then rename, so an interrupted write never leaves a corrupt file
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+        os.replace(temporary, path)
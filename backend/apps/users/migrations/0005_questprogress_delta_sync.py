@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_userstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestProgressTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['deleted_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='questprogress',
+            index=models.Index(fields=['user', 'updated_at'], name='users_quest_user_id_2a088e_idx'),
+        ),
+        migrations.AddField(
+            model_name='questprogresstombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quest_tombstones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='questprogresstombstone',
+            index=models.Index(fields=['user', 'deleted_at'], name='users_quest_user_id_b8019c_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:30
+
+from django.db import migrations, models
+from django.db.models import Case, IntegerField, Value, When
+
+
+def backfill_completion_mask(apps, schema_editor):
+    QuestProgress = apps.get_model('users', 'QuestProgress')
+
+    def bit(field, value):
+        return Case(When(**{field: True}, then=Value(value)), default=Value(0), output_field=IntegerField())
+
+    QuestProgress.objects.update(
+        completion_mask=bit('quest_1_completed', 1) + bit('quest_2_completed', 2) + bit('quest_3_completed', 4)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_questprogress_delta_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questprogress',
+            name='completion_mask',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_completion_mask, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='questprogress',
+            index=models.Index(condition=models.Q(('completion_mask', 7)), fields=['user', 'date'], name='users_questprogress_full_days'),
+        ),
+    ]
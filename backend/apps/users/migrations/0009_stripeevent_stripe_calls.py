@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_stripeevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripeevent',
+            name='stripe_calls',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
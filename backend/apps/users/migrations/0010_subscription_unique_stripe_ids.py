@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:41
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def clear_blank_and_duplicate_ids(apps, schema_editor):
+    """Blank IDs become NULL; a duplicated ID stays only on the most recently updated row"""
+    Subscription = apps.get_model('users', 'Subscription')
+    for field in ('stripe_customer_id', 'stripe_subscription_id'):
+        Subscription.objects.filter(**{field: ''}).update(**{field: None})
+        duplicated = (
+            Subscription.objects.exclude(**{f'{field}__isnull': True})
+            .values(field).annotate(rows=Count('id')).filter(rows__gt=1).values_list(field, flat=True)
+        )
+        for value in list(duplicated):
+            keep = Subscription.objects.filter(**{field: value}).order_by('-updated_at', '-id').first()
+            Subscription.objects.filter(**{field: value}).exclude(pk=keep.pk).update(**{field: None})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_stripeevent_stripe_calls'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_blank_and_duplicate_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='subscription',
+            name='stripe_customer_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='subscription',
+            name='stripe_subscription_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
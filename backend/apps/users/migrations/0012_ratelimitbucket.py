@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_subscription_expiry_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('tat', models.FloatField()),
+                ('allowed', models.BooleanField(default=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tat'], name='users_ratel_tat_2f1600_idx')],
+            },
+        ),
+    ]
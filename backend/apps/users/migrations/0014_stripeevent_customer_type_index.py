@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_user_lower_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stripeevent',
+            index=models.Index(fields=['customer_id', 'type', 'created'], name='users_strip_custome_61ecd9_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:40
+
+from django.db import migrations
+
+INDEX_NAME = 'users_user_username_lower_like_idx'
+
+
+def create_pattern_index(apps, schema_editor):
+    # Under a non-C collation PostgreSQL can only serve lower(username) LIKE 'prefix%'
+    # from a text_pattern_ops index; other databases use the plain lower() index.
+    # Like the _like indexes Django adds for CharFields, it stays out of the model state.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(apps.get_model('users', 'User')._meta.db_table)
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {schema_editor.quote_name(INDEX_NAME)} '
+        f'ON {table} (LOWER("username") text_pattern_ops)'
+    )
+
+
+def drop_pattern_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(INDEX_NAME)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_stripeevent_customer_type_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_pattern_index, drop_pattern_index),
+    ]
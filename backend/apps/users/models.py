@@ -1,10 +1,198 @@
+from collections import namedtuple
+from datetime import date, timedelta
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import connections, models
+from django.db.models.sql import UpdateQuery
+from django.db.models.functions import Coalesce, Lower
+from django.db.utils import NotSupportedError
+from django.utils import timezone
 
 
 class User(AbstractUser):
     """Custom user model"""
-    pass
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Case-insensitive login and password reset lookups (see backends.py)
+            models.Index(Lower('username'), name='users_user_username_lower_idx'),
+            models.Index(Lower('email'), name='users_user_email_lower_idx'),
+        ]
+
+
+StreakSummary = namedtuple(
+    'StreakSummary',
+    ['current_streak', 'streak_start_date', 'last_completed_date', 'longest_streak'],
+)
+
+# Day number of a date, per database vendor. Subtracting ROW_NUMBER() over the
+# ordered completed days yields a constant for every run of consecutive days
+# (the "gaps and islands" technique), so each run becomes one GROUP BY bucket.
+STREAK_ISLAND_EXPRESSIONS = {
+    'postgresql': 'day - CAST(ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY day) AS integer)',
+    'sqlite': 'CAST(julianday(day) AS integer) - ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY day)',
+}
+
+STREAK_SQL = """
+WITH completed (user_id, day) AS ({completed_sql}),
+islands AS (
+    SELECT user_id, day, {island_expression} AS island
+    FROM completed
+),
+runs AS (
+    SELECT user_id, MIN(day) AS start_day, MAX(day) AS end_day, COUNT(*) AS length
+    FROM islands
+    GROUP BY user_id, island
+),
+ranked AS (
+    SELECT user_id, start_day, end_day, length,
+           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY end_day DESC) AS recency,
+           MAX(length) OVER (PARTITION BY user_id) AS longest
+    FROM runs
+)
+SELECT user_id, length, start_day, end_day, longest
+FROM ranked
+WHERE recency = 1
+"""
+
+
+def _as_date(value):
+    # SQLite hands back aggregated dates as ISO strings
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+FULL_COMPLETION_MASK = 0b111
+
+# Aggregates over completion_mask: bit n is set when quest n + 1 is completed
+COMPLETION_AGGREGATES = {
+    'days': models.Count('id'),
+    'full_days': models.Count('id', filter=models.Q(completion_mask=FULL_COMPLETION_MASK)),
+    'xp': Coalesce(models.Sum(
+        models.F('completion_mask').bitand(1)
+        + models.F('completion_mask').bitand(2) / 2
+        + models.F('completion_mask').bitand(4) / 4
+    ), 0),
+}
+
+
+class QuestProgressQuerySet(models.QuerySet):
+
+    def fully_completed(self):
+        return self.filter(completion_mask=FULL_COMPLETION_MASK)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Keep completion_mask in sync for rows that bypass save()"""
+        objs = list(objs)
+        for obj in objs:
+            obj.completion_mask = obj.compute_completion_mask()
+        update_fields = kwargs.get('update_fields')
+        if update_fields and set(update_fields) & set(QuestProgress.COMPLETED_FIELDS):
+            kwargs['update_fields'] = [*update_fields, 'completion_mask']
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def update(self, **kwargs):
+        """Recompute completion_mask in the same UPDATE when completion flags change"""
+        completed_fields = QuestProgress.COMPLETED_FIELDS
+        if 'completion_mask' not in kwargs and set(kwargs) & set(completed_fields):
+            bits = []
+            for bit, field in enumerate(completed_fields):
+                value = kwargs.get(field, models.F(field))
+                if isinstance(value, bool):
+                    bits.append(models.Value(value << bit))
+                else:
+                    # SET expressions see the old row, so unchanged flags read their column
+                    bits.append(models.Case(
+                        models.When(models.ExpressionWrapper(value, output_field=models.BooleanField()),
+                                    then=models.Value(1 << bit)),
+                        default=models.Value(0),
+                    ))
+            kwargs['completion_mask'] = sum(bits[1:], bits[0])
+        return super().update(**kwargs)
+
+    def update_returning(self, **kwargs):
+        """
+        Like update(), but return the updated rows via UPDATE ... RETURNING.
+
+        Filtering on the current state turns a check-then-save into one statement
+        that reports whether the transition happened, so concurrent requests
+        cannot both pass the check. updated_at is stamped since update() skips
+        auto_now.
+        """
+        query = self.query.chain(UpdateQuery)
+        query.add_update_values({'updated_at': timezone.now(), **kwargs})
+        update_sql, params = query.get_compiler(self.db).as_sql()
+        return list(self.model._base_manager.db_manager(self.db).raw(f'{update_sql} RETURNING *', params))
+
+    def upsert_day(self, user, day, values):
+        """
+        Write one day of progress with a single INSERT ... ON CONFLICT statement.
+
+        Only the columns named in `values` are written to an existing row, so
+        concurrent clients saving different quests never clobber each other, and a
+        submitted day is left untouched. completion_mask is recomputed in the same
+        statement from the merged flags. Returns the stored row, or None when the
+        day exists and has already been submitted.
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        meta = self.model._meta
+        now = timezone.now()
+
+        row = self.model(user=user, date=day, created_at=now, updated_at=now, **values)
+        row.completion_mask = row.compute_completion_mask()
+        fields = [field for field in meta.concrete_fields if not field.primary_key]
+        params = [field.get_db_prep_save(getattr(row, field.attname), connection) for field in fields]
+
+        assignments = [
+            f'{qn(column)} = EXCLUDED.{qn(column)}'
+            for column in [meta.get_field(name).column for name in values] + ['updated_at']
+        ]
+        if set(values) & set(self.model.COMPLETED_FIELDS):
+            # Flags missing from the payload keep their stored value
+            bits = [
+                f'CASE WHEN {"EXCLUDED" if field in values else qn(meta.db_table)}.{qn(field)} '
+                f'THEN {1 << bit} ELSE 0 END'
+                for bit, field in enumerate(self.model.COMPLETED_FIELDS)
+            ]
+            assignments.append(f'{qn("completion_mask")} = {" + ".join(bits)}')
+
+        sql = (
+            f'INSERT INTO {qn(meta.db_table)} ({", ".join(qn(field.column) for field in fields)}) '
+            f'VALUES ({", ".join(["%s"] * len(fields))}) '
+            f'ON CONFLICT ({qn("user_id")}, {qn("date")}) DO UPDATE SET {", ".join(assignments)} '
+            f'WHERE NOT {qn(meta.db_table)}.{qn("submitted")} '
+            f'RETURNING *'
+        )
+        return next(iter(self.raw(sql, params)), None)
+
+    def completion_totals(self):
+        """Return {'days', 'full_days', 'xp'} for the rows in this queryset"""
+        return self.order_by().aggregate(**COMPLETION_AGGREGATES)
+
+    def streaks(self):
+        """
+        Compute streaks in the database for every user in this queryset.
+
+        Returns {user_id: StreakSummary} where the current streak is the most recent
+        run of consecutive fully completed days, and longest_streak is the longest
+        run ever. Users without a completed day are absent from the result. Works on
+        a single user (filter(user=...)) or in bulk over many users.
+        """
+        vendor = connections[self.db].vendor
+        if vendor not in STREAK_ISLAND_EXPRESSIONS:
+            raise NotSupportedError(f'Streak computation is not supported on {vendor}')
+
+        completed_sql, params = self.fully_completed().order_by().values('user_id', 'date').query.sql_with_params()
+        sql = STREAK_SQL.format(
+            completed_sql=completed_sql,
+            island_expression=STREAK_ISLAND_EXPRESSIONS[vendor],
+        )
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return {
+                user_id: StreakSummary(length, _as_date(start_day), _as_date(end_day), longest)
+                for user_id, length, start_day, end_day, longest in cursor.fetchall()
+            }
 
 
 class QuestProgress(models.Model):
@@ -17,6 +205,8 @@ class QuestProgress(models.Model):
     quest_1_completed = models.BooleanField(default=False)
     quest_2_completed = models.BooleanField(default=False)
     quest_3_completed = models.BooleanField(default=False)
+    # Bit n set when quest n + 1 is completed; kept in sync by save() and bulk writers
+    completion_mask = models.PositiveSmallIntegerField(default=0, editable=False)
     submitted = models.BooleanField(default=False)
     submitted_at = models.DateTimeField(null=True, blank=True)
     choices_locked = models.BooleanField(default=False)
@@ -24,16 +214,121 @@ class QuestProgress(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = QuestProgressQuerySet.as_manager()
+
     class Meta:
         unique_together = ['user', 'date']
         ordering = ['-date']
         indexes = [
             models.Index(fields=['user', 'date']),
+            # Delta sync scans a user's rows changed after a cursor
+            models.Index(fields=['user', 'updated_at']),
+            # Streaks only ever look at fully completed days
+            models.Index(
+                fields=['user', 'date'],
+                condition=models.Q(completion_mask=FULL_COMPLETION_MASK),
+                name='users_questprogress_full_days',
+            ),
         ]
 
     def __str__(self):
         return f"{self.user.username} - {self.date}"
 
+    COMPLETED_FIELDS = ('quest_1_completed', 'quest_2_completed', 'quest_3_completed')
+
+    def compute_completion_mask(self):
+        return sum(1 << bit for bit, field in enumerate(self.COMPLETED_FIELDS) if getattr(self, field))
+
+    def save(self, *args, **kwargs):
+        self.completion_mask = self.compute_completion_mask()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and set(update_fields) & set(self.COMPLETED_FIELDS):
+            kwargs['update_fields'] = {*update_fields, 'completion_mask'}
+        super().save(*args, **kwargs)
+
+
+class QuestProgressTombstone(models.Model):
+    """Records a deleted QuestProgress day so delta sync can report it"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quest_tombstones')
+    date = models.DateField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['deleted_at', 'id']
+        indexes = [
+            models.Index(fields=['user', 'deleted_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.date} (deleted)"
+
+
+class IdempotencyKey(models.Model):
+    """Stored outcome of a mutating request, replayed when the client retries it"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    # SHA-256 of method, path and body; a reused key with a different request is rejected
+    request_hash = models.CharField(max_length=64)
+    # Null while the original request is still being processed
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['user', 'key']
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.key}"
+
+
+class RateLimitBucket(models.Model):
+    """
+    Shared rate limiter state for one scope and client (see throttling.py).
+
+    `tat` is the GCRA theoretical arrival time as a Unix timestamp: the client
+    is within its limit while tat is no further in the future than the burst
+    allows. `allowed` records the outcome of the latest request.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    tat = models.FloatField()
+    allowed = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            # purge_rate_limits deletes buckets whose tat has passed
+            models.Index(fields=['tat']),
+        ]
+
+    def __str__(self):
+        return self.key
+
+
+class UserStats(models.Model):
+    """Denormalized per-user quest statistics, maintained on every QuestProgress write"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total_xp = models.PositiveIntegerField(default=0)
+    # Length of the most recent run of fully completed days, ending on last_completed_date
+    current_streak = models.PositiveIntegerField(default=0)
+    streak_start_date = models.DateField(null=True, blank=True)
+    longest_streak = models.PositiveIntegerField(default=0)
+    last_completed_date = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'user stats'
+
+    def __str__(self):
+        return f"{self.user.username} - {self.total_xp} XP"
+
+    def streak_as_of(self, today):
+        """Return the current streak, which only counts if the run reaches today"""
+        if self.last_completed_date == today:
+            return self.current_streak
+        return 0
+
 
 class Subscription(models.Model):
     """User subscription for premium features"""
@@ -61,17 +356,73 @@ class Subscription(models.Model):
         blank=True
     )
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.ACTIVE)
-    stripe_customer_id = models.CharField(max_length=255, blank=True, null=True)
-    stripe_subscription_id = models.CharField(max_length=255, blank=True, null=True)
+    # Unique (NULL when unset) so webhook lookups are index probes
+    stripe_customer_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
+    stripe_subscription_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
     current_period_start = models.DateTimeField(null=True, blank=True)
     current_period_end = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # The expiry sweep looks for active rows whose period has ended
+            models.Index(fields=['status', 'current_period_end']),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.tier}"
 
     @property
     def is_premium(self):
-        return self.tier == self.Tier.PREMIUM and self.status == self.Status.ACTIVE
+        return has_premium_access(self.tier, self.status, self.current_period_end)
+
+
+def expiry_cutoff():
+    """Active subscriptions whose period ended before this are treated as lapsed"""
+    return timezone.now() - timedelta(hours=settings.SUBSCRIPTION_EXPIRY_GRACE_HOURS)
+
+
+def has_premium_access(tier, status, current_period_end):
+    """Whether a subscription in this state grants premium features"""
+    if tier != Subscription.Tier.PREMIUM or status != Subscription.Status.ACTIVE:
+        return False
+    # Lapsed but not swept yet (see expire_subscriptions)
+    return current_period_end is None or current_period_end > expiry_cutoff()
 
+
+class StripeEvent(models.Model):
+    """A verified Stripe webhook event, stored on receipt and applied by process_stripe_events"""
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        PROCESSED = 'processed', 'Processed'
+        FAILED = 'failed', 'Failed'
+
+    # Stripe's evt_... ID; redelivered events collide here and are dropped
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    customer_id = models.CharField(max_length=255, blank=True, default='')
+    # When Stripe created the event; events are applied in this order per customer
+    created = models.DateTimeField()
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # Outbound Stripe API requests made while applying the event, across attempts
+    stripe_calls = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    # A failed attempt backs off until this time before the event is retried
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created', 'id']
+        indexes = [
+            models.Index(fields=['status', 'customer_id', 'created']),
+            # A customer's latest subscription event, looked up on checkout completion
+            models.Index(fields=['customer_id', 'type', 'created']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_id} ({self.type})"
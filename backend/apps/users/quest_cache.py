@@ -0,0 +1,86 @@
+"""
+Versioned per-user response cache for the quest read endpoints.
+
+Every user has a data version stored in the cache. Cached responses are keyed
+by (user, version, endpoint, state, params), so bumping the version after any
+QuestProgress write makes all of that user's cached responses unreachable at
+once; they simply age out of the cache. Versions are random tokens rather than
+counters so that an evicted version key can never resurrect stale entries.
+
+The version only reaches processes that share the cache. With the default
+per-process LocMem cache, a write handled by another worker leaves this
+worker's version untouched, so responses are also keyed on `state`: the
+conditional GET ETag, which the view's validator has already computed from
+the database (see conditional.py). A write from any process changes it, and a
+cached response is never served for, or under the ETag of, newer data.
+"""
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+
+_MISSING = object()
+
+
+def _cache():
+    return caches[settings.QUEST_CACHE_ALIAS]
+
+
+def _version_key(user_id):
+    return f'quests:{user_id}:version'
+
+
+def get_data_version(user_id):
+    """Return the user's current data version, initializing it if absent"""
+    cache = _cache()
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, timeout=None):
+            # Another request initialized it first
+            version = cache.get(key, version)
+    return version
+
+
+def bump_data_version(user_id):
+    """Invalidate every cached quest response for the user"""
+    _cache().set(_version_key(user_id), uuid.uuid4().hex, timeout=None)
+
+
+def get_or_build(user_id, endpoint, build, *key_parts, state):
+    """
+    Return the cached response data for an endpoint, building it on a miss.
+
+    `state` identifies the database state the response reflects; views pass
+    request.etag, set by the @conditional decorator.
+
+    Only one request per key builds at a time (single flight): concurrent
+    misses wait briefly for the builder to populate the cache instead of all
+    hitting the database. If the builder is slow or dies, waiters fall back to
+    building the response themselves.
+    """
+    cache = _cache()
+    version = get_data_version(user_id)
+    key = ':'.join(['quests', str(user_id), version, endpoint, state, *map(str, key_parts)])
+
+    data = cache.get(key, _MISSING)
+    if data is not _MISSING:
+        return data
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, timeout=settings.QUEST_CACHE_LOCK_TIMEOUT):
+        try:
+            data = build()
+            cache.set(key, data, timeout=settings.QUEST_CACHE_TIMEOUT)
+        finally:
+            cache.delete(lock_key)
+        return data
+
+    deadline = time.monotonic() + settings.QUEST_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(settings.QUEST_CACHE_POLL_INTERVAL)
+        data = cache.get(key, _MISSING)
+        if data is not _MISSING:
+            return data
+    return build()
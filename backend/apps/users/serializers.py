@@ -1,7 +1,10 @@
+from datetime import date, timedelta
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 from .models import User, QuestProgress
+from . import hashing
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -26,7 +29,13 @@ class UserSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         # Remove password2 before creating user
         validated_data.pop('password2', None)
-        user = User.objects.create_user(**validated_data)
+        password = validated_data.pop('password')
+        user = User(**validated_data)
+        user.username = User.normalize_username(user.username)
+        user.email = User.objects.normalize_email(user.email)
+        # Hashed on the bounded pool rather than by create_user()
+        hashing.set_password(user, password)
+        user.save()
         return user
 
     def to_representation(self, instance):
@@ -48,22 +57,8 @@ class LoginSerializer(serializers.Serializer):
         password = attrs.get('password')
 
         if username_or_email and password:
-            user = None
-            
-            # Check if input looks like an email (contains @)
-            if '@' in username_or_email:
-                # Try to authenticate with email
-                try:
-                    user_obj = User.objects.get(email=username_or_email)
-                    # Authenticate using the username field (Django's authenticate expects username)
-                    user = authenticate(username=user_obj.username, password=password)
-                except User.DoesNotExist:
-                    # User with this email doesn't exist
-                    pass
-            else:
-                # Try to authenticate with username
-                user = authenticate(username=username_or_email, password=password)
-            
+            # UsernameOrEmailBackend resolves either, ignoring case, in one query
+            user = authenticate(self.context.get('request'), username=username_or_email, password=password)
             if not user:
                 raise serializers.ValidationError('Invalid credentials')
             if not user.is_active:
@@ -90,3 +85,44 @@ class QuestProgressSerializer(serializers.ModelSerializer):
         """Return True if all three quests are completed"""
         return obj.quest_1_completed and obj.quest_2_completed and obj.quest_3_completed
 
+
+
+class QuestSyncItemSerializer(serializers.Serializer):
+    """Validates one day of client-side quest history sent to bulk-sync"""
+    date = serializers.DateField()
+    quest_1_text = serializers.CharField(max_length=255, allow_blank=True, required=False)
+    quest_2_text = serializers.CharField(max_length=255, allow_blank=True, required=False)
+    quest_3_text = serializers.CharField(max_length=255, allow_blank=True, required=False)
+    quest_1_completed = serializers.BooleanField(required=False)
+    quest_2_completed = serializers.BooleanField(required=False)
+    quest_3_completed = serializers.BooleanField(required=False)
+
+
+class QuestHistoryQuerySerializer(serializers.Serializer):
+    """
+    Validates quests/history query parameters.
+
+    `from`/`to` bound the date window (defaulting to the heatmap's range ending
+    today, or context['default_days']), `cursor` is the last date of the previous
+    page and `limit` the page size.
+    """
+    to = serializers.DateField(required=False)
+    cursor = serializers.DateField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # "from" is a Python keyword, so it cannot be declared as a class attribute
+        fields['from'] = serializers.DateField(required=False)
+        return fields
+
+    def validate(self, attrs):
+        default_days = self.context.get('default_days', settings.QUEST_HISTORY_DEFAULT_DAYS)
+        attrs.setdefault('to', date.today())
+        attrs.setdefault('from', attrs['to'] - timedelta(days=default_days - 1))
+        attrs['limit'] = min(attrs.get('limit', settings.QUEST_HISTORY_PAGE_SIZE), settings.QUEST_HISTORY_PAGE_SIZE)
+        if attrs['from'] > attrs['to']:
+            raise serializers.ValidationError({'from': '"from" must not be after "to".'})
+        if 'max_days' in self.context and (attrs['to'] - attrs['from']).days >= self.context['max_days']:
+            raise serializers.ValidationError({'from': f'Window must not exceed {self.context["max_days"]} days.'})
+        return attrs
@@ -0,0 +1,323 @@
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import COMPLETION_AGGREGATES, QuestProgress, QuestProgressTombstone, UserStats
+from .serializers import QuestSyncItemSerializer
+from . import quest_cache
+
+QUEST_FIELDS = (
+    'quest_1_text', 'quest_2_text', 'quest_3_text',
+    'quest_1_completed', 'quest_2_completed', 'quest_3_completed',
+)
+
+
+def completion_flags(progress):
+    """Return the (quest_1, quest_2, quest_3) completion flags of a progress row"""
+    return (
+        bool(progress.quest_1_completed),
+        bool(progress.quest_2_completed),
+        bool(progress.quest_3_completed),
+    )
+
+
+def lock_user_stats(user):
+    """
+    Fetch and row-lock the user's stats, creating them from history if missing.
+
+    Must be called inside transaction.atomic(). Taking this lock before touching
+    QuestProgress serializes concurrent writers for the same user, so the deltas
+    applied by apply_progress_changes() never interleave.
+    """
+    stats, created = UserStats.objects.select_for_update().get_or_create(user=user)
+    if created:
+        _recompute_stats(stats)
+        stats.save()
+    return stats
+
+
+def apply_progress_changes(stats, changes):
+    """
+    Apply QuestProgress writes to a locked UserStats row and save it.
+
+    `changes` is an iterable of (date, old_flags, new_flags) tuples, where
+    old_flags is None for newly created rows. XP is always updated incrementally.
+    Streaks are extended in place when a day completes right after the current
+    run (the common "finished today" path); anything else, such as backfilling an
+    older day or un-completing one, falls back to recomputing the streaks.
+    """
+    needs_streak_rebuild = False
+
+    for progress_date, old_flags, new_flags in sorted(changes, key=lambda change: change[0]):
+        stats.total_xp += sum(new_flags) - (sum(old_flags) if old_flags else 0)
+
+        was_full = bool(old_flags) and all(old_flags)
+        is_full = all(new_flags)
+        if was_full == is_full or needs_streak_rebuild:
+            continue
+
+        if is_full and (stats.last_completed_date is None or progress_date > stats.last_completed_date):
+            if stats.last_completed_date == progress_date - timedelta(days=1):
+                stats.current_streak += 1
+            else:
+                stats.current_streak = 1
+                stats.streak_start_date = progress_date
+            stats.last_completed_date = progress_date
+            stats.longest_streak = max(stats.longest_streak, stats.current_streak)
+        else:
+            needs_streak_rebuild = True
+
+    if needs_streak_rebuild:
+        _recompute_streaks(stats)
+    stats.save()
+    return stats
+
+
+def save_day_progress(user, progress_date, values):
+    """
+    Create or partially update one day of progress, keeping stats in sync.
+
+    `values` holds only the quest fields the client sent. The write is a single
+    upsert (see QuestProgressQuerySet.upsert_day), so concurrent first saves of a
+    day never collide on the (user, date) constraint. Returns (progress, created);
+    a submitted day is returned unchanged.
+    """
+    with transaction.atomic():
+        stats = lock_user_stats(user)
+        current = QuestProgress.objects.filter(user=user, date=progress_date).first()
+        progress = QuestProgress.objects.upsert_day(user, progress_date, values)
+        if progress is None:
+            return current, False
+
+        old_flags = completion_flags(current) if current is not None else None
+        apply_progress_changes(stats, [(progress_date, old_flags, completion_flags(progress))])
+        # The raw upsert bypasses the post_save cache invalidation
+        transaction.on_commit(lambda: quest_cache.bump_data_version(user.pk))
+    return progress, current is None
+
+
+def validate_sync_item(item):
+    """Validate one bulk-sync item, returning (validated_data, rejection_reason)"""
+    if not isinstance(item, dict):
+        return None, 'Item must be an object'
+    serializer = QuestSyncItemSerializer(data=item)
+    if not serializer.is_valid():
+        field, errors = next(iter(serializer.errors.items()))
+        return None, f'{field}: {errors[0]}'
+    return serializer.validated_data, None
+
+
+def bulk_upsert_progress(user, items):
+    """
+    Create or update many days of quest progress in one set-based write.
+
+    Every item is validated up front; existing rows for the affected dates are
+    read (and row-locked) with one range query, then all accepted days are written
+    with a single INSERT ... ON CONFLICT (user_id, date) DO UPDATE. Days that were
+    already submitted are rejected, matching quests/today. Keys missing from an
+    item keep their stored value. Returns one result dict per input item:
+    {'index', 'date', 'status': created|updated|rejected, 'reason'}.
+    """
+    results = [None] * len(items)
+    accepted = {}
+    for index, item in enumerate(items):
+        data, reason = validate_sync_item(item)
+        if reason:
+            results[index] = {'index': index, 'date': None, 'status': 'rejected', 'reason': reason}
+            continue
+        previous = accepted.get(data['date'])
+        if previous is not None:
+            # The last entry for a date wins; a row can only be upserted once per statement
+            results[previous[0]].update(status='rejected', reason='Superseded by a later item for the same date')
+        accepted[data['date']] = (index, data)
+        results[index] = {'index': index, 'date': data['date'].isoformat(), 'status': None, 'reason': None}
+
+    if not accepted:
+        return results
+
+    with transaction.atomic():
+        stats = lock_user_stats(user)
+        existing = {
+            progress.date: progress
+            for progress in QuestProgress.objects.select_for_update().filter(
+                user=user, date__range=(min(accepted), max(accepted))
+            )
+        }
+
+        rows = []
+        changes = []
+        for progress_date, (index, data) in accepted.items():
+            current = existing.get(progress_date)
+            if current is not None and current.submitted:
+                results[index].update(status='rejected', reason='Day has already been submitted')
+                continue
+
+            row = QuestProgress(user=user, date=progress_date)
+            for field in QUEST_FIELDS:
+                fallback = getattr(current if current is not None else row, field)
+                setattr(row, field, data.get(field, fallback))
+            rows.append(row)
+            changes.append((progress_date, completion_flags(current) if current else None, completion_flags(row)))
+            results[index]['status'] = 'created' if current is None else 'updated'
+
+        if rows:
+            QuestProgress.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['user', 'date'],
+                update_fields=[*QUEST_FIELDS, 'updated_at'],
+            )
+            apply_progress_changes(stats, changes)
+            # bulk_create() bypasses the post_save cache invalidation
+            transaction.on_commit(lambda: quest_cache.bump_data_version(user.pk))
+
+    return results
+
+
+class CursorExpired(Exception):
+    """Raised when a sync cursor is older than the tombstone retention window"""
+
+
+_CURSOR_SALT = 'apps.users.quest-changes'
+
+
+def encode_sync_cursor(changes_position, deleted_position):
+    """Build an opaque, signed cursor from two (timestamp, id) keyset positions"""
+    return signing.dumps(
+        {'c': [changes_position[0].isoformat(), changes_position[1]],
+         'd': [deleted_position[0].isoformat(), deleted_position[1]]},
+        salt=_CURSOR_SALT,
+        compress=True,
+    )
+
+
+def decode_sync_cursor(cursor):
+    """
+    Return the (changes_position, deleted_position) stored in a cursor.
+
+    Cursors are timestamped when issued; once older than the tombstone retention
+    window, deletions may have been purged, so the client must fully resync.
+    """
+    try:
+        data = signing.loads(
+            cursor,
+            salt=_CURSOR_SALT,
+            max_age=timedelta(days=settings.QUEST_TOMBSTONE_RETENTION_DAYS),
+        )
+        return tuple(
+            (datetime.fromisoformat(data[key][0]), int(data[key][1]))
+            for key in ('c', 'd')
+        )
+    except signing.SignatureExpired:
+        raise CursorExpired('Sync cursor has expired; a full sync is required')
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise ValueError('Invalid sync cursor')
+
+
+def quest_changes(user, cursor=None, limit=None):
+    """
+    Return QuestProgress rows and deletions for a user since a sync cursor.
+
+    Both streams are paged by (timestamp, id) keyset over the (user, updated_at)
+    and (user, deleted_at) indexes. Returns (rows, tombstones, next_cursor,
+    has_more). Clients should apply tombstones before rows, since a deleted day
+    can be re-created later.
+    """
+    limit = limit or settings.QUEST_CHANGES_PAGE_SIZE
+    if cursor:
+        changes_position, deleted_position = decode_sync_cursor(cursor)
+    else:
+        changes_position = deleted_position = (timezone.make_aware(datetime(1970, 1, 1)), 0)
+
+    rows = list(_after_position(
+        QuestProgress.objects.filter(user=user), 'updated_at', changes_position
+    )[:limit + 1])
+    tombstones = list(_after_position(
+        QuestProgressTombstone.objects.filter(user=user), 'deleted_at', deleted_position
+    )[:limit + 1])
+
+    has_more = len(rows) > limit or len(tombstones) > limit
+    rows, tombstones = rows[:limit], tombstones[:limit]
+
+    if rows:
+        changes_position = (rows[-1].updated_at, rows[-1].pk)
+    if tombstones:
+        deleted_position = (tombstones[-1].deleted_at, tombstones[-1].pk)
+    if not has_more:
+        # Never advance past the settle window: a transaction that started earlier
+        # may still commit a row stamped inside it.
+        settled = (timezone.now() - timedelta(seconds=settings.QUEST_CHANGES_SETTLE_SECONDS), 0)
+        changes_position = min(changes_position, settled)
+        deleted_position = min(deleted_position, settled)
+
+    return rows, tombstones, encode_sync_cursor(changes_position, deleted_position), has_more
+
+
+def _after_position(queryset, field, position):
+    timestamp, pk = position
+    return queryset.filter(
+        Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'pk__gt': pk})
+    ).order_by(field, 'pk')
+
+
+def rebuild_user_stats(user):
+    """Recompute a user's stats from their full QuestProgress history"""
+    with transaction.atomic():
+        stats, created = UserStats.objects.select_for_update().get_or_create(user=user)
+        _recompute_stats(stats)
+        stats.save()
+    return stats
+
+
+def bulk_rebuild_user_stats(user_ids):
+    """
+    Recompute stats for many users with a fixed number of queries.
+
+    XP totals and streaks are each computed by a single grouped query over all
+    the given users, then written back with one upsert.
+    """
+    user_ids = list(user_ids)
+    progress = QuestProgress.objects.filter(user_id__in=user_ids)
+    xp_by_user = {
+        row['user_id']: row['xp']
+        for row in progress.order_by().values('user_id').annotate(xp=COMPLETION_AGGREGATES['xp'])
+    }
+    streaks = progress.streaks()
+
+    rows = []
+    for user_id in user_ids:
+        stats = UserStats(user_id=user_id, total_xp=xp_by_user.get(user_id, 0))
+        _set_streaks(stats, streaks.get(user_id))
+        rows.append(stats)
+
+    UserStats.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['total_xp', 'current_streak', 'streak_start_date', 'longest_streak',
+                       'last_completed_date', 'updated_at'],
+    )
+    return rows
+
+
+def _recompute_stats(stats):
+    stats.total_xp = QuestProgress.objects.filter(user_id=stats.user_id).completion_totals()['xp']
+    _recompute_streaks(stats)
+
+
+def _recompute_streaks(stats):
+    streaks = QuestProgress.objects.filter(user_id=stats.user_id).streaks()
+    _set_streaks(stats, streaks.get(stats.user_id))
+
+
+def _set_streaks(stats, summary):
+    if summary is None:
+        stats.current_streak = stats.longest_streak = 0
+        stats.streak_start_date = stats.last_completed_date = None
+        return
+    stats.current_streak = summary.current_streak
+    stats.streak_start_date = summary.streak_start_date
+    stats.last_completed_date = summary.last_completed_date
+    stats.longest_streak = summary.longest_streak
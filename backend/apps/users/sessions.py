@@ -0,0 +1,71 @@
+"""
+Session engine that reads through the cache and rarely writes.
+
+Sessions are stored in the database and cached, like Django's cached_db
+engine, so an authenticated request normally reads its session from the cache.
+Rather than saving every session on every request, an unmodified session is
+saved (pushing back its expiry and re-sending the cookie) once it was last
+saved at least SESSION_REFRESH_INTERVAL_SECONDS ago, so active users still get
+a rolling SESSION_COOKIE_AGE expiry. Sessions that are modified, such as the
+OAuth state allauth stores before redirecting to a provider, are saved as usual.
+
+Cache entries live at most SESSION_CACHE_TIMEOUT_SECONDS. The cache is only
+used when SESSION_CACHE_ALIAS names a cache shared by every worker: with a
+per-process cache (LocMem, the default) a logout or account deletion handled
+by one worker would go unseen by the others, so the logged-out cookie would
+still authenticate there. Sessions are then read from the database on every
+request, and only the rare saves remain. Expired rows are removed by
+purge_sessions.
+"""
+import time
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# Session data key holding the Unix time the session was last saved
+SAVED_AT_KEY = '_saved_at'
+
+# Cache backends that are not shared between worker processes
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+class SessionStore(CachedDBStore):
+    cache_key_prefix = 'apps.users.sessions'
+
+    @property
+    def _cache_is_shared(self):
+        return not isinstance(self._cache, PROCESS_LOCAL_CACHES)
+
+    def _cache_timeout(self, **kwargs):
+        return min(self.get_expiry_age(**kwargs), settings.SESSION_CACHE_TIMEOUT_SECONDS)
+
+    def load(self):
+        data = None
+        if self._cache_is_shared:
+            try:
+                data = self._cache.get(self.cache_key)
+            except Exception:
+                # Some backends raise on invalid cache keys; treat it as a miss
+                pass
+
+        if data is None:
+            session = self._get_session_from_db()
+            if session is None:
+                return {}
+            data = self.decode(session.session_data)
+            if self._cache_is_shared:
+                self._cache.set(self.cache_key, data, self._cache_timeout(expiry=session.expire_date))
+
+        if time.time() - data.get(SAVED_AT_KEY, 0) >= settings.SESSION_REFRESH_INTERVAL_SECONDS:
+            # Saved by SessionMiddleware at the end of the request
+            self.modified = True
+        return data
+
+    def save(self, must_create=False):
+        if self._session:
+            self._session[SAVED_AT_KEY] = int(time.time())
+        DBStore.save(self, must_create)
+        if self._cache_is_shared:
+            self._cache.set(self.cache_key, self._session, self._cache_timeout())
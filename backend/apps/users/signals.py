@@ -0,0 +1,29 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import User, QuestProgress, QuestProgressTombstone, Subscription
+from . import entitlements, quest_cache
+
+
+@receiver(post_save, sender=QuestProgress)
+@receiver(post_delete, sender=QuestProgress)
+def invalidate_quest_cache(sender, instance, **kwargs):
+    """Bump the owner's cache version once the write is committed"""
+    user_id = instance.user_id
+    transaction.on_commit(lambda: quest_cache.bump_data_version(user_id))
+
+
+@receiver(post_delete, sender=QuestProgress)
+def record_quest_tombstone(sender, instance, origin=None, **kwargs):
+    """Leave a tombstone for delta sync, unless the whole account is being deleted"""
+    if isinstance(origin, User) or getattr(origin, 'model', None) is User:
+        return
+    QuestProgressTombstone.objects.create(user_id=instance.user_id, date=instance.date)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_entitlement(sender, instance, **kwargs):
+    """Drop the owner's cached entitlement once the write is committed"""
+    user_id = instance.user_id
+    transaction.on_commit(lambda: entitlements.invalidate(user_id))
@@ -0,0 +1,138 @@
+"""
+Incremental parsing of large quest-sync uploads.
+
+Request bodies are read in fixed-size blocks and decoded record by record, so
+memory use is bounded by the largest single record rather than the payload.
+Both newline-delimited JSON (one object per line) and a single top-level JSON
+array are supported.
+"""
+import codecs
+import json
+
+READ_BLOCK_SIZE = 64 * 1024
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\r\n'
+
+
+class PayloadTooLarge(Exception):
+    """Raised when the body exceeds the configured maximum size"""
+
+
+class MalformedPayload(Exception):
+    """Raised when the body cannot be parsed any further"""
+
+
+class RecordError:
+    """Placeholder yielded for a single record that could not be parsed"""
+
+    def __init__(self, reason):
+        self.reason = reason
+
+
+def body_stream(http_request):
+    """
+    Return a file-like object yielding the raw request body, or None.
+
+    Django only reads as far as Content-Length, and exposes an empty body
+    without one. A chunked upload has none; it is read straight from wsgi.input
+    when the server (e.g. gunicorn) sets wsgi.input_terminated to promise the
+    stream ends with the body. Other servers give no such promise, so the body
+    can't be read safely and None is returned.
+    """
+    if http_request.META.get('CONTENT_LENGTH'):
+        return http_request
+    if http_request.META.get('wsgi.input_terminated'):
+        return http_request.META['wsgi.input']
+    return None
+
+
+class BodyReader:
+    """Reads decoded text blocks from a stream, enforcing a byte limit"""
+
+    def __init__(self, stream, max_bytes):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def read(self):
+        """Return the next block of text, or '' at end of stream"""
+        while True:
+            block = self.stream.read(READ_BLOCK_SIZE) if self.stream is not None else b''
+            self.bytes_read += len(block)
+            if self.bytes_read > self.max_bytes:
+                raise PayloadTooLarge(f'Request body exceeds {self.max_bytes} bytes')
+            text = self._decoder.decode(block, final=not block)
+            if text or not block:
+                return text
+
+
+def iter_records(reader, content_type):
+    """Yield each record of the body, or a RecordError for unparseable NDJSON lines"""
+    if content_type in NDJSON_CONTENT_TYPES:
+        return _iter_ndjson(reader)
+    return _iter_json_array(reader)
+
+
+def _iter_ndjson(reader):
+    buffer = ''
+    while True:
+        text = reader.read()
+        buffer += text
+        *lines, buffer = buffer.split('\n')
+        if not text:
+            lines.append(buffer)
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield RecordError(f'Invalid JSON: {e}')
+        if not text:
+            return
+
+
+def _iter_json_array(reader):
+    buffer = ''
+    position = 0
+    started = False
+    exhausted = False
+
+    while True:
+        # Skip whitespace and separators; stop once we need more input
+        while position < len(buffer) and buffer[position] in _WHITESPACE + (',' if started else ''):
+            position += 1
+
+        if position < len(buffer):
+            if not started:
+                if buffer[position] != '[':
+                    raise MalformedPayload('Expected a JSON array or NDJSON body')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                record, end = _decoder.raw_decode(buffer, position)
+            except ValueError as e:
+                # The record may continue in the next block
+                if exhausted:
+                    raise MalformedPayload(f'Invalid JSON: {e}')
+            else:
+                if end < len(buffer) or exhausted:
+                    yield record
+                    buffer = buffer[end:]
+                    position = 0
+                    continue
+                # A record ending exactly at the block edge might be a truncated number
+        elif exhausted:
+            raise MalformedPayload('Unexpected end of JSON array')
+
+        text = reader.read()
+        if not text:
+            exhausted = True
+        buffer = buffer[position:] + text
+        position = 0
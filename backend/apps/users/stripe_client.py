@@ -0,0 +1,225 @@
+"""
+The HTTP client used for every outbound Stripe API call.
+
+Stripe's requests-based client, configured with:
+
+- explicit connect/read timeouts (STRIPE_CONNECT_TIMEOUT_SECONDS,
+  STRIPE_READ_TIMEOUT_SECONDS) instead of the library's 80 seconds;
+- keep-alive connection reuse through one requests.Session per thread;
+- bounded retries (STRIPE_MAX_NETWORK_RETRIES) of connection errors, 409s and
+  5xx, using the library's exponential backoff with jitter. The library adds an
+  Idempotency-Key to POSTs, so a retried create is applied once;
+- a circuit breaker. After STRIPE_BREAKER_FAILURE_THRESHOLD consecutive failed
+  calls (connection errors, timeouts or 5xx once retries are exhausted), calls
+  fail fast with StripeUnavailable for STRIPE_BREAKER_RESET_SECONDS. Then a
+  single trial call is let through, which closes the breaker again on success.
+
+Breaker state and call metrics are per process, like the gunicorn workers
+that hold them; metrics() returns a snapshot for this process.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+import stripe
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the call latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_call_counter = ContextVar('stripe_call_counter', default=None)
+
+
+class StripeUnavailable(stripe.error.APIConnectionError):
+    """Raised without contacting Stripe while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Thread-safe consecutive-failure circuit breaker: closed, open, then half open"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def before_call(self):
+        """Raise StripeUnavailable unless a call may go out now"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < settings.STRIPE_BREAKER_RESET_SECONDS:
+                    raise StripeUnavailable('Stripe is unavailable (circuit breaker open)', should_retry=False)
+                self.state = self.HALF_OPEN
+                logger.info('Stripe circuit breaker half open; sending a trial call')
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    raise StripeUnavailable('Stripe is unavailable (trial call in flight)', should_retry=False)
+                self._trial_in_flight = True
+
+    def release(self):
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.warning('Stripe circuit breaker closed')
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= settings.STRIPE_BREAKER_FAILURE_THRESHOLD:
+                if self.state != self.OPEN:
+                    logger.warning('Stripe circuit breaker opened after %d consecutive failure(s)', self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class CallMetrics:
+    """Counters and a latency histogram of Stripe API calls"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.attempts = 0
+            self.failures = 0
+            self.rejected = 0
+            self.latency_total = 0.0
+            self.latency_max = 0.0
+            self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record_call(self, seconds, failed):
+        with self._lock:
+            self.calls += 1
+            self.failures += failed
+            self.latency_total += seconds
+            self.latency_max = max(self.latency_max, seconds)
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+            self.latency_buckets[bucket] += 1
+
+    def record_attempt(self):
+        with self._lock:
+            self.attempts += 1
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self):
+        with self._lock:
+            bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+            return {
+                'calls': self.calls,
+                'attempts': self.attempts,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'latency_seconds': {
+                    'mean': self.latency_total / self.calls if self.calls else 0.0,
+                    'max': self.latency_max,
+                    'buckets': dict(zip(bounds, self.latency_buckets)),
+                },
+            }
+
+
+breaker = CircuitBreaker()
+call_metrics = CallMetrics()
+
+
+class StripeHTTPClient(stripe.RequestsClient):
+    """Stripe's requests client behind the circuit breaker, recording metrics"""
+
+    def request_with_retries(self, method, url, headers, post_data=None, max_network_retries=None, *,
+                             _usage=None):
+        return self._guarded(super().request_with_retries, method, url, headers, post_data,
+                             max_network_retries, _usage=_usage)
+
+    def request_stream_with_retries(self, method, url, headers, post_data=None, max_network_retries=None, *,
+                                    _usage=None):
+        return self._guarded(super().request_stream_with_retries, method, url, headers, post_data,
+                             max_network_retries, _usage=_usage)
+
+    def request(self, *args, **kwargs):
+        # One attempt; request_with_retries() may make several per call
+        counter = _call_counter.get()
+        if counter is not None:
+            counter['calls'] += 1
+        call_metrics.record_attempt()
+        return super().request(*args, **kwargs)
+
+    def _guarded(self, send, *args, **kwargs):
+        try:
+            breaker.before_call()
+        except StripeUnavailable:
+            call_metrics.record_rejected()
+            raise
+
+        started = time.perf_counter()
+        try:
+            response = send(*args, **kwargs)
+        except stripe.error.APIConnectionError:
+            breaker.record_failure()
+            call_metrics.record_call(time.perf_counter() - started, failed=True)
+            raise
+        except BaseException:
+            # Not Stripe's fault (e.g. interrupted); just free a half-open trial slot
+            breaker.release()
+            raise
+
+        failed = response[1] >= 500
+        if failed:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        call_metrics.record_call(time.perf_counter() - started, failed=failed)
+        return response
+
+
+def build_http_client():
+    """Return a StripeHTTPClient configured from settings"""
+    return StripeHTTPClient(timeout=(settings.STRIPE_CONNECT_TIMEOUT_SECONDS, settings.STRIPE_READ_TIMEOUT_SECONDS))
+
+
+def configure():
+    """Install the configured client and retry policy as the Stripe library defaults"""
+    stripe.api_key = settings.STRIPE_SECRET_KEY
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    stripe.default_http_client = build_http_client()
+
+
+@contextmanager
+def count_stripe_calls():
+    """Count outbound Stripe HTTP requests (retries included) made within the block"""
+    counter = {'calls': 0}
+    token = _call_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _call_counter.reset(token)
+
+
+def metrics():
+    """Return this process's call metrics and circuit breaker state"""
+    return {
+        **call_metrics.snapshot(),
+        'breaker': {'state': breaker.state, 'consecutive_failures': breaker.failures},
+    }
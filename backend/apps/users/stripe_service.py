@@ -1,10 +1,18 @@
+import json
+import logging
 import stripe
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
 from django.utils import timezone
-from datetime import datetime
-from .models import User, Subscription
+from datetime import datetime, timedelta
+from .models import User, Subscription, StripeEvent, expiry_cutoff
+from . import entitlements, stripe_client
+from .stripe_client import count_stripe_calls
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+logger = logging.getLogger(__name__)
+
+stripe_client.configure()
 
 
 def get_or_create_stripe_customer(user: User) -> str:
@@ -24,7 +32,7 @@ def get_or_create_stripe_customer(user: User) -> str:
     )
 
     subscription.stripe_customer_id = customer.id
-    subscription.save()
+    subscription.save(update_fields=['stripe_customer_id', 'updated_at'])
 
     return customer.id
 
@@ -63,17 +71,17 @@ def cancel_subscription(user: User) -> bool:
             subscription.tier = Subscription.Tier.FREE
             subscription.status = Subscription.Status.CANCELED
             subscription.stripe_subscription_id = None
-            subscription.save()
+            subscription.save(update_fields=['tier', 'status', 'stripe_subscription_id', 'updated_at'])
             return True
     except Subscription.DoesNotExist:
         pass
     return False
 
 
-def handle_webhook_event(payload: bytes, sig_header: str):
-    """Handle Stripe webhook events."""
+def construct_webhook_event(payload: bytes, sig_header: str):
+    """Verify a webhook's signature and return the Stripe event."""
     try:
-        event = stripe.Webhook.construct_event(
+        return stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
     except ValueError:
@@ -81,95 +89,338 @@ def handle_webhook_event(payload: bytes, sig_header: str):
     except stripe.error.SignatureVerificationError:
         raise ValueError("Invalid signature")
 
-    event_type = event['type']
+
+def record_webhook_event(payload: bytes, sig_header: str):
+    """
+    Verify a webhook and store it for process_stripe_events().
+
+    Nothing is applied here, so the webhook can be acknowledged straight away.
+    Returns (event_type, created); created is False for a redelivery of an event
+    that is already stored.
+    """
+    construct_webhook_event(payload, sig_header)
+    # Work from plain JSON; StripeObject no longer supports dict methods like get()
+    event = json.loads(payload)
     data = event['data']['object']
+    customer = data['id'] if data.get('object') == 'customer' else data.get('customer')
+    if isinstance(customer, dict):
+        customer = customer['id']
+
+    _, created = StripeEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={
+            'type': event['type'],
+            'customer_id': customer or '',
+            'created': timezone.make_aware(datetime.fromtimestamp(event['created'])),
+            'payload': event,
+        },
+    )
+    return event['type'], created
+
 
-    if event_type == 'checkout.session.completed':
-        handle_checkout_completed(data)
-    elif event_type == 'customer.subscription.updated':
-        handle_subscription_updated(data)
-    elif event_type == 'customer.subscription.deleted':
-        handle_subscription_deleted(data)
+def apply_webhook_event(event):
+    """Apply one stored event payload to the local Subscription records."""
+    handler = WEBHOOK_HANDLERS.get(event['type'])
+    if handler is not None:
+        handler(event['data']['object'])
 
-    return event_type
 
+def pending_event_backlog():
+    """
+    Return how many webhook events are pending or parked as failed, and the age
+    in seconds of the oldest pending one
+    """
+    backlog = StripeEvent.objects.aggregate(
+        pending=Count('id', filter=Q(status=StripeEvent.Status.PENDING)),
+        failed=Count('id', filter=Q(status=StripeEvent.Status.FAILED)),
+        oldest=Min('received_at', filter=Q(status=StripeEvent.Status.PENDING)),
+    )
+    oldest_age = (timezone.now() - backlog['oldest']).total_seconds() if backlog['oldest'] else 0.0
+    return {'pending': backlog['pending'], 'failed': backlog['failed'], 'oldest_age_seconds': oldest_age}
+
+
+def check_pending_event_backlog():
+    """
+    Log an error when a webhook event has waited longer than STRIPE_EVENT_ALERT_SECONDS,
+    or when events have been parked as failed.
+
+    Called on every webhook, so a stopped or stuck worker, or an event that will
+    never apply, is reported while Stripe keeps delivering, instead of paying
+    users silently staying free. Failed events keep being reported until they
+    are queued again from the admin.
+    """
+    backlog = pending_event_backlog()
+    if backlog['oldest_age_seconds'] > settings.STRIPE_EVENT_ALERT_SECONDS:
+        logger.error(
+            '%d Stripe webhook event(s) pending, oldest received %.0fs ago; '
+            'is the process_stripe_events worker running?',
+            backlog['pending'], backlog['oldest_age_seconds'],
+        )
+    if backlog['failed']:
+        logger.error(
+            '%d Stripe webhook event(s) failed after %d attempts; '
+            'see last_error and queue them again from the admin',
+            backlog['failed'], settings.STRIPE_EVENT_MAX_ATTEMPTS,
+        )
+    return backlog
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Backoff before retrying an event that has failed `attempts` times"""
+    seconds = settings.STRIPE_EVENT_RETRY_SECONDS * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, settings.STRIPE_EVENT_RETRY_MAX_SECONDS))
+
+
+def process_stripe_events(limit: int = 100):
+    """
+    Apply pending webhook events, oldest first and in order per customer.
+
+    A customer's events are applied while holding its Subscription row lock, so
+    concurrent workers never reorder them. When an event raises, it backs off
+    (see retry_delay) and later events for that customer wait for the retry;
+    after STRIPE_EVENT_MAX_ATTEMPTS it is parked as failed and the rest proceed.
+    Returns counts by outcome.
+    """
+    counts = {'processed': 0, 'retrying': 0, 'failed': 0}
+    now = timezone.now()
+    pending = StripeEvent.objects.filter(status=StripeEvent.Status.PENDING)
+    due = pending.filter(Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+    customer_ids = dict.fromkeys(
+        due.order_by('created', 'id').values_list('customer_id', flat=True)[:limit]
+    )
 
+    for customer_id in customer_ids:
+        with transaction.atomic():
+            if customer_id:
+                list(Subscription.objects.select_for_update().filter(stripe_customer_id=customer_id))
+            events = pending.select_for_update().filter(customer_id=customer_id).order_by('created', 'id')
+            for event in events[:limit]:
+                if event.next_attempt_at and event.next_attempt_at > now:
+                    # An earlier event is backing off; keep the customer's order
+                    break
+                try:
+                    with transaction.atomic(), count_stripe_calls() as counter:
+                        apply_webhook_event(event.payload)
+                except stripe_client.StripeUnavailable:
+                    # Stripe is known to be down; wait for it without spending an attempt
+                    counts['retrying'] += 1
+                    break
+                except Exception as e:
+                    event.attempts += 1
+                    event.stripe_calls += counter['calls']
+                    event.last_error = f'{type(e).__name__}: {e}'
+                    if event.attempts < settings.STRIPE_EVENT_MAX_ATTEMPTS:
+                        event.next_attempt_at = now + retry_delay(event.attempts)
+                        event.save(update_fields=['attempts', 'stripe_calls', 'last_error', 'next_attempt_at'])
+                        counts['retrying'] += 1
+                        break
+                    event.status = StripeEvent.Status.FAILED
+                    event.save(update_fields=['status', 'attempts', 'stripe_calls', 'last_error'])
+                    counts['failed'] += 1
+                    continue
+
+                event.status = StripeEvent.Status.PROCESSED
+                event.attempts += 1
+                event.stripe_calls += counter['calls']
+                event.processed_at = timezone.now()
+                event.save(update_fields=['status', 'attempts', 'stripe_calls', 'processed_at'])
+                counts['processed'] += 1
+                # Outbound calls on the webhook path are the exception worth surfacing
+                logger.log(logging.INFO if counter['calls'] else logging.DEBUG,
+                           'Applied Stripe event %s (%s) with %d outbound Stripe call(s)',
+                           event.event_id, event.type, counter['calls'])
+
+    return counts
+
+
+SUBSCRIPTION_DETAIL_FIELDS = ('current_period_start', 'current_period_end', 'billing_interval')
+
+STATUS_MAP = {
+    'active': Subscription.Status.ACTIVE,
+    'past_due': Subscription.Status.PAST_DUE,
+    'canceled': Subscription.Status.CANCELED,
+    'incomplete': Subscription.Status.INCOMPLETE,
+}
+
+
+def apply_subscription_details(subscription, stripe_subscription) -> bool:
+    """
+    Copy billing period and interval from a Stripe subscription object.
+
+    Newer API versions report the period on the subscription item rather than
+    the subscription. Returns True only if every detail was present.
+    """
+    items = (stripe_subscription.get('items') or {}).get('data') or [{}]
+    item = items[0]
+    period_start = stripe_subscription.get('current_period_start') or item.get('current_period_start')
+    period_end = stripe_subscription.get('current_period_end') or item.get('current_period_end')
+    interval = ((item.get('price') or {}).get('recurring') or {}).get('interval')
+
+    if period_start:
+        subscription.current_period_start = timezone.make_aware(datetime.fromtimestamp(period_start))
+    if period_end:
+        subscription.current_period_end = timezone.make_aware(datetime.fromtimestamp(period_end))
+    if interval == 'year':
+        subscription.billing_interval = Subscription.BillingInterval.YEARLY
+    elif interval:
+        subscription.billing_interval = Subscription.BillingInterval.MONTHLY
+    return bool(period_start and period_end and interval)
+
+
+def _known_subscription_object(customer_id, subscription_id):
+    """The subscription as last reported by a stored customer.subscription.* event"""
+    event = StripeEvent.objects.filter(
+        customer_id=customer_id or '',
+        type__in=['customer.subscription.created', 'customer.subscription.updated'],
+        payload__data__object__id=subscription_id,
+    ).order_by('-created', '-id').first()
+    return event.payload['data']['object'] if event else None
+
+
+@transaction.atomic
 def handle_checkout_completed(session):
     """Handle successful checkout."""
     customer_id = session.get('customer')
     subscription_id = session.get('subscription')
+    # Present when the session was expanded; usually just the ID
+    expanded = subscription_id if isinstance(subscription_id, dict) else None
+    if expanded:
+        subscription_id = expanded['id']
 
     try:
-        subscription = Subscription.objects.get(stripe_customer_id=customer_id)
+        subscription = Subscription.objects.select_for_update().get(stripe_customer_id=customer_id)
         subscription.stripe_subscription_id = subscription_id
         subscription.tier = Subscription.Tier.PREMIUM
         subscription.status = Subscription.Status.ACTIVE
 
-        # Get subscription details from Stripe
-        stripe_sub = stripe.Subscription.retrieve(subscription_id)
-        subscription.current_period_start = timezone.make_aware(
-            datetime.fromtimestamp(stripe_sub.current_period_start)
-        )
-        subscription.current_period_end = timezone.make_aware(
-            datetime.fromtimestamp(stripe_sub.current_period_end)
-        )
-
-        # Determine billing interval from the price
-        price = stripe_sub['items']['data'][0]['price']
-        if price['recurring']['interval'] == 'year':
-            subscription.billing_interval = Subscription.BillingInterval.YEARLY
-        else:
-            subscription.billing_interval = Subscription.BillingInterval.MONTHLY
+        # Period and interval normally come from the expanded session or the
+        # customer.subscription.created event Stripe sends alongside it
+        known = expanded or _known_subscription_object(customer_id, subscription_id)
+        if not (known and apply_subscription_details(subscription, known)):
+            stripe_sub = stripe.Subscription.retrieve(subscription_id)
+            apply_subscription_details(subscription, stripe_sub.to_dict())
 
-        subscription.save()
+        subscription.save(update_fields=[
+            'stripe_subscription_id', 'tier', 'status', *SUBSCRIPTION_DETAIL_FIELDS, 'updated_at',
+        ])
     except Subscription.DoesNotExist:
         pass
 
 
+@transaction.atomic
 def handle_subscription_updated(stripe_subscription):
     """Handle subscription updates."""
     try:
-        subscription = Subscription.objects.get(
+        subscription = Subscription.objects.select_for_update().get(
             stripe_subscription_id=stripe_subscription['id']
         )
 
-        status_map = {
-            'active': Subscription.Status.ACTIVE,
-            'past_due': Subscription.Status.PAST_DUE,
-            'canceled': Subscription.Status.CANCELED,
-            'incomplete': Subscription.Status.INCOMPLETE,
-        }
-
-        subscription.status = status_map.get(
+        subscription.status = STATUS_MAP.get(
             stripe_subscription['status'],
             Subscription.Status.ACTIVE
         )
-        subscription.current_period_start = timezone.make_aware(
-            datetime.fromtimestamp(stripe_subscription['current_period_start'])
-        )
-        subscription.current_period_end = timezone.make_aware(
-            datetime.fromtimestamp(stripe_subscription['current_period_end'])
-        )
-        subscription.save()
+        apply_subscription_details(subscription, stripe_subscription)
+        subscription.save(update_fields=['status', *SUBSCRIPTION_DETAIL_FIELDS, 'updated_at'])
     except Subscription.DoesNotExist:
         pass
 
 
+@transaction.atomic
 def handle_subscription_deleted(stripe_subscription):
     """Handle subscription cancellation."""
     try:
-        subscription = Subscription.objects.get(
+        subscription = Subscription.objects.select_for_update().get(
             stripe_subscription_id=stripe_subscription['id']
         )
         subscription.tier = Subscription.Tier.FREE
         subscription.status = Subscription.Status.CANCELED
         subscription.stripe_subscription_id = None
-        subscription.save()
+        subscription.save(update_fields=['tier', 'status', 'stripe_subscription_id', 'updated_at'])
     except Subscription.DoesNotExist:
         pass
 
 
-
-
-
-
+WEBHOOK_HANDLERS = {
+    'checkout.session.completed': handle_checkout_completed,
+    'customer.subscription.created': handle_subscription_updated,
+    'customer.subscription.updated': handle_subscription_updated,
+    'customer.subscription.deleted': handle_subscription_deleted,
+}
+
+
+RECONCILED_FIELDS = ['tier', 'status', 'stripe_subscription_id', *SUBSCRIPTION_DETAIL_FIELDS, 'updated_at']
+
+
+def reconcile_subscription_batch(stripe_subscriptions, dry_run=False):
+    """
+    Bring local Subscription rows in line with a batch of Stripe subscriptions.
+
+    A live subscription is matched to the row linked to it, or else to its
+    customer's row (repairing a missed checkout), and makes that row premium.
+    An ended one downgrades the row still linked to it, like the deleted
+    webhook. Subscriptions still awaiting their first payment are left to the
+    checkout webhook. Matching rows are read and locked with one query and
+    only rows that differ are written, with one bulk_update. Returns the
+    changed rows.
+    """
+    stripe_subscriptions = [sub for sub in stripe_subscriptions if sub['status'] != 'incomplete']
+    if not stripe_subscriptions:
+        return []
+
+    with transaction.atomic():
+        rows = list(Subscription.objects.select_for_update().filter(
+            Q(stripe_subscription_id__in=[sub['id'] for sub in stripe_subscriptions])
+            | Q(stripe_customer_id__in=[sub['customer'] for sub in stripe_subscriptions])
+        ))
+        by_subscription = {row.stripe_subscription_id: row for row in rows if row.stripe_subscription_id}
+        by_customer = {row.stripe_customer_id: row for row in rows if row.stripe_customer_id}
+
+        changed = {}
+        for stripe_sub in stripe_subscriptions:
+            ended = stripe_sub['status'] in ('canceled', 'incomplete_expired')
+            row = by_subscription.get(stripe_sub['id'])
+            if row is None and not ended:
+                row = by_customer.get(stripe_sub['customer'])
+            if row is None:
+                continue
+
+            before = [getattr(row, field) for field in RECONCILED_FIELDS]
+            if ended:
+                row.tier = Subscription.Tier.FREE
+                row.status = Subscription.Status.CANCELED
+                row.stripe_subscription_id = None
+            else:
+                by_subscription.pop(row.stripe_subscription_id, None)
+                by_subscription[stripe_sub['id']] = row
+                row.tier = Subscription.Tier.PREMIUM
+                row.status = STATUS_MAP.get(stripe_sub['status'], Subscription.Status.ACTIVE)
+                row.stripe_subscription_id = stripe_sub['id']
+                apply_subscription_details(row, stripe_sub)
+            if [getattr(row, field) for field in RECONCILED_FIELDS] != before:
+                row.updated_at = timezone.now()
+                changed[row.pk] = row
+
+        if changed and not dry_run:
+            Subscription.objects.bulk_update(changed.values(), RECONCILED_FIELDS)
+            # bulk_update() bypasses the post_save entitlement invalidation
+            user_ids = [row.user_id for row in changed.values()]
+            transaction.on_commit(lambda: entitlements.invalidate(*user_ids))
+    return list(changed.values())
+
+
+def expire_lapsed_subscriptions():
+    """
+    Downgrade active subscriptions whose period ended without a renewal.
+
+    One conditional UPDATE over the (status, current_period_end) index marks
+    rows lapsed past SUBSCRIPTION_EXPIRY_GRACE_HOURS as past due, which ends
+    premium access. Tier and Stripe IDs are kept, so a late renewal webhook
+    makes the row active again. Rows only match while still active, so
+    concurrent sweeps from several nodes never downgrade a row twice. Cached
+    entitlements need no invalidation: they apply the same cutoff when read.
+    Returns the number of rows downgraded.
+    """
+    return Subscription.objects.filter(
+        status=Subscription.Status.ACTIVE,
+        current_period_end__lt=expiry_cutoff(),
+    ).update(status=Subscription.Status.PAST_DUE, updated_at=timezone.now())
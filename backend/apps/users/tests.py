@@ -1,13 +1,17 @@
+import time
 import pytest
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from datetime import date, timedelta
-from .models import QuestProgress
+from .models import QuestProgress, UserStats
 
 User = get_user_model()
 
+# Start of a billing period that is still running, for Stripe subscription payloads
+PERIOD_START = int(time.time()) - 86400
+
 
 @pytest.mark.django_db
 class TestUserRegistration:
@@ -86,6 +90,172 @@ class TestUserLogin:
         assert 'Invalid credentials' in str(response.data)
 
 
+@pytest.mark.django_db
+class TestUsernameOrEmailBackend:
+    """Test case-insensitive username or email authentication"""
+
+    def test_authenticates_in_one_query(self, user, django_assert_num_queries):
+        """Test that username or email, in any case, resolves with a single query"""
+        from django.contrib.auth import authenticate
+        for login in ('TestUser', 'TEST@example.com'):
+            with django_assert_num_queries(1):
+                assert authenticate(username=login, password='testpass123') == user
+        # A wrong password doesn't fall through to the other backends
+        with django_assert_num_queries(1):
+            assert authenticate(username='test@example.com', password='wrong') is None
+
+    def test_login_view_and_lookup_indexes(self, api_client, user):
+        """Test logging in by email, and that lookups use the lower() indexes"""
+        from .backends import find_user
+        response = api_client.post(reverse('users:login'), {'username': 'Test@Example.com',
+                                                             'password': 'testpass123'}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['user']['username'] == 'testuser'
+        assert {index.name for index in User._meta.indexes} >= {
+            'users_user_username_lower_idx', 'users_user_email_lower_idx',
+        }
+        assert find_user('nobody@example.com') is None
+
+    def test_shared_email_reset_and_login(self, api_client, user):
+        """Test that accounts sharing an email each get a reset link, and login picks the active one"""
+        from django.core import mail
+        from django.utils import timezone
+        User.objects.create_user(username='other', email='TEST@example.com', password='otherpass123',
+                                 last_login=timezone.now())
+        response = api_client.post(reverse('users:password_reset_request'), {'email': 'test@EXAMPLE.com'},
+                                   format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert sorted(message.body.split()[1].rstrip(',') for message in mail.outbox) == ['other', 'testuser']
+
+        response = api_client.post(reverse('users:login'), {'username': 'test@example.com',
+                                                             'password': 'otherpass123'}, format='json')
+        assert response.data['user']['username'] == 'other'
+
+
+@pytest.mark.django_db
+class TestPasswordHashing:
+    """Test the bounded password hashing pool"""
+
+    def test_saturated_pool_fails_fast(self, api_client, user, monkeypatch):
+        """Test that login gets 503 instead of queueing when the pool is full"""
+        import threading
+        from . import hashing
+        executor = hashing.HashingExecutor(workers=1, queue_depth=0, timeout=5)
+        monkeypatch.setattr(hashing, '_executor', executor)
+        started, release = threading.Event(), threading.Event()
+
+        def busy():
+            started.set()
+            release.wait(5)
+
+        worker = threading.Thread(target=executor.run, args=(busy,))
+        worker.start()
+        started.wait(5)
+        try:
+            response = api_client.post(reverse('users:login'), {'username': 'testuser', 'password': 'testpass123'},
+                                       format='json')
+            assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+            assert response['Retry-After'] == '1'
+        finally:
+            release.set()
+            worker.join()
+
+        response = api_client.post(reverse('users:login'), {'username': 'testuser', 'password': 'testpass123'},
+                                   format='json')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_threaded_burst_leaves_threads_free(self):
+        """Test that with more request threads than pool slots, the excess is refused at once"""
+        import threading
+        from . import hashing
+        executor = hashing.HashingExecutor(workers=2, queue_depth=4, timeout=5)
+        release, outcomes = threading.Event(), []
+
+        def request_thread():
+            # One of gunicorn's gthread threads (8 per process in start.sh) handling a login
+            try:
+                outcomes.append(executor.run(release.wait, 5))
+            except hashing.HashingUnavailable:
+                outcomes.append('503')
+
+        threads = [threading.Thread(target=request_thread) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while outcomes.count('503') < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Two threads were refused without waiting; six hold every slot
+        assert outcomes == ['503', '503']
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert (outcomes.count(True), outcomes.count('503')) == (6, 2)
+
+    @pytest.mark.parametrize('url', ['/admin/login/', '/accounts/login/', '/api/users/login'])
+    def test_overloaded_pool_returns_503_everywhere(self, client, user, monkeypatch, url):
+        """Test that every login path answers a full hashing pool with 503, not 500"""
+        from . import hashing
+
+        class FullExecutor:
+            def run(self, func, *args):
+                raise hashing.HashingUnavailable()
+        monkeypatch.setattr(hashing, 'get_executor', FullExecutor)
+
+        response = client.post(url, {'username': 'testuser', 'login': 'testuser', 'password': 'testpass123'})
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response['Retry-After'] == '1'
+
+    def test_login_upgrades_hash_to_scrypt(self, api_client, user, settings):
+        """Test that a correct password stored with an older hasher is re-hashed on login"""
+        settings.PASSWORD_HASHERS = [
+            'django.contrib.auth.hashers.ScryptPasswordHasher',
+            'django.contrib.auth.hashers.MD5PasswordHasher',
+        ]
+        assert user.password.startswith('md5$')
+        response = api_client.post(reverse('users:login'), {'username': 'testuser', 'password': 'wrong'},
+                                   format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        user.refresh_from_db()
+        assert user.password.startswith('md5$')
+
+        response = api_client.post(reverse('users:login'), {'username': 'testuser', 'password': 'testpass123'},
+                                   format='json')
+        assert response.status_code == status.HTTP_200_OK
+        user.refresh_from_db()
+        assert user.password.startswith('scrypt$') and user.check_password('testpass123')
+
+
+@pytest.mark.django_db
+class TestSocialUsernameGeneration:
+    """Test set-based unique username generation in the social account adapter"""
+
+    def test_lowest_free_suffix_in_one_query(self, django_assert_num_queries):
+        """Test that the next free suffix is found with one query, ignoring case"""
+        from .adapters import SocialAccountAdapter
+        for username in ('john', 'John1', 'john3', 'johnny', 'john_doe'):
+            User.objects.create_user(username=username, password='testpass123')
+        adapter = SocialAccountAdapter()
+        with django_assert_num_queries(1):
+            assert adapter._generate_unique_username('John') == 'John2'
+        with django_assert_num_queries(1):
+            assert adapter._generate_unique_username('jane') == 'jane'
+
+    def test_save_user_retries_taken_username(self, rf):
+        """Test that a username taken before the INSERT is replaced and saved"""
+        from django.contrib.sessions.backends.base import SessionBase
+        from allauth.socialaccount.models import SocialAccount, SocialLogin
+        from .adapters import SocialAccountAdapter
+        User.objects.create_user(username='race', password='testpass123')
+        sociallogin = SocialLogin(user=User(username='race', email='race@example.com'),
+                                  account=SocialAccount(provider='google', uid='12345'))
+        request = rf.get('/')
+        request.session = SessionBase()
+
+        user = SocialAccountAdapter().save_user(request, sociallogin)
+        assert user.pk is not None and user.username == 'race1'
+        assert SocialAccount.objects.get(uid='12345').user == user
+
+
 @pytest.mark.django_db
 class TestQuestProgress:
     """Test quest progress endpoints"""
@@ -197,6 +367,1390 @@ class TestQuestProgress:
         assert response.data['momentum_hours'] >= 48  # at least 2 full days of hours
 
 
+@pytest.mark.django_db
+class TestUserStats:
+    """Test incrementally maintained user statistics"""
+
+    def test_stats_follow_today_writes(self, authenticated_client, user):
+        """Test that saving today's quests updates XP and streak without a rebuild"""
+        today = date.today()
+        QuestProgress.objects.create(
+            user=user,
+            date=today - timedelta(days=1),
+            quest_1_completed=True,
+            quest_2_completed=True,
+            quest_3_completed=True,
+        )
+        url = reverse('users:quest_progress')
+        authenticated_client.post(url, {'quest_1_completed': True}, format='json')
+        authenticated_client.put(url, {'quest_2_completed': True, 'quest_3_completed': True}, format='json')
+
+        stats = UserStats.objects.get(pk=user.pk)
+        assert stats.total_xp == 6
+        assert stats.current_streak == 2
+        assert stats.longest_streak == 2
+        assert stats.streak_start_date == today - timedelta(days=1)
+        assert stats.last_completed_date == today
+
+        response = authenticated_client.get(reverse('users:quest_stats'))
+        assert response.data['streak'] == 2
+        assert response.data['total_xp'] == 6
+
+    def test_backfill_merges_streaks(self, authenticated_client, user):
+        """Test that syncing a missing past day joins two runs into one streak"""
+        today = date.today()
+        days = [
+            {'date': (today - timedelta(days=i)).isoformat(),
+             'quest_1_completed': True, 'quest_2_completed': True, 'quest_3_completed': True}
+            for i in (0, 1, 3)
+        ]
+        url = reverse('users:quest_bulk_sync')
+        authenticated_client.post(url, days, format='json')
+        assert UserStats.objects.get(pk=user.pk).current_streak == 2
+
+        authenticated_client.post(url, [{**days[0], 'date': (today - timedelta(days=2)).isoformat()}], format='json')
+        stats = UserStats.objects.get(pk=user.pk)
+        assert stats.current_streak == 4
+        assert stats.longest_streak == 4
+        assert stats.total_xp == 12
+
+    def test_rebuild_command(self, user):
+        """Test that rebuild_user_stats recomputes stats from history"""
+        from django.core.management import call_command
+
+        today = date.today()
+        for i in range(3):
+            QuestProgress.objects.create(
+                user=user,
+                date=today - timedelta(days=i),
+                quest_1_completed=True,
+                quest_2_completed=True,
+                quest_3_completed=i != 1,
+            )
+        UserStats.objects.create(user=user, total_xp=999)
+
+        call_command('rebuild_user_stats')
+
+        stats = UserStats.objects.get(pk=user.pk)
+        assert stats.total_xp == 8
+        assert stats.current_streak == 1
+        assert stats.longest_streak == 1
+        assert stats.last_completed_date == today
+
+
+@pytest.mark.django_db
+class TestStreakEngine:
+    """Test database-side streak computation"""
+
+    def _complete_days(self, user, days):
+        today = date.today()
+        QuestProgress.objects.bulk_create([
+            QuestProgress(
+                user=user,
+                date=today - timedelta(days=i),
+                quest_1_completed=True,
+                quest_2_completed=True,
+                quest_3_completed=True,
+            )
+            for i in days
+        ])
+
+    def test_streak_longer_than_a_year(self, user):
+        """Test that streaks are not capped at 365 days"""
+        self._complete_days(user, range(400))
+
+        summary = QuestProgress.objects.filter(user=user).streaks()[user.pk]
+        assert summary.current_streak == 400
+        assert summary.longest_streak == 400
+        assert summary.last_completed_date == date.today()
+        assert summary.streak_start_date == date.today() - timedelta(days=399)
+
+    def test_streaks_in_bulk(self, user):
+        """Test computing current and longest streaks for several users at once"""
+        other = User.objects.create_user(username='other', password='testpass123')
+        self._complete_days(user, [0, 1, 5, 6, 7, 8])
+        self._complete_days(other, [3])
+        QuestProgress.objects.create(user=other, date=date.today(), quest_1_completed=True)
+
+        streaks = QuestProgress.objects.filter(user__in=[user, other]).streaks()
+        assert streaks[user.pk].current_streak == 2
+        assert streaks[user.pk].longest_streak == 4
+        assert streaks[other.pk].current_streak == 1
+        assert streaks[other.pk].last_completed_date == date.today() - timedelta(days=3)
+
+
+@pytest.mark.django_db
+class TestQuestProgressUpsert:
+    """Test the single-statement upsert behind quests/today writes"""
+
+    def test_partial_update_keeps_other_fields(self, authenticated_client, user):
+        """Test that only the fields sent are written"""
+        QuestProgress.objects.create(
+            user=user, date=date.today(), quest_1_text='Run', quest_2_text='Read', quest_1_completed=True,
+        )
+        url = reverse('users:quest_progress')
+        response = authenticated_client.put(url, {'quest_2_completed': True}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        progress = QuestProgress.objects.get(user=user, date=date.today())
+        assert (progress.quest_1_text, progress.quest_2_text) == ('Run', 'Read')
+        assert progress.quest_1_completed and progress.quest_2_completed
+        assert progress.completion_mask == 0b011
+        assert UserStats.objects.get(user=user).total_xp == 2
+
+    def test_submitted_day_is_untouched(self, authenticated_client, user):
+        """Test that writes to a submitted day are ignored"""
+        QuestProgress.objects.create(user=user, date=date.today(), quest_1_text='Done', submitted=True)
+        url = reverse('users:quest_progress')
+        response = authenticated_client.post(url, {'quest_1_text': 'Changed'}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['quest_1_text'] == 'Done'
+        assert QuestProgress.objects.get(user=user).quest_1_text == 'Done'
+
+    @pytest.mark.django_db(transaction=True)
+    def test_concurrent_first_saves(self, user):
+        """Test that many clients saving the same new day all succeed and merge"""
+        from concurrent.futures import ThreadPoolExecutor
+        from threading import Barrier
+        from django.db import OperationalError, connection
+
+        fields = ['quest_1_completed', 'quest_2_completed', 'quest_3_completed'] * 4
+        barrier = Barrier(len(fields))
+
+        def save(field):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        return client.post(reverse('users:quest_progress'), {field: True}, format='json').status_code
+                    except OperationalError:
+                        # SQLite's shared in-memory test database fails fast on table
+                        # locks instead of waiting; PostgreSQL blocks on the stats row
+                        # lock. An IntegrityError is never retried.
+                        continue
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(fields)) as pool:
+            codes = list(pool.map(save, fields))
+
+        assert set(codes) <= {status.HTTP_200_OK, status.HTTP_201_CREATED}
+        progress = QuestProgress.objects.get(user=user, date=date.today())
+        assert progress.completion_mask == 0b111
+        assert UserStats.objects.get(user=user).total_xp == 3
+
+
+@pytest.mark.django_db
+class TestQuestTransitions:
+    """Test the conditional single-statement submit and lock transitions"""
+
+    def test_submit_is_one_query(self, authenticated_client, user, django_assert_num_queries):
+        """Test that a successful submit is a single UPDATE ... RETURNING"""
+        QuestProgress.objects.create(user=user, date=date.today(), quest_1_completed=True)
+        url = reverse('users:submit_quest')
+
+        with django_assert_num_queries(1):
+            response = authenticated_client.post(url, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['data']['submitted'] is True
+
+        response = authenticated_client.post(url, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data['submitted_at'] is not None
+
+    def test_submit_without_progress(self, authenticated_client, user):
+        """Test that submitting with no row for today is a 404"""
+        response = authenticated_client.post(reverse('users:submit_quest'), format='json')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_lock_choices_requires_text_and_locks_once(self, authenticated_client, user):
+        """Test that locking checks quest text and keeps the first lock time"""
+        progress = QuestProgress.objects.create(
+            user=user, date=date.today(), quest_1_text='Run', quest_2_text='Read', quest_3_text='  ',
+        )
+        url = reverse('users:lock_choices')
+        assert authenticated_client.post(url, format='json').status_code == status.HTTP_400_BAD_REQUEST
+
+        QuestProgress.objects.filter(pk=progress.pk).update(quest_3_text='Write')
+        first = authenticated_client.post(url, format='json')
+        second = authenticated_client.post(url, format='json')
+        assert first.status_code == second.status_code == status.HTTP_200_OK
+        assert first.data['data']['choices_locked'] is True
+        assert second.data['data']['choices_locked_at'] == first.data['data']['choices_locked_at']
+
+
+@pytest.mark.django_db
+class TestIdempotencyKeys:
+    """Test Idempotency-Key replay on mutating endpoints"""
+
+    def test_retry_replays_without_rerunning(self, authenticated_client, user, monkeypatch):
+        """Test that a retried subscribe does not create another checkout session"""
+        from . import stripe_service
+        calls = []
+        monkeypatch.setattr(
+            stripe_service, 'create_checkout_session',
+            lambda **kwargs: calls.append(kwargs) or f'https://checkout.test/{len(calls)}',
+        )
+        url = reverse('users:create_checkout')
+
+        first = authenticated_client.post(url, {'billing_interval': 'yearly'}, format='json',
+                                          HTTP_IDEMPOTENCY_KEY='abc')
+        retry = authenticated_client.post(url, {'billing_interval': 'yearly'}, format='json',
+                                          HTTP_IDEMPOTENCY_KEY='abc')
+
+        assert len(calls) == 1
+        assert retry.status_code == first.status_code == status.HTTP_200_OK
+        assert retry.data == first.data == {'checkout_url': 'https://checkout.test/1'}
+        assert retry['Idempotent-Replayed'] == 'true'
+
+    def test_key_reuse_and_in_flight(self, authenticated_client, user):
+        """Test that a reused key with another body is 422 and an unfinished one is 409"""
+        from .models import IdempotencyKey
+        url = reverse('users:quest_progress')
+        authenticated_client.post(url, {'quest_1_text': 'Run'}, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+
+        response = authenticated_client.post(url, {'quest_1_text': 'Swim'}, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert QuestProgress.objects.get(user=user).quest_1_text == 'Run'
+
+        IdempotencyKey.objects.filter(key='k1').update(status_code=None)
+        response = authenticated_client.post(url, {'quest_1_text': 'Run'}, format='json', HTTP_IDEMPOTENCY_KEY='k1')
+        assert response.status_code == status.HTTP_409_CONFLICT
+
+    def test_abandoned_claim_is_taken_over(self, authenticated_client, user, settings):
+        """Test that a claim left unfinished past the lease no longer blocks retries"""
+        from django.utils import timezone
+        from .models import IdempotencyKey
+        url = reverse('users:quest_progress')
+        claim = IdempotencyKey.objects.create(user=user, key='k2', request_hash='died mid-request')
+
+        IdempotencyKey.objects.filter(pk=claim.pk).update(
+            created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS + 1)
+        )
+        response = authenticated_client.post(url, {'quest_1_text': 'Run'}, format='json', HTTP_IDEMPOTENCY_KEY='k2')
+        assert response.status_code == status.HTTP_201_CREATED
+        assert IdempotencyKey.objects.get(key='k2').status_code == status.HTTP_201_CREATED
+
+    def test_expired_keys_are_purged(self, authenticated_client, user):
+        """Test that keys past the TTL are purged and free to reuse"""
+        from django.core.management import call_command
+        from django.utils import timezone
+        from .models import IdempotencyKey
+        url = reverse('users:submit_quest')
+        QuestProgress.objects.create(user=user, date=date.today())
+        authenticated_client.post(url, format='json', HTTP_IDEMPOTENCY_KEY='old')
+        authenticated_client.post(url, format='json', HTTP_IDEMPOTENCY_KEY='new')
+        IdempotencyKey.objects.filter(key='old').update(created_at=timezone.now() - timedelta(days=2))
+
+        response = authenticated_client.post(url, format='json', HTTP_IDEMPOTENCY_KEY='old')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'Idempotent-Replayed' not in response
+
+        IdempotencyKey.objects.filter(key='old').update(created_at=timezone.now() - timedelta(days=2))
+        call_command('purge_idempotency_keys')
+        assert list(IdempotencyKey.objects.values_list('key', flat=True)) == ['new']
+
+
+@pytest.mark.django_db
+class TestStripeEventQueue:
+    """Test storing Stripe webhooks and applying them with the worker"""
+
+    @pytest.fixture
+    def subscription(self, user):
+        from .models import Subscription
+        return Subscription.objects.create(
+            user=user, tier='premium', stripe_customer_id='cus_1', stripe_subscription_id='sub_1',
+        )
+
+    def _event(self, event_id, created, sub_status, event_type='customer.subscription.updated'):
+        return {
+            'id': event_id, 'object': 'event', 'type': event_type, 'created': created,
+            'data': {'object': {
+                'id': 'sub_1', 'object': 'subscription', 'customer': 'cus_1', 'status': sub_status,
+                'current_period_start': created, 'current_period_end': created + 86400,
+            }},
+        }
+
+    def test_webhook_stores_and_deduplicates(self, api_client, subscription, settings):
+        """Test that the webhook only stores events and drops redeliveries"""
+        import json
+        import time
+        from .management.commands.generate_stripe_events import sign_payload
+        from .models import StripeEvent
+        settings.STRIPE_WEBHOOK_SECRET = 'whsec_test'
+        payload = json.dumps(self._event('evt_1', int(time.time()), 'past_due'))
+        url = reverse('users:stripe_webhook')
+
+        for duplicate in (False, True):
+            response = api_client.post(url, payload, content_type='application/json',
+                                       HTTP_STRIPE_SIGNATURE=sign_payload(payload, 'whsec_test', int(time.time())))
+            assert response.status_code == status.HTTP_200_OK
+            assert response.data['duplicate'] is duplicate
+
+        assert StripeEvent.objects.get().status == StripeEvent.Status.PENDING
+        subscription.refresh_from_db()
+        assert subscription.status == 'active'
+
+    def test_worker_applies_in_order_and_retries(self, subscription, monkeypatch, settings):
+        """Test per-customer ordering and that a failing event holds back later ones"""
+        from django.utils import timezone
+        from . import stripe_service
+        from .models import StripeEvent
+        settings.STRIPE_EVENT_MAX_ATTEMPTS = 2
+        now = int(timezone.now().timestamp())
+        for event_id, created, sub_status in [('evt_b', now, 'active'), ('evt_a', now - 60, 'past_due')]:
+            StripeEvent.objects.create(
+                event_id=event_id, type='customer.subscription.updated', customer_id='cus_1',
+                created=timezone.now() + timedelta(seconds=created - now),
+                payload=self._event(event_id, created, sub_status),
+            )
+
+        original = stripe_service.apply_webhook_event
+
+        def flaky(event):
+            if event['id'] == 'evt_a':
+                raise RuntimeError('boom')
+            original(event)
+        monkeypatch.setattr(stripe_service, 'apply_webhook_event', flaky)
+
+        assert stripe_service.process_stripe_events() == {'processed': 0, 'retrying': 1, 'failed': 0}
+        assert StripeEvent.objects.get(event_id='evt_b').status == StripeEvent.Status.PENDING
+
+        # The failed event backs off, and holds back evt_b, until its retry is due
+        retry_at = StripeEvent.objects.get(event_id='evt_a').next_attempt_at
+        assert retry_at > timezone.now() + timedelta(seconds=settings.STRIPE_EVENT_RETRY_SECONDS - 5)
+        assert stripe_service.process_stripe_events() == {'processed': 0, 'retrying': 0, 'failed': 0}
+
+        StripeEvent.objects.filter(event_id='evt_a').update(next_attempt_at=timezone.now())
+        assert stripe_service.process_stripe_events() == {'processed': 1, 'retrying': 0, 'failed': 1}
+
+        subscription.refresh_from_db()
+        assert subscription.status == 'active'
+        assert StripeEvent.objects.get(event_id='evt_a').last_error == 'RuntimeError: boom'
+
+    def test_stale_backlog_is_reported(self, api_client, subscription, settings, caplog):
+        """Test that webhooks log an error while an event waits past the alert age"""
+        import json
+        import time
+        from django.utils import timezone
+        from .management.commands.generate_stripe_events import sign_payload
+        from .models import StripeEvent
+        settings.STRIPE_WEBHOOK_SECRET = 'whsec_test'
+        url = reverse('users:stripe_webhook')
+
+        def deliver(event_id):
+            payload = json.dumps(self._event(event_id, int(time.time()), 'active'))
+            api_client.post(url, payload, content_type='application/json',
+                            HTTP_STRIPE_SIGNATURE=sign_payload(payload, 'whsec_test', int(time.time())))
+
+        deliver('evt_1')
+        assert 'worker running' not in caplog.text
+
+        stale = timezone.now() - timedelta(seconds=settings.STRIPE_EVENT_ALERT_SECONDS + 60)
+        StripeEvent.objects.update(received_at=stale)
+        deliver('evt_2')
+        assert '2 Stripe webhook event(s) pending' in caplog.text
+        assert 'failed after' not in caplog.text
+
+        StripeEvent.objects.filter(event_id='evt_2').update(status=StripeEvent.Status.FAILED)
+        deliver('evt_3')
+        assert '1 Stripe webhook event(s) failed after' in caplog.text
+
+        admin = User.objects.create_superuser(username='admin', password='x')
+        api_client.force_authenticate(user=admin)
+        events = api_client.get(reverse('users:stripe_metrics')).data['events']
+        assert (events['pending'], events['failed']) == (2, 1)
+        assert events['oldest_age_seconds'] > settings.STRIPE_EVENT_ALERT_SECONDS
+
+    def test_retry_backoff_doubles_up_to_cap(self, settings):
+        """Test that retries back off exponentially and are capped"""
+        from . import stripe_service
+        settings.STRIPE_EVENT_RETRY_SECONDS = 30
+        settings.STRIPE_EVENT_RETRY_MAX_SECONDS = 200
+
+        delays = [stripe_service.retry_delay(attempts).total_seconds() for attempts in range(1, 6)]
+        assert delays == [30, 60, 120, 200, 200]
+
+    def test_fake_event_generator(self, settings):
+        """Test that generated events are accepted and processed"""
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import StripeEvent
+        settings.STRIPE_WEBHOOK_SECRET = 'whsec_test'
+        call_command('generate_stripe_events', count=20, customers=3, seed=True, stdout=StringIO())
+        call_command('process_stripe_events', stdout=StringIO())
+
+        assert StripeEvent.objects.count() == 20
+        assert not StripeEvent.objects.exclude(status=StripeEvent.Status.PROCESSED).exists()
+
+
+@pytest.mark.django_db
+class TestCheckoutCompletion:
+    """Test that checkout completion avoids outbound Stripe calls"""
+
+    def _store(self, event_id, event_type, created, obj):
+        from django.utils import timezone
+        from .models import StripeEvent
+        return StripeEvent.objects.create(
+            event_id=event_id, type=event_type, customer_id='cus_1',
+            created=timezone.now() + timedelta(seconds=created),
+            payload={'id': event_id, 'type': event_type, 'created': created, 'data': {'object': obj}},
+        )
+
+    @pytest.fixture
+    def subscription(self, user):
+        from .models import Subscription
+        return Subscription.objects.create(user=user, stripe_customer_id='cus_1')
+
+    def test_checkout_uses_subscription_created_event(self, subscription):
+        """Test that period and interval come from the stored subscription event"""
+        from . import stripe_service
+        from .models import StripeEvent
+        self._store('evt_sub', 'customer.subscription.created', 0, {
+            'id': 'sub_1', 'object': 'subscription', 'customer': 'cus_1', 'status': 'incomplete',
+            'items': {'data': [{'current_period_start': PERIOD_START, 'current_period_end': PERIOD_START + 365 * 86400,
+                                'price': {'recurring': {'interval': 'year'}}}]},
+        })
+        self._store('evt_checkout', 'checkout.session.completed', 1, {
+            'id': 'cs_1', 'object': 'checkout.session', 'customer': 'cus_1', 'subscription': 'sub_1',
+        })
+
+        stripe_service.process_stripe_events()
+
+        subscription.refresh_from_db()
+        assert subscription.is_premium
+        assert subscription.billing_interval == 'yearly'
+        assert subscription.current_period_end is not None
+        assert list(StripeEvent.objects.values_list('stripe_calls', flat=True)) == [0, 0]
+
+    def test_checkout_falls_back_to_fetch(self, subscription, monkeypatch):
+        """Test that a missing subscription event triggers one counted fetch"""
+        import json
+        import stripe
+        from . import stripe_service
+        from .models import StripeEvent
+        monkeypatch.setattr(stripe, 'api_key', 'sk_test_fake')
+        body = json.dumps({
+            'id': 'sub_1', 'object': 'subscription', 'customer': 'cus_1', 'status': 'active',
+            'current_period_start': 1700000000, 'current_period_end': 1702592000,
+            'items': {'object': 'list', 'data': [{'id': 'si_1', 'object': 'subscription_item',
+                                                  'price': {'id': 'price_1', 'object': 'price',
+                                                            'recurring': {'interval': 'month'}}}]},
+        })
+        monkeypatch.setattr(stripe.RequestsClient, 'request', lambda self, *args, **kwargs: (body, 200, {}))
+        self._store('evt_checkout', 'checkout.session.completed', 0, {
+            'id': 'cs_1', 'object': 'checkout.session', 'customer': 'cus_1', 'subscription': 'sub_1',
+        })
+
+        stripe_service.process_stripe_events()
+
+        subscription.refresh_from_db()
+        assert subscription.billing_interval == 'monthly'
+        assert StripeEvent.objects.get().stripe_calls == 1
+
+    def test_subscription_event_lookup_is_indexed(self, subscription):
+        """Test that the stored-event lookup uses the (customer_id, type, created) index"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from . import stripe_service
+        with CaptureQueriesContext(connection) as queries:
+            assert stripe_service._known_subscription_object('cus_1', 'sub_1') is None
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {queries[0]["sql"]}')
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        assert 'users_strip_custome_61ecd9_idx' in plan
+
+
+@pytest.mark.django_db
+class TestSubscriptionLookups:
+    """Test Stripe ID constraints and scoped webhook writes"""
+
+    def test_stripe_ids_are_unique(self, user):
+        """Test that a Stripe customer ID can belong to one subscription only"""
+        from django.db import IntegrityError, transaction
+        from .models import Subscription
+        other = User.objects.create_user(username='other', password='testpass123')
+        third = User.objects.create_user(username='third', password='testpass123')
+        Subscription.objects.create(user=user, stripe_customer_id='cus_1')
+        Subscription.objects.create(user=third)
+
+        with pytest.raises(IntegrityError), transaction.atomic():
+            Subscription.objects.create(user=other, stripe_customer_id='cus_1')
+        Subscription.objects.create(user=other)  # several unlinked rows are fine
+
+    def test_handler_writes_only_its_fields(self, user):
+        """Test that a subscription update locks the row and saves only what it owns"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from . import stripe_service
+        from .models import Subscription
+        Subscription.objects.create(user=user, tier='premium', stripe_customer_id='cus_1',
+                                    stripe_subscription_id='sub_1')
+
+        with CaptureQueriesContext(connection) as queries:
+            stripe_service.handle_subscription_updated({
+                'id': 'sub_1', 'status': 'past_due', 'current_period_start': 1700000000,
+                'current_period_end': 1702592000,
+            })
+
+        update = next(query['sql'] for query in queries if query['sql'].startswith('UPDATE'))
+        assert '"status"' in update and '"tier"' not in update
+        assert Subscription.objects.get(user=user).status == 'past_due'
+
+    def test_benchmark_rolls_back(self):
+        """Test that the webhook benchmark runs and leaves no data behind"""
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import StripeEvent, Subscription
+        out = StringIO()
+        call_command('benchmark_stripe_webhooks', subscriptions=30, events=10, stdout=out)
+
+        assert 'Applied 10 event(s)' in out.getvalue()
+        assert not Subscription.objects.exists() and not StripeEvent.objects.exists()
+
+
+@pytest.fixture
+def stripe_stand_in(monkeypatch):
+    """
+    A local HTTP server answering Stripe's subscription list API from a fixed list.
+
+    Set 'delay' (seconds) or 'error_status' to inject latency or failures into
+    every response.
+    """
+    import json
+    import threading
+    import time as clock
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from urllib.parse import parse_qs, urlparse
+    import stripe
+
+    server_state = {'subscriptions': [], 'requests': [], 'fail_after': None, 'delay': 0, 'error_status': None}
+    stand_in_error = {'error': {'type': 'api_error', 'message': 'Stand-in failure'}}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+            server_state['requests'].append(query)
+            subscriptions = server_state['subscriptions']
+            start = 0
+            if 'starting_after' in query:
+                start = [sub['id'] for sub in subscriptions].index(query['starting_after']) + 1
+            if server_state['fail_after'] is not None and start >= server_state['fail_after']:
+                self._respond(500, stand_in_error)
+            else:
+                page = subscriptions[start:start + int(query.get('limit', 10))]
+                self._respond(200, {'object': 'list', 'url': '/v1/subscriptions', 'data': page,
+                                    'has_more': start + len(page) < len(subscriptions)})
+
+        def _respond(self, status_code, body):
+            clock.sleep(server_state['delay'])
+            if server_state['error_status']:
+                status_code, body = server_state['error_status'], stand_in_error
+            content = json.dumps(body).encode()
+            self.send_response(status_code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(stripe, 'api_key', 'sk_test_stand_in')
+    monkeypatch.setattr(stripe, 'api_base', stripe.api_base)
+    server_state['api_base'] = f'http://127.0.0.1:{server.server_address[1]}'
+    yield server_state
+    server.shutdown()
+
+
+@pytest.mark.django_db
+class TestReconcileSubscriptions:
+    """Test reconciling Subscription rows from Stripe's subscription list"""
+
+    def _stripe_sub(self, number, sub_status):
+        return {
+            'id': f'sub_{number}', 'object': 'subscription', 'customer': f'cus_{number}', 'status': sub_status,
+            'current_period_start': PERIOD_START, 'current_period_end': PERIOD_START + 365 * 86400,
+            'items': {'object': 'list', 'data': [{'object': 'subscription_item', 'id': f'si_{number}',
+                                                  'price': {'object': 'price', 'id': 'price_1',
+                                                            'recurring': {'interval': 'year'}}}]},
+        }
+
+    def test_repairs_missed_webhooks(self, stripe_stand_in):
+        """Test that missed checkouts and cancellations are repaired in batches"""
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import Subscription
+        for number in range(5):
+            user = User.objects.create_user(username=f'user{number}', password='testpass123')
+            Subscription.objects.create(
+                user=user, stripe_customer_id=f'cus_{number}',
+                stripe_subscription_id='sub_4' if number == 4 else None,
+                tier='premium' if number == 4 else 'free',
+            )
+        stripe_stand_in['subscriptions'] = [
+            self._stripe_sub(0, 'active'), self._stripe_sub(1, 'incomplete'), self._stripe_sub(2, 'past_due'),
+            self._stripe_sub(4, 'canceled'),
+        ]
+
+        call_command('reconcile_subscriptions', api_base=stripe_stand_in['api_base'], page_size=2, stdout=StringIO())
+
+        rows = {row.stripe_customer_id: row for row in Subscription.objects.all()}
+        assert rows['cus_0'].is_premium and rows['cus_0'].billing_interval == 'yearly'
+        assert rows['cus_1'].tier == 'free'
+        assert (rows['cus_2'].tier, rows['cus_2'].status) == ('premium', 'past_due')
+        assert (rows['cus_4'].tier, rows['cus_4'].stripe_subscription_id) == ('free', None)
+        assert len(stripe_stand_in['requests']) == 2
+
+    def test_resumes_from_checkpoint(self, stripe_stand_in, tmp_path):
+        """Test that a failed run resumes after the last committed page"""
+        from io import StringIO
+        from django.core.management import CommandError, call_command
+        from .models import Subscription
+        for number in range(4):
+            user = User.objects.create_user(username=f'user{number}', password='testpass123')
+            Subscription.objects.create(user=user, stripe_customer_id=f'cus_{number}')
+        stripe_stand_in['subscriptions'] = [self._stripe_sub(number, 'active') for number in range(4)]
+        stripe_stand_in['fail_after'] = 2
+        checkpoint = tmp_path / 'reconcile.json'
+        options = {'api_base': stripe_stand_in['api_base'], 'page_size': 2, 'checkpoint': str(checkpoint),
+                   'stdout': StringIO()}
+
+        with pytest.raises(CommandError):
+            call_command('reconcile_subscriptions', **options)
+        assert Subscription.objects.filter(tier='premium').count() == 2
+        assert checkpoint.exists()
+
+        stripe_stand_in['fail_after'] = None
+        stripe_stand_in['requests'].clear()
+        call_command('reconcile_subscriptions', **options)
+
+        assert stripe_stand_in['requests'][0]['starting_after'] == 'sub_1'
+        assert Subscription.objects.filter(tier='premium').count() == 4
+        assert not checkpoint.exists()
+
+
+@pytest.mark.django_db
+class TestStripeClient:
+    """Test timeouts, retries and the circuit breaker around outbound Stripe calls"""
+
+    def test_breaker_opens_and_recovers(self, settings, monkeypatch, stripe_stand_in):
+        """Test that repeated failures open the breaker, then a trial call closes it"""
+        import stripe
+        from . import stripe_client
+        settings.STRIPE_BREAKER_FAILURE_THRESHOLD = 2
+        monkeypatch.setattr(stripe, 'api_base', stripe_stand_in['api_base'])
+        stripe_stand_in['error_status'] = 500
+
+        for _ in range(2):
+            with pytest.raises(stripe.error.APIError):
+                stripe.Subscription.list()
+        with pytest.raises(stripe_client.StripeUnavailable):
+            stripe.Subscription.list()
+        assert len(stripe_stand_in['requests']) == 2
+        metrics = stripe_client.metrics()
+        assert metrics['breaker']['state'] == 'open'
+        assert (metrics['calls'], metrics['failures'], metrics['rejected']) == (2, 2, 1)
+
+        settings.STRIPE_BREAKER_RESET_SECONDS = 0
+        stripe_stand_in['error_status'] = None
+        assert stripe.Subscription.list().data == []
+        assert stripe_client.metrics()['breaker'] == {'state': 'closed', 'consecutive_failures': 0}
+
+    def test_slow_responses_time_out_and_retry(self, monkeypatch, stripe_stand_in):
+        """Test that the read timeout bounds each attempt and retries are bounded"""
+        import stripe
+        from . import stripe_client
+        monkeypatch.setattr(stripe, 'api_base', stripe_stand_in['api_base'])
+        monkeypatch.setattr(stripe, 'max_network_retries', 1)
+        monkeypatch.setattr(stripe, 'default_http_client', stripe_client.StripeHTTPClient(timeout=(1, 0.2)))
+        monkeypatch.setattr(stripe_client.StripeHTTPClient, 'INITIAL_DELAY', 0.01)
+        stripe_stand_in['delay'] = 0.5
+
+        with stripe_client.count_stripe_calls() as counter, pytest.raises(stripe.error.APIConnectionError):
+            stripe.Subscription.list()
+        assert counter['calls'] == 2
+        metrics = stripe_client.metrics()
+        assert (metrics['calls'], metrics['attempts'], metrics['failures']) == (1, 2, 1)
+        assert metrics['latency_seconds']['max'] < 1.5
+
+    def test_checkout_fails_fast_while_stripe_is_down(self, settings, authenticated_client, user):
+        """Test that checkout returns 503 without calling Stripe while the breaker is open"""
+        from .models import Subscription
+        from . import stripe_client
+        Subscription.objects.create(user=user, stripe_customer_id='cus_down')
+        for _ in range(settings.STRIPE_BREAKER_FAILURE_THRESHOLD):
+            stripe_client.breaker.record_failure()
+
+        response = authenticated_client.post(reverse('users:create_checkout'), {}, format='json')
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response['Retry-After'] == str(settings.STRIPE_BREAKER_RESET_SECONDS)
+        assert stripe_client.metrics()['rejected'] == 1
+
+
+@pytest.mark.django_db
+class TestSubscriptionExpiry:
+    """Test the lapsed subscription sweep"""
+
+    def _subscription(self, username, period_end, sub_status='active'):
+        from .models import Subscription
+        user = User.objects.create_user(username=username, password='testpass123')
+        return Subscription.objects.create(
+            user=user, tier='premium', status=sub_status, current_period_end=period_end,
+            stripe_customer_id=f'cus_{username}', stripe_subscription_id=f'sub_{username}',
+        )
+
+    def test_sweep_downgrades_only_lapsed_rows(self, django_assert_num_queries):
+        """Test that one UPDATE downgrades active rows past the grace period"""
+        from django.utils import timezone
+        from . import stripe_service
+        now = timezone.now()
+        lapsed = self._subscription('lapsed', now - timedelta(days=3))
+        in_grace = self._subscription('grace', now - timedelta(hours=1))
+        current = self._subscription('current', now + timedelta(days=20))
+        canceled = self._subscription('canceled', now - timedelta(days=3), sub_status='canceled')
+
+        with django_assert_num_queries(1):
+            assert stripe_service.expire_lapsed_subscriptions() == 1
+        assert stripe_service.expire_lapsed_subscriptions() == 0
+
+        for row in (lapsed, in_grace, current, canceled):
+            row.refresh_from_db()
+        assert (lapsed.status, lapsed.is_premium) == ('past_due', False)
+        assert in_grace.is_premium and current.is_premium
+        assert canceled.status == 'canceled'
+
+    def test_lapsed_row_is_not_premium_and_renewal_restores_it(self):
+        """Test that is_premium honours the period end and a late renewal webhook recovers"""
+        from django.utils import timezone
+        from . import stripe_service
+        lapsed = self._subscription('lapsed', timezone.now() - timedelta(days=3))
+        assert not lapsed.is_premium
+
+        stripe_service.expire_lapsed_subscriptions()
+        stripe_service.handle_subscription_updated({
+            'id': 'sub_lapsed', 'status': 'active',
+            'current_period_start': PERIOD_START, 'current_period_end': PERIOD_START + 30 * 86400,
+        })
+        lapsed.refresh_from_db()
+        assert lapsed.is_premium
+
+    def test_command_reports_count(self):
+        """Test the expire_subscriptions management command"""
+        from io import StringIO
+        from django.core.management import call_command
+        from django.utils import timezone
+        self._subscription('lapsed', timezone.now() - timedelta(days=3))
+        out = StringIO()
+        call_command('expire_subscriptions', stdout=out)
+        assert 'Downgraded 1 lapsed subscription(s)' in out.getvalue()
+
+
+@pytest.mark.django_db
+class TestEntitlements:
+    """Test the cached premium entitlement resolver"""
+
+    def _premium(self, user):
+        from .models import Subscription
+        return Subscription.objects.create(
+            user=user, tier='premium', status='active', billing_interval='monthly',
+            stripe_customer_id='cus_entitled', stripe_subscription_id='sub_entitled',
+        )
+
+    def test_status_is_served_from_cache(self, authenticated_client, user):
+        """Test that a repeat subscription status request does not query Subscription"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self._premium(user)
+        url = reverse('users:subscription_status')
+        assert authenticated_client.get(url).data['is_premium'] is True
+
+        with CaptureQueriesContext(connection) as queries:
+            response = authenticated_client.get(url)
+        assert response.data['tier'] == 'premium' and response.data['is_premium'] is True
+        assert not [query for query in queries if 'users_subscription' in query['sql']]
+
+    def test_cancel_invalidates_cached_entitlement(self, user, monkeypatch, django_capture_on_commit_callbacks):
+        """Test that saving the Subscription row evicts the owner's entitlement"""
+        import stripe
+        from . import entitlements, stripe_service
+        self._premium(user)
+        assert entitlements.resolve(user).is_premium
+
+        monkeypatch.setattr(stripe.Subscription, 'delete', lambda subscription_id: None)
+        with django_capture_on_commit_callbacks(execute=True):
+            assert stripe_service.cancel_subscription(user)
+        entitlement = entitlements.resolve(user)
+        assert (entitlement.tier, entitlement.status, entitlement.is_premium) == ('free', 'canceled', False)
+
+    def test_cache_is_bounded_and_premium_permission(self, settings, user):
+        """Test LRU eviction and the IsPremium permission"""
+        from rest_framework.response import Response
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from rest_framework.views import APIView
+        from . import entitlements
+        settings.ENTITLEMENT_CACHE_MAX_ENTRIES = 2
+        others = [User.objects.create_user(username=f'free{n}', password='testpass123') for n in range(3)]
+        for other in others:
+            assert not entitlements.resolve(other).is_premium
+        assert len(entitlements._cache) == 2
+        assert entitlements._cache.get(others[0].pk) is None
+
+        self._premium(user)
+
+        class PremiumView(APIView):
+            permission_classes = [entitlements.IsPremium]
+
+            def get(self, request):
+                return Response({'ok': True})
+
+        factory = APIRequestFactory()
+        for account, expected in ((user, 200), (others[0], 403)):
+            request = factory.get('/premium')
+            force_authenticate(request, user=account)
+            assert PremiumView.as_view()(request).status_code == expected
+
+
+@pytest.mark.django_db
+class TestSessionEngine:
+    """Test the cached, rarely-saved session engine"""
+
+    def _login(self, client):
+        response = client.post(reverse('users:login'), {'username': 'testuser', 'password': 'testpass123'},
+                               content_type='application/json')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_reads_do_not_touch_session_table(self, client, user, locmem_cache, monkeypatch):
+        """Test that authenticated requests read the session from a shared cache and don't save it"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from . import sessions
+        # Stand in for a cache shared by every worker
+        monkeypatch.setattr(sessions, 'PROCESS_LOCAL_CACHES', ())
+        self._login(client)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('users:current_user'))
+        assert response.status_code == status.HTTP_200_OK
+        assert not [query for query in queries if 'django_session' in query['sql']]
+        assert 'sessionid' not in response.cookies
+
+    def test_process_local_cache_is_bypassed(self, client, user, locmem_cache):
+        """Test that a logout handled by another worker is seen at once with a per-process cache"""
+        from django.contrib.sessions.models import Session
+        self._login(client)
+        assert client.get(reverse('users:current_user')).status_code == status.HTTP_200_OK
+
+        # Another worker's logout deletes the row; its cache is not this one
+        Session.objects.all().delete()
+        assert client.get(reverse('users:current_user')).status_code == status.HTTP_403_FORBIDDEN
+
+    def test_expiry_refreshed_once_per_interval(self, client, user, settings, monkeypatch):
+        """Test that an unmodified session is saved again after the refresh interval"""
+        from django.contrib.sessions.models import Session
+        from . import sessions
+        self._login(client)
+        expires = Session.objects.get().expire_date
+
+        now = time.time() + settings.SESSION_REFRESH_INTERVAL_SECONDS + 1
+        monkeypatch.setattr(sessions.time, 'time', lambda: now)
+        response = client.get(reverse('users:current_user'))
+        assert 'sessionid' in response.cookies
+        assert Session.objects.get().expire_date > expires
+        assert 'sessionid' not in client.get(reverse('users:current_user')).cookies
+
+    def test_oauth_state_and_purge(self, client):
+        """Test that OAuth state is stored, and purge_sessions removes only expired rows"""
+        from io import StringIO
+        from django.contrib.sessions.models import Session
+        from django.core.management import call_command
+        from django.utils import timezone
+        response = client.get('/accounts/google/login/')
+        assert response.status_code == status.HTTP_302_FOUND
+        assert 'socialaccount_states' in client.session
+
+        Session.objects.bulk_create([
+            Session(session_key=f'expired{n}', session_data='', expire_date=timezone.now() - timedelta(days=1))
+            for n in range(5)
+        ])
+        out = StringIO()
+        call_command('purge_sessions', chunk_size=2, stdout=out)
+        assert 'Purged 5 expired session(s)' in out.getvalue()
+        assert list(Session.objects.values_list('session_key', flat=True)) == [client.session.session_key]
+
+
+@pytest.mark.django_db
+class TestRateLimits:
+    """Test the shared GCRA rate limiter"""
+
+    def _login(self, client, username, ip):
+        return client.post(reverse('users:login'), {'username': username, 'password': 'wrong'},
+                           format='json', REMOTE_ADDR=ip)
+
+    def test_login_limited_per_ip_in_one_query(self, api_client, settings, django_assert_num_queries):
+        """Test that a burst beyond the IP rate gets 429, each check costing one statement"""
+        from . import throttling
+        settings.RATE_LIMITS = {'auth_ip': '3/min', 'auth_account': '100/min'}
+        for n in range(3):
+            assert self._login(api_client, f'user{n}', '10.0.0.1').status_code == status.HTTP_400_BAD_REQUEST
+        response = self._login(api_client, 'user9', '10.0.0.1')
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert 0 < int(response['Retry-After']) <= 20
+        assert self._login(api_client, 'user9', '10.0.0.2').status_code == status.HTTP_400_BAD_REQUEST
+
+        with django_assert_num_queries(1):
+            assert throttling.check('auth_ip:10.0.0.3', '3/min') == (True, None)
+
+    def test_login_limited_per_account_and_ip(self, api_client, settings, user):
+        """Test that guesses against one account are limited, without locking out other IPs"""
+        settings.RATE_LIMITS = {'auth_ip': '100/min', 'auth_account': '2/hour'}
+        for name in ('TestUser', 'testuser '):
+            assert self._login(api_client, name, '10.0.1.1').status_code == status.HTTP_400_BAD_REQUEST
+        assert self._login(api_client, 'testuser', '10.0.1.1').status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert self._login(api_client, 'someone', '10.0.1.1').status_code == status.HTTP_400_BAD_REQUEST
+
+        response = api_client.post(reverse('users:login'), {'username': 'testuser', 'password': 'testpass123'},
+                                   format='json', REMOTE_ADDR='10.0.1.2')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_forwarded_for_only_trusted_from_proxies(self, api_client, settings):
+        """Test that a client-supplied X-Forwarded-For cannot dodge the IP limit"""
+        settings.RATE_LIMITS = {'auth_ip': '1/min', 'auth_account': '100/min'}
+        settings.REST_FRAMEWORK = {**settings.REST_FRAMEWORK, 'NUM_PROXIES': 2}
+        settings.TRUSTED_PROXY_IPS = []
+        settings.PROXY_SECRET = 'proxy-secret'
+
+        def login(remote_addr, forwarded_for, **headers):
+            return api_client.post(reverse('users:login'), {'username': 'user', 'password': 'wrong'},
+                                   format='json', REMOTE_ADDR=remote_addr, HTTP_X_FORWARDED_FOR=forwarded_for,
+                                   **headers)
+
+        # Called directly (or with the wrong secret): the header is ignored
+        assert login('10.0.2.1', '1.1.1.1, 10.0.3.1').status_code == status.HTTP_400_BAD_REQUEST
+        assert login('10.0.2.1', '2.2.2.2, 10.0.3.1').status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert login('10.0.2.1', '3.3.3.3, 10.0.3.1',
+                     HTTP_X_PROXY_SECRET='guess').status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+        # Through the proxy (Vercel, then Render): only the hops they added are trusted
+        assert login('10.0.2.1', '4.4.4.4, 198.51.100.7, 10.0.3.1',
+                     HTTP_X_PROXY_SECRET='proxy-secret').status_code == status.HTTP_400_BAD_REQUEST
+        assert login('10.0.2.1', '5.5.5.5, 198.51.100.7, 10.0.3.1',
+                     HTTP_X_PROXY_SECRET='proxy-secret').status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+        # A proxy trusted by address needs no secret
+        settings.PROXY_SECRET = ''
+        settings.TRUSTED_PROXY_IPS = ['10.0.4.0/24']
+        assert login('10.0.4.5', '198.51.100.8, 10.0.3.1').status_code == status.HTTP_400_BAD_REQUEST
+        assert login('10.0.5.5', '198.51.100.9, 10.0.3.1').status_code == status.HTTP_400_BAD_REQUEST
+        assert login('10.0.5.5', '198.51.100.10, 10.0.3.1').status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+    @pytest.mark.parametrize('store', ['database', 'local'])
+    def test_bucket_refills_and_purge(self, settings, monkeypatch, store):
+        """Test GCRA refill with both stores, and purging idle buckets"""
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import RateLimitBucket
+        from . import throttling
+        settings.RATE_LIMIT_STORE = store
+        throttling._stores['local'].clear()
+        clock = [time.time()]
+        monkeypatch.setattr(throttling, 'time', lambda: clock[0])
+
+        assert [throttling.check('refill', '2/min')[0] for _ in range(3)] == [True, True, False]
+        assert throttling.check('refill', '2/min') == (False, pytest.approx(30))
+        clock[0] += 30
+        assert throttling.check('refill', '2/min') == (True, None)
+        assert throttling.check('refill', '2/min')[0] is False
+
+        if store == 'database':
+            RateLimitBucket.objects.create(key='idle', tat=time.time() - 1)
+            out = StringIO()
+            call_command('purge_rate_limits', stdout=out)
+            assert 'Purged 1 idle rate limit bucket(s)' in out.getvalue()
+            assert list(RateLimitBucket.objects.values_list('key', flat=True)) == ['refill']
+
+
+@pytest.fixture
+def locmem_cache(settings):
+    """Use a real in-memory cache instead of the testing DummyCache"""
+    settings.CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'quest-tests'},
+    }
+    from django.core.cache import cache
+    cache.clear()
+    yield cache
+    cache.clear()
+
+
+@pytest.mark.django_db
+class TestQuestCache:
+    """Test the versioned per-user quest response cache"""
+
+    def test_history_cached_until_write(self, authenticated_client, user, locmem_cache,
+                                        django_capture_on_commit_callbacks):
+        """Test that history is served from cache and invalidated by a save"""
+        url = reverse('users:quest_history')
+        progress = QuestProgress.objects.create(user=user, date=date.today() - timedelta(days=1))
+        assert len(authenticated_client.get(url).data) == 1
+
+        # Writes that bypass model signals are not seen...
+        QuestProgress.objects.filter(pk=progress.pk).update(quest_1_text='Hidden')
+        assert authenticated_client.get(url).data[0]['quest_1_text'] == ''
+
+        # ...but any model save bumps the user's data version
+        with django_capture_on_commit_callbacks(execute=True):
+            authenticated_client.post(reverse('users:quest_progress'), {'quest_1_text': 'Today'}, format='json')
+        data = authenticated_client.get(url).data
+        assert len(data) == 2
+        assert data[0]['quest_1_text'] == 'Hidden'
+
+    def test_single_flight_waits_for_builder(self, user, locmem_cache, settings):
+        """Test that a concurrent miss waits for the in-flight build instead of rebuilding"""
+        import threading
+        from . import quest_cache
+
+        settings.QUEST_CACHE_POLL_INTERVAL = 0.01
+        version = quest_cache.get_data_version(user.pk)
+        key = f'quests:{user.pk}:{version}:stats:"etag"'
+        locmem_cache.add(f'{key}:lock', 1)
+        threading.Timer(0.05, lambda: locmem_cache.set(key, {'streak': 7})).start()
+
+        def build():
+            raise AssertionError('should not rebuild while another request holds the lock')
+
+        assert quest_cache.get_or_build(user.pk, 'stats', build, state='"etag"') == {'streak': 7}
+
+    def test_write_from_another_worker_is_seen(self, authenticated_client, user, locmem_cache):
+        """Test that a write this process never bumped for still misses the cache"""
+        url = reverse('users:quest_history')
+        progress = QuestProgress.objects.create(user=user, date=date.today())
+        etag = authenticated_client.get(url)['ETag']
+
+        # What a save committed by another worker looks like here: no version bump
+        QuestProgress.objects.filter(pk=progress.pk).update(
+            quest_1_text='New', updated_at=progress.updated_at + timedelta(seconds=1)
+        )
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data[0]['quest_1_text'] == 'New'
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.django_db
+class TestConditionalGet:
+    """Test ETag / Last-Modified handling on polled endpoints"""
+
+    def test_history_not_modified(self, authenticated_client, user):
+        """Test that an unchanged history answers 304 and a write changes the ETag"""
+        url = reverse('users:quest_history')
+        QuestProgress.objects.create(user=user, date=date.today())
+        response = authenticated_client.get(url)
+        etag = response['ETag']
+        assert response.status_code == status.HTTP_200_OK
+        assert 'Last-Modified' in response
+
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert not response.content
+
+        QuestProgress.objects.create(user=user, date=date.today() - timedelta(days=1))
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+
+    def test_stats_validator_reads_only_user_stats(self, authenticated_client, user):
+        """Test that revalidating stats never aggregates over the progress history"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        url = reverse('users:quest_stats')
+        authenticated_client.post(reverse('users:quest_progress'), {'quest_1_text': 'Run'}, format='json')
+        etag = authenticated_client.get(url)['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert not [query for query in queries if 'users_questprogress' in query['sql']]
+
+        authenticated_client.post(reverse('users:quest_progress'), {'quest_1_completed': True}, format='json')
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['total_xp'] == 1
+
+    def test_subscription_not_modified(self, authenticated_client, user, django_capture_on_commit_callbacks):
+        """Test conditional GET on the subscription endpoint"""
+        from .models import Subscription
+
+        url = reverse('users:subscription_status')
+        etag = authenticated_client.get(url)['ETag']
+        with django_capture_on_commit_callbacks(execute=True):
+            Subscription.objects.create(user=user)
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    def test_subscription_lapse_changes_etag(self, authenticated_client, user, settings,
+                                             django_capture_on_commit_callbacks):
+        """Test that a premium period lapsing without any write is not answered with 304"""
+        from django.utils import timezone
+        from .models import Subscription
+
+        url = reverse('users:subscription_status')
+        with django_capture_on_commit_callbacks(execute=True):
+            Subscription.objects.create(user=user, tier='premium', current_period_end=timezone.now())
+        response = authenticated_client.get(url)
+        assert response.data['is_premium'] is True
+
+        settings.SUBSCRIPTION_EXPIRY_GRACE_HOURS = 0
+        response = authenticated_client.get(url, HTTP_IF_NONE_MATCH=response['ETag'],
+                                             HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['is_premium'] is False
+
+    def test_writes_are_not_conditional(self, authenticated_client, user):
+        """Test that POST to quests/today ignores validators"""
+        url = reverse('users:quest_progress')
+        etag = authenticated_client.get(url)['ETag']
+        response = authenticated_client.post(url, {'quest_1_text': 'Write'}, format='json', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_201_CREATED
+
+
+@pytest.mark.django_db
+class TestQuestBulkSync:
+    """Test the set-based bulk sync endpoint"""
+
+    def test_per_item_results(self, authenticated_client, user):
+        """Test created/updated/rejected results and the submitted lock"""
+        today = date.today()
+        QuestProgress.objects.create(user=user, date=today - timedelta(days=1), quest_1_text='Keep me')
+        QuestProgress.objects.create(user=user, date=today - timedelta(days=2), submitted=True)
+
+        response = authenticated_client.post(reverse('users:quest_bulk_sync'), {'quests': [
+            {'date': today.isoformat(), 'quest_1_completed': True},
+            {'date': (today - timedelta(days=1)).isoformat(), 'quest_2_completed': True},
+            {'date': (today - timedelta(days=2)).isoformat(), 'quest_1_completed': True},
+            {'date': 'not-a-date'},
+            {'quest_1_completed': True},
+        ]}, format='json')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['synced_count'] == 2
+        assert [r['status'] for r in response.data['results']] == [
+            'created', 'updated', 'rejected', 'rejected', 'rejected',
+        ]
+        assert 'submitted' in response.data['results'][2]['reason']
+
+        yesterday = QuestProgress.objects.get(user=user, date=today - timedelta(days=1))
+        assert yesterday.quest_1_text == 'Keep me'
+        assert yesterday.quest_2_completed is True
+        assert QuestProgress.objects.get(user=user, date=today - timedelta(days=2)).quest_1_completed is False
+
+    def test_year_of_history_in_constant_queries(self, authenticated_client, user, django_assert_max_num_queries):
+        """Test that syncing a year does not issue a query per day"""
+        today = date.today()
+        days = [
+            {'date': (today - timedelta(days=i)).isoformat(), 'quest_1_text': f'Day {i}', 'quest_1_completed': True}
+            for i in range(365)
+        ]
+        with django_assert_max_num_queries(20):
+            response = authenticated_client.post(reverse('users:quest_bulk_sync'), days, format='json')
+
+        assert response.data['created'] == 365
+        assert QuestProgress.objects.filter(user=user).count() == 365
+        assert UserStats.objects.get(pk=user.pk).total_xp == 365
+
+
+@pytest.mark.django_db
+class TestQuestBulkSyncStream:
+    """Test streaming, chunked bulk sync"""
+
+    def _days(self, count):
+        today = date.today()
+        return [
+            {'date': (today - timedelta(days=i)).isoformat(), 'quest_1_completed': True}
+            for i in range(count)
+        ]
+
+    def test_ndjson_committed_in_chunks(self, authenticated_client, user, settings):
+        """Test NDJSON ingestion with bad lines rejected and chunked commits"""
+        import json
+
+        settings.QUEST_SYNC_CHUNK_SIZE = 4
+        lines = [json.dumps(day) for day in self._days(10)]
+        lines.insert(3, '{not json')
+        response = authenticated_client.post(
+            reverse('users:quest_bulk_sync_stream'),
+            '\n'.join(lines),
+            content_type='application/x-ndjson',
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['records'] == 11
+        assert response.data['created'] == 10
+        assert response.data['rejected'] == 1
+        assert response.data['rejections'][0]['index'] == 3
+        assert response.data['chunks_committed'] == 3
+        assert response.data['complete'] is True
+        assert QuestProgress.objects.filter(user=user).count() == 10
+
+    def test_json_array_and_size_limit(self, authenticated_client, user, settings):
+        """Test JSON array bodies and the configurable maximum body size"""
+        import json
+
+        url = reverse('users:quest_bulk_sync_stream')
+        body = json.dumps(self._days(5))
+        response = authenticated_client.post(url, body, content_type='application/json')
+        assert response.data['synced_count'] == 5
+
+        settings.QUEST_SYNC_MAX_BODY_BYTES = len(body) - 1
+        response = authenticated_client.post(url, body, content_type='application/json')
+        assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+    def test_chunked_upload_without_content_length(self, authenticated_client, user):
+        """Test that a body sent without Content-Length is read to the end, or refused with 411"""
+        import io
+        import json
+        url = reverse('users:quest_bulk_sync_stream')
+        body = '\n'.join(json.dumps(day) for day in self._days(3))
+
+        # gunicorn decodes chunked bodies and marks the stream as ending with them
+        response = authenticated_client.post(url, body, content_type='application/x-ndjson', CONTENT_LENGTH='',
+                                             **{'wsgi.input': io.BytesIO(body.encode()),
+                                                'wsgi.input_terminated': True})
+        assert response.status_code == status.HTTP_200_OK
+        assert (response.data['records'], response.data['created']) == (3, 3)
+        assert QuestProgress.objects.filter(user=user).count() == 3
+
+        response = authenticated_client.post(url, body, content_type='application/json', CONTENT_LENGTH='')
+        assert response.status_code == status.HTTP_411_LENGTH_REQUIRED
+
+
+@pytest.mark.django_db
+class TestQuestChanges:
+    """Test delta sync with server-issued cursors"""
+
+    def test_changes_since_cursor(self, authenticated_client, user, settings):
+        """Test that a cursor returns only rows changed or deleted after it"""
+        settings.QUEST_CHANGES_SETTLE_SECONDS = 0
+        url = reverse('users:quest_changes')
+        today = date.today()
+        first = QuestProgress.objects.create(user=user, date=today - timedelta(days=1))
+        QuestProgress.objects.create(user=user, date=today - timedelta(days=2))
+
+        response = authenticated_client.get(url)
+        assert len(response.data['changes']) == 2
+        assert response.data['has_more'] is False
+        cursor = response.data['cursor']
+
+        response = authenticated_client.get(url, {'since': cursor})
+        assert response.data['changes'] == []
+        assert response.data['deleted'] == []
+
+        first.quest_1_text = 'Edited'
+        first.save()
+        QuestProgress.objects.filter(date=today - timedelta(days=2)).delete()
+        response = authenticated_client.get(url, {'since': cursor})
+        assert [row['quest_1_text'] for row in response.data['changes']] == ['Edited']
+        assert response.data['deleted'][0]['date'] == (today - timedelta(days=2)).isoformat()
+
+    def test_paging_and_bad_cursor(self, authenticated_client, user, settings):
+        """Test keyset paging with has_more and rejection of tampered cursors"""
+        settings.QUEST_CHANGES_SETTLE_SECONDS = 0
+        url = reverse('users:quest_changes')
+        for i in range(5):
+            QuestProgress.objects.create(user=user, date=date.today() - timedelta(days=i))
+
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2, **({'since': cursor} if cursor else {})}
+            response = authenticated_client.get(url, params)
+            seen.extend(row['id'] for row in response.data['changes'])
+            cursor = response.data['cursor']
+            if not response.data['has_more']:
+                break
+        assert len(seen) == len(set(seen)) == 5
+
+        response = authenticated_client.get(url, {'since': cursor + 'x'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_account_deletion_leaves_no_tombstones(self, user):
+        """Test that cascading deletes from the user do not create tombstones"""
+        from .models import QuestProgressTombstone
+
+        QuestProgress.objects.create(user=user, date=date.today())
+        user.delete()
+        assert not QuestProgressTombstone.objects.exists()
+
+
+@pytest.mark.django_db
+class TestQuestHistoryWindow:
+    """Test date-bounded, keyset-paginated history"""
+
+    def test_default_window(self, authenticated_client, user, settings):
+        """Test that history defaults to the heatmap window"""
+        today = date.today()
+        for i in (0, settings.QUEST_HISTORY_DEFAULT_DAYS - 1, settings.QUEST_HISTORY_DEFAULT_DAYS):
+            QuestProgress.objects.create(user=user, date=today - timedelta(days=i))
+
+        response = authenticated_client.get(reverse('users:quest_history'))
+        assert len(response.data) == 2
+        assert 'Link' not in response
+
+    def test_keyset_pages(self, authenticated_client, user):
+        """Test from/to bounds and following the next-page cursor"""
+        start = date(2024, 1, 1)
+        for i in range(5):
+            QuestProgress.objects.create(user=user, date=start + timedelta(days=i))
+
+        url = reverse('users:quest_history')
+        response = authenticated_client.get(url, {'from': '2024-01-02', 'to': '2024-01-05', 'limit': 2})
+        assert [row['date'] for row in response.data] == ['2024-01-02', '2024-01-03']
+        assert 'cursor=2024-01-03' in response['Link']
+
+        response = authenticated_client.get(url, {'from': '2024-01-02', 'to': '2024-01-05', 'limit': 2,
+                                                  'cursor': '2024-01-03'})
+        assert [row['date'] for row in response.data] == ['2024-01-04', '2024-01-05']
+        assert 'Link' not in response
+
+        response = authenticated_client.get(url, {'from': '2024-01-05', 'to': '2024-01-01'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestQuestHistoryBitmap:
+    """Test the packed heatmap history encoding"""
+
+    def test_year_fits_under_1kb(self, authenticated_client, user):
+        """Test encoding a year of history and decoding it back"""
+        from .history_bitmap import decode_history
+
+        today = date.today()
+        QuestProgress.objects.create(
+            user=user, date=today, quest_1_text='Read', quest_1_completed=True, quest_3_completed=True,
+        )
+        QuestProgress.objects.create(user=user, date=today - timedelta(days=364), quest_2_text='Run')
+
+        response = authenticated_client.get(reverse('users:quest_history_bitmap'))
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['days'] == 365
+        assert len(response.content) < 1024
+
+        start = date.fromisoformat(response.data['start'])
+        history = decode_history(response.data['data'], start, response.data['days'])
+        assert history == {
+            today - timedelta(days=364): [0, 1, 0],
+            today: [3, 0, 2],
+        }
+
+
 @pytest.mark.django_db
 class TestQuestProgressModel:
     """Test QuestProgress model"""
@@ -229,6 +1783,26 @@ class TestQuestProgressModel:
                 date=date.today(),
             )
 
+    def test_completion_mask_maintained(self, user):
+        """Test that completion_mask follows save(), update() and bulk_create()"""
+        progress = QuestProgress.objects.create(user=user, date=date.today(), quest_1_completed=True)
+        assert progress.completion_mask == 0b001
+
+        progress.quest_3_completed = True
+        progress.save(update_fields=['quest_3_completed'])
+        progress.refresh_from_db()
+        assert progress.completion_mask == 0b101
+
+        QuestProgress.objects.filter(pk=progress.pk).update(quest_2_completed=True)
+        progress.refresh_from_db()
+        assert progress.completion_mask == 0b111
+
+        QuestProgress.objects.bulk_create([
+            QuestProgress(user=user, date=date.today() - timedelta(days=1), quest_2_completed=True),
+        ])
+        totals = QuestProgress.objects.filter(user=user).completion_totals()
+        assert totals == {'days': 2, 'full_days': 1, 'xp': 4}
+
     def test_quest_progress_str_representation(self, user):
         """Test string representation of QuestProgress"""
         progress = QuestProgress.objects.create(
@@ -0,0 +1,198 @@
+"""
+Rate limiting shared by every worker process.
+
+DRF's cache-based throttles keep their counters in the default cache, which is
+per-process LocMem unless a shared cache is configured, so limits multiply with
+the number of workers and reset on restart. These throttles keep their state
+in the database instead.
+
+Limits use GCRA (the generic cell rate algorithm), a token bucket stored as a
+single timestamp per client: a rate of "10/min" allows bursts of 10 and
+refills one request every 6 seconds. Each check is one INSERT ... ON CONFLICT
+DO UPDATE ... RETURNING statement, so it costs one round trip and concurrent
+workers never race. Rates are configured per scope in RATE_LIMITS. With
+RATE_LIMIT_STORE = 'local' state is kept in process memory instead, which is
+only suitable for a single process (development, tests).
+
+Clients are identified by REMOTE_ADDR, or by X-Forwarded-For (NUM_PROXIES hops
+back) on requests from a trusted proxy: see TRUSTED_PROXY_IPS and PROXY_SECRET.
+"""
+import hashlib
+import hmac
+import ipaddress
+import threading
+from time import time
+from django.conf import settings
+from django.db import connection
+from rest_framework.throttling import BaseThrottle
+from .models import RateLimitBucket
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """Return (requests, period_seconds) for a rate such as '10/min'"""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class DatabaseStore:
+    """GCRA state in the RateLimitBucket table, updated with one upsert"""
+
+    def hit(self, key, limit, period, now):
+        interval = period / limit
+        table = connection.ops.quote_name(RateLimitBucket._meta.db_table)
+        key_column, tat, allowed = (connection.ops.quote_name(name) for name in ('key', 'tat', 'allowed'))
+        greatest = 'MAX' if connection.vendor == 'sqlite' else 'GREATEST'
+        start = f'{greatest}({table}.{tat}, %s)'
+        # SET expressions all see the row as it was before the update
+        sql = f'''
+            INSERT INTO {table} ({key_column}, {tat}, {allowed}) VALUES (%s, %s, %s)
+            ON CONFLICT ({key_column}) DO UPDATE SET
+                {allowed} = ({start} + %s - %s <= %s),
+                {tat} = CASE WHEN {start} + %s - %s <= %s THEN {start} + %s ELSE {table}.{tat} END
+            RETURNING {allowed}, {tat}
+        '''
+        params = [
+            key, now + interval, True,
+            now, interval, now, period,
+            now, interval, now, period, now, interval,
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            is_allowed, new_tat = cursor.fetchone()
+        return bool(is_allowed), new_tat
+
+
+class LocalStore:
+    """GCRA state in process memory, for single-process use"""
+
+    def __init__(self):
+        self._tats = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, period, now):
+        interval = period / limit
+        with self._lock:
+            start = max(self._tats.get(key, now), now)
+            allowed = start + interval - now <= period
+            if allowed:
+                self._tats[key] = start + interval
+            return allowed, self._tats[key]
+
+    def clear(self):
+        with self._lock:
+            self._tats.clear()
+
+
+_stores = {'database': DatabaseStore(), 'local': LocalStore()}
+
+
+def get_store():
+    return _stores[settings.RATE_LIMIT_STORE]
+
+
+def check(key, rate):
+    """
+    Record a request against `key` at `rate`; returns (allowed, wait_seconds).
+
+    wait_seconds is how long until the next request would be allowed, or
+    None when this one was.
+    """
+    limit, period = parse_rate(rate)
+    now = time()
+    allowed, tat = get_store().hit(key, limit, period, now)
+    if allowed:
+        return True, None
+    return False, max(tat + period / limit - period - now, 0)
+
+
+def from_trusted_proxy(request):
+    """Whether the request came through a proxy allowed to set X-Forwarded-For"""
+    secret = request.META.get('HTTP_X_PROXY_SECRET', '')
+    if settings.PROXY_SECRET and hmac.compare_digest(secret.encode(), settings.PROXY_SECRET.encode()):
+        return True
+    if not settings.TRUSTED_PROXY_IPS:
+        return False
+    try:
+        remote_addr = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(remote_addr in ipaddress.ip_network(proxy, strict=False) for proxy in settings.TRUSTED_PROXY_IPS)
+
+
+class SharedRateThrottle(BaseThrottle):
+    """
+    Base class for throttles backed by the shared store.
+
+    Subclasses set `scope` (a key of RATE_LIMITS) and implement get_ident_key().
+    Scopes without a configured rate are not limited.
+    """
+
+    scope = None
+
+    def get_ident_key(self, request, view):
+        """Return the identity to limit, or None to skip this request"""
+        raise NotImplementedError('.get_ident_key() must be overridden')
+
+    def get_ident(self, request):
+        """Client IP, from X-Forwarded-For only on requests from a trusted proxy"""
+        if not from_trusted_proxy(request):
+            return request.META.get('REMOTE_ADDR')
+        return super().get_ident(request)
+
+    def allow_request(self, request, view):
+        rate = settings.RATE_LIMITS.get(self.scope)
+        ident = self.get_ident_key(request, view)
+        if not rate or ident is None:
+            return True
+        allowed, self.wait_seconds = check(f'{self.scope}:{ident}', rate)
+        return allowed
+
+    def wait(self):
+        return getattr(self, 'wait_seconds', None)
+
+
+class IPRateThrottle(SharedRateThrottle):
+    """Limit by client IP (see get_ident)"""
+
+    def get_ident_key(self, request, view):
+        return self.get_ident(request)
+
+
+class AccountRateThrottle(SharedRateThrottle):
+    """
+    Limit by the account a request targets, per client IP. The account is the
+    authenticated user, or else the first of `account_fields` present in the
+    request body.
+
+    Bounds password guessing against one account well below the per-IP rate.
+    The client IP is part of the key, so requests naming an account from
+    elsewhere can never lock its owner out. Identifiers are hashed, so the
+    store never holds raw usernames or emails.
+    """
+
+    account_fields = ('username', 'email')
+
+    def get_account(self, request):
+        if request.user and request.user.is_authenticated:
+            return f'user:{request.user.pk}'
+        for field in self.account_fields:
+            value = request.data.get(field) if hasattr(request.data, 'get') else None
+            if isinstance(value, str) and value.strip():
+                return value.strip().lower()
+        return None
+
+    def get_ident_key(self, request, view):
+        account = self.get_account(request)
+        if account is None:
+            return None
+        return hashlib.sha256(f'{account}\n{self.get_ident(request)}'.encode()).hexdigest()[:32]
+
+
+class AuthIPRateThrottle(IPRateThrottle):
+    scope = 'auth_ip'
+
+
+class AuthAccountRateThrottle(AccountRateThrottle):
+    scope = 'auth_account'
@@ -16,12 +16,16 @@ urlpatterns = [
     path('quests/lock-choices', views.lock_choices_view, name='lock_choices'),
     path('quests/submit', views.submit_quest_view, name='submit_quest'),
     path('quests/history', views.quest_history_view, name='quest_history'),
+    path('quests/history/bitmap', views.quest_history_bitmap_view, name='quest_history_bitmap'),
     path('quests/stats', views.quest_stats_view, name='quest_stats'),
+    path('quests/changes', views.quest_changes_view, name='quest_changes'),
     path('quests/bulk-sync', views.quest_bulk_sync_view, name='quest_bulk_sync'),
+    path('quests/bulk-sync/stream', views.quest_bulk_sync_stream_view, name='quest_bulk_sync_stream'),
     path('account/delete', views.delete_account_view, name='delete_account'),
     path('subscription', views.subscription_status_view, name='subscription_status'),
     path('subscribe', views.create_checkout_view, name='create_checkout'),
     path('cancel-subscription', views.cancel_subscription_view, name='cancel_subscription'),
     path('webhook', views.stripe_webhook_view, name='stripe_webhook'),
+    path('stripe/metrics', views.stripe_metrics_view, name='stripe_metrics'),
 ]
 
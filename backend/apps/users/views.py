@@ -1,9 +1,10 @@
 import os
+import stripe
 from rest_framework import status, viewsets
 from rest_framework.decorators import api_view, permission_classes, action, throttle_classes
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.throttling import AnonRateThrottle
+from rest_framework.utils.urls import replace_query_param
 from django.contrib.auth import login, logout
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.auth.forms import PasswordResetForm
@@ -18,20 +19,28 @@ from datetime import date, timedelta, datetime
 from allauth.socialaccount.models import SocialAccount
 from allauth.socialaccount.providers.google.views import oauth2_login
 # from allauth.socialaccount.providers.facebook.views import oauth2_login as fb_oauth2_login  # Facebook login disabled
-from .models import User, QuestProgress, Subscription
-from .serializers import UserSerializer, LoginSerializer, QuestProgressSerializer
-from . import stripe_service
+from .models import User, QuestProgress, UserStats
+from .serializers import (
+    UserSerializer, LoginSerializer, QuestProgressSerializer, QuestHistoryQuerySerializer, QuestSyncItemSerializer,
+)
+from . import backends, entitlements, hashing, history_bitmap, quest_cache, services, streaming, stripe_client, stripe_service
+from .idempotency import idempotent
+from .throttling import AuthAccountRateThrottle, AuthIPRateThrottle
+from .conditional import (
+    conditional, today_validator, history_validator, history_bitmap_validator, stats_validator,
+    subscription_validator,
+)
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
-@throttle_classes([AnonRateThrottle])
+@throttle_classes([AuthIPRateThrottle])
 def register_view(request):
     """Register a new user"""
     serializer = UserSerializer(data=request.data)
     if serializer.is_valid():
         user = serializer.save()
-        login(request, user)
+        login(request, user, backend='apps.users.backends.UsernameOrEmailBackend')
         # Create a serializer instance without password fields for response
         user_data = {
             'id': user.id,
@@ -60,10 +69,10 @@ def register_view(request):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
-@throttle_classes([AnonRateThrottle])
+@throttle_classes([AuthIPRateThrottle, AuthAccountRateThrottle])
 def login_view(request):
     """Login user"""
-    serializer = LoginSerializer(data=request.data)
+    serializer = LoginSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
         user = serializer.validated_data['user']
         login(request, user)
@@ -159,57 +168,47 @@ def social_auth_urls_view(request):
 
 @api_view(['GET', 'POST', 'PUT'])
 @permission_classes([IsAuthenticated])
+@idempotent
+@conditional(today_validator)
 def quest_progress_view(request):
     """Get or update quest progress for today"""
     today = date.today()
     
     if request.method == 'GET':
-        # Get today's progress
-        try:
-            progress = QuestProgress.objects.get(user=request.user, date=today)
-            serializer = QuestProgressSerializer(progress)
-            return Response(serializer.data)
-        except QuestProgress.DoesNotExist:
-            # Return default empty progress
-            return Response({
-                'date': today.isoformat(),
-                'quest_1_text': '',
-                'quest_2_text': '',
-                'quest_3_text': '',
-                'quest_1_completed': False,
-                'quest_2_completed': False,
-                'quest_3_completed': False,
-                'submitted': False,
-            })
+        def build():
+            # Get today's progress
+            try:
+                progress = QuestProgress.objects.get(user=request.user, date=today)
+                serializer = QuestProgressSerializer(progress)
+                return serializer.data
+            except QuestProgress.DoesNotExist:
+                # Return default empty progress
+                return {
+                    'date': today.isoformat(),
+                    'quest_1_text': '',
+                    'quest_2_text': '',
+                    'quest_3_text': '',
+                    'quest_1_completed': False,
+                    'quest_2_completed': False,
+                    'quest_3_completed': False,
+                    'submitted': False,
+                }
+
+        return Response(quest_cache.get_or_build(
+            request.user.pk, 'today', build, today.isoformat(), state=request.etag
+        ))
     
     elif request.method == 'POST' or request.method == 'PUT':
-        # Create or update today's progress
-        data = request.data.copy()
-        data['date'] = today.isoformat()
-        
-        progress, created = QuestProgress.objects.get_or_create(
-            user=request.user,
-            date=today,
-            defaults={
-                'quest_1_text': data.get('quest_1_text', ''),
-                'quest_2_text': data.get('quest_2_text', ''),
-                'quest_3_text': data.get('quest_3_text', ''),
-                'quest_1_completed': data.get('quest_1_completed', False),
-                'quest_2_completed': data.get('quest_2_completed', False),
-                'quest_3_completed': data.get('quest_3_completed', False),
-            }
-        )
-        
-        if not created:
-            # Update existing progress (but don't allow resubmission if already submitted)
-            if not progress.submitted:
-                progress.quest_1_text = data.get('quest_1_text', progress.quest_1_text)
-                progress.quest_2_text = data.get('quest_2_text', progress.quest_2_text)
-                progress.quest_3_text = data.get('quest_3_text', progress.quest_3_text)
-                progress.quest_1_completed = data.get('quest_1_completed', progress.quest_1_completed)
-                progress.quest_2_completed = data.get('quest_2_completed', progress.quest_2_completed)
-                progress.quest_3_completed = data.get('quest_3_completed', progress.quest_3_completed)
-                progress.save()
+        # Create or update today's progress; only the fields sent are written
+        serializer = QuestSyncItemSerializer(data=request.data, partial=True)
+        if not serializer.is_valid():
+            return Response({'error': 'Invalid quest progress', 'errors': serializer.errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        values = {
+            field: value for field, value in serializer.validated_data.items()
+            if field in services.QUEST_FIELDS
+        }
+        progress, created = services.save_day_progress(request.user, today, values)
         
         serializer = QuestProgressSerializer(progress)
         return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
@@ -217,75 +216,72 @@ def quest_progress_view(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def submit_quest_view(request):
     """Submit today's quest progress (one submission per day)"""
     today = date.today()
     
-    try:
-        progress = QuestProgress.objects.get(user=request.user, date=today)
-        
-        # Check if already submitted
-        if progress.submitted:
+    # Mark as submitted only if it was not already, in a single statement
+    updated = QuestProgress.objects.filter(
+        user=request.user, date=today, submitted=False,
+    ).update_returning(submitted=True, submitted_at=timezone.now())
+    
+    if not updated:
+        progress = QuestProgress.objects.filter(user=request.user, date=today).first()
+        if progress is None:
             return Response({
-                'error': 'You have already submitted today',
-                'submitted': True,
-                'submitted_at': progress.submitted_at.isoformat() if progress.submitted_at else None
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Mark as submitted
-        from django.utils import timezone
-        progress.submitted = True
-        progress.submitted_at = timezone.now()
-        progress.save()
-        
-        serializer = QuestProgressSerializer(progress)
+                'error': 'No quest progress found for today'
+            }, status=status.HTTP_404_NOT_FOUND)
         return Response({
-            'message': 'Successfully submitted!',
-            'data': serializer.data
-        }, status=status.HTTP_200_OK)
-        
-    except QuestProgress.DoesNotExist:
-        return Response({
-            'error': 'No quest progress found for today'
-        }, status=status.HTTP_404_NOT_FOUND)
+            'error': 'You have already submitted today',
+            'submitted': True,
+            'submitted_at': progress.submitted_at.isoformat() if progress.submitted_at else None
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # update() bypasses the post_save cache invalidation
+    transaction.on_commit(lambda: quest_cache.bump_data_version(request.user.pk))
+    serializer = QuestProgressSerializer(updated[0])
+    return Response({
+        'message': 'Successfully submitted!',
+        'data': serializer.data
+    }, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def lock_choices_view(request):
     """Lock in quest choices for today"""
-    from django.utils import timezone
-
     today = date.today()
 
-    try:
-        progress = QuestProgress.objects.get(user=request.user, date=today)
-
-        # Validate all 3 quests have text
-        if not all([
-            progress.quest_1_text.strip(),
-            progress.quest_2_text.strip(),
-            progress.quest_3_text.strip()
-        ]):
+    # Lock only once, and only when all 3 quests have text
+    updated = QuestProgress.objects.filter(
+        user=request.user,
+        date=today,
+        choices_locked=False,
+        quest_1_text__regex=r'\S',
+        quest_2_text__regex=r'\S',
+        quest_3_text__regex=r'\S',
+    ).update_returning(choices_locked=True, choices_locked_at=timezone.now())
+
+    if updated:
+        progress = updated[0]
+        transaction.on_commit(lambda: quest_cache.bump_data_version(request.user.pk))
+    else:
+        progress = QuestProgress.objects.filter(user=request.user, date=today).first()
+        if progress is None:
+            return Response({
+                'error': 'No quest progress found for today'
+            }, status=status.HTTP_404_NOT_FOUND)
+        if not progress.choices_locked:
             return Response({
                 'error': 'All 3 quests must have text before locking'
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Lock the choices
-        progress.choices_locked = True
-        progress.choices_locked_at = timezone.now()
-        progress.save()
-
-        serializer = QuestProgressSerializer(progress)
-        return Response({
-            'message': 'Choices locked successfully!',
-            'data': serializer.data
-        }, status=status.HTTP_200_OK)
-
-    except QuestProgress.DoesNotExist:
-        return Response({
-            'error': 'No quest progress found for today'
-        }, status=status.HTTP_404_NOT_FOUND)
+    serializer = QuestProgressSerializer(progress)
+    return Response({
+        'message': 'Choices locked successfully!',
+        'data': serializer.data
+    }, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
@@ -311,7 +307,7 @@ def delete_account_view(request):
 
     # Verify password
     user = request.user
-    if not user.check_password(password):
+    if not hashing.check_password(user, password):
         return Response({
             'error': 'Incorrect password'
         }, status=status.HTTP_400_BAD_REQUEST)
@@ -337,122 +333,258 @@ def delete_account_view(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional(history_validator)
 def quest_history_view(request):
-    """Get quest progress history for heatmap"""
-    progress_list = QuestProgress.objects.filter(user=request.user).order_by('date')
-    serializer = QuestProgressSerializer(progress_list, many=True)
-    return Response(serializer.data)
+    """
+    Get quest progress history for heatmap.
+
+    Returns days between `from` and `to` (default: the heatmap window) in date
+    order. Pages are keyed on the last date returned; when more days remain, a
+    Link: <...>; rel="next" header carries the next cursor.
+    """
+    params = QuestHistoryQuerySerializer(data=request.query_params)
+    if not params.is_valid():
+        return Response({'error': 'Invalid history parameters', 'errors': params.errors},
+                        status=status.HTTP_400_BAD_REQUEST)
+    window = params.validated_data
+
+    def build():
+        start = window['from']
+        if window.get('cursor'):
+            start = max(start, window['cursor'] + timedelta(days=1))
+        progress_list = list(QuestProgress.objects.filter(
+            user=request.user, date__gte=start, date__lte=window['to']
+        ).order_by('date')[:window['limit'] + 1])
+        next_cursor = None
+        if len(progress_list) > window['limit']:
+            progress_list = progress_list[:window['limit']]
+            next_cursor = progress_list[-1].date.isoformat()
+        serializer = QuestProgressSerializer(progress_list, many=True)
+        return serializer.data, next_cursor
+
+    data, next_cursor = quest_cache.get_or_build(
+        request.user.pk, 'history', build,
+        window['from'], window['to'], window.get('cursor'), window['limit'], state=request.etag,
+    )
+    response = Response(data)
+    if next_cursor:
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor)
+        response['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional(history_bitmap_validator)
+def quest_history_bitmap_view(request):
+    """
+    Get heatmap history as a packed bitmap (2 bits per quest per day, base64).
+
+    Defaults to the last 365 days; see apps/users/history_bitmap.py for the layout.
+    """
+    params = QuestHistoryQuerySerializer(data=request.query_params, context=history_bitmap.HISTORY_BITMAP_CONTEXT)
+    if not params.is_valid():
+        return Response({'error': 'Invalid history parameters', 'errors': params.errors},
+                        status=status.HTTP_400_BAD_REQUEST)
+    start, end = params.validated_data['from'], params.validated_data['to']
+
+    def build():
+        return {
+            'start': start.isoformat(),
+            'days': (end - start).days + 1,
+            'bits_per_quest': history_bitmap.BITS_PER_QUEST,
+            'data': history_bitmap.encode_history(request.user, start, end),
+        }
+
+    return Response(quest_cache.get_or_build(
+        request.user.pk, 'history-bitmap', build, start, end, state=request.etag
+    ))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def quest_changes_view(request):
+    """
+    Delta sync: quest rows changed and days deleted since an opaque cursor.
+
+    Omit `since` for an initial full download. Keep requesting with the returned
+    cursor while has_more is true; store the last cursor for the next sync.
+    """
+    try:
+        limit = min(int(request.query_params.get('limit', settings.QUEST_CHANGES_PAGE_SIZE)),
+                    settings.QUEST_CHANGES_PAGE_SIZE)
+        rows, tombstones, cursor, has_more = services.quest_changes(
+            request.user, request.query_params.get('since'), max(limit, 1)
+        )
+    except services.CursorExpired as e:
+        return Response({
+            'error': str(e),
+            'full_sync_required': True
+        }, status=status.HTTP_410_GONE)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'changes': QuestProgressSerializer(rows, many=True).data,
+        'deleted': [
+            {'date': tombstone.date.isoformat(), 'deleted_at': tombstone.deleted_at.isoformat()}
+            for tombstone in tombstones
+        ],
+        'cursor': cursor,
+        'has_more': has_more,
+    })
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def quest_bulk_sync_view(request):
     """Bulk sync quest progress from client"""
-    data_list = request.data if isinstance(request.data, list) else [request.data]
+    # Accept a bare list, {"quests": [...]} (the dashboard client) or a single day
+    payload = request.data
+    if isinstance(payload, dict) and isinstance(payload.get('quests'), list):
+        payload = payload['quests']
+    data_list = payload if isinstance(payload, list) else [payload]
     
-    synced_count = 0
-    for item in data_list:
-        try:
-            date_str = item.get('date')
-            if not date_str:
-                continue
-                
-            progress_date = date.fromisoformat(date_str) if isinstance(date_str, str) else date_str
-            
-            progress, created = QuestProgress.objects.get_or_create(
-                user=request.user,
-                date=progress_date,
-                defaults={
-                    'quest_1_text': item.get('quest_1_text', ''),
-                    'quest_2_text': item.get('quest_2_text', ''),
-                    'quest_3_text': item.get('quest_3_text', ''),
-                    'quest_1_completed': item.get('quest_1_completed', False),
-                    'quest_2_completed': item.get('quest_2_completed', False),
-                    'quest_3_completed': item.get('quest_3_completed', False),
-                }
-            )
-            
-            if not created:
-                # Update existing
-                progress.quest_1_text = item.get('quest_1_text', progress.quest_1_text)
-                progress.quest_2_text = item.get('quest_2_text', progress.quest_2_text)
-                progress.quest_3_text = item.get('quest_3_text', progress.quest_3_text)
-                progress.quest_1_completed = item.get('quest_1_completed', progress.quest_1_completed)
-                progress.quest_2_completed = item.get('quest_2_completed', progress.quest_2_completed)
-                progress.quest_3_completed = item.get('quest_3_completed', progress.quest_3_completed)
-                progress.save()
-            
-            synced_count += 1
-        except Exception as e:
-            continue
+    results = services.bulk_upsert_progress(request.user, data_list)
+    counts = {'created': 0, 'updated': 0, 'rejected': 0}
+    for result in results:
+        counts[result['status']] += 1
+    synced_count = counts['created'] + counts['updated']
     
     return Response({
         'synced_count': synced_count,
+        **counts,
+        'results': results,
         'message': f'Successfully synced {synced_count} days'
     }, status=status.HTTP_200_OK)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def quest_bulk_sync_stream_view(request):
+    """
+    Bulk sync a large offline backlog from a streamed NDJSON or JSON array body.
+
+    Records are parsed incrementally and committed in chunks of
+    QUEST_SYNC_CHUNK_SIZE, so memory stays flat regardless of payload size.
+    Chunks committed before an error stay committed; the response reports how far
+    ingestion got.
+    """
+    max_bytes = settings.QUEST_SYNC_MAX_BODY_BYTES
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > max_bytes:
+        return Response({
+            'error': f'Request body exceeds {max_bytes} bytes'
+        }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    progress = {'records': 0, 'created': 0, 'updated': 0, 'rejected': 0, 'chunks_committed': 0}
+    rejections = []
+
+    def reject(index, reason):
+        progress['rejected'] += 1
+        if len(rejections) < settings.QUEST_SYNC_MAX_REPORTED_REJECTIONS:
+            rejections.append({'index': index, 'reason': reason})
+
+    def commit(chunk):
+        indexes = [index for index, _ in chunk]
+        results = services.bulk_upsert_progress(request.user, [item for _, item in chunk])
+        for index, result in zip(indexes, results):
+            if result['status'] == 'rejected':
+                reject(index, result['reason'])
+            else:
+                progress[result['status']] += 1
+        progress['chunks_committed'] += 1
+
+    stream = streaming.body_stream(request._request)
+    if stream is None:
+        return Response({
+            'error': 'Content-Length is required for chunked uploads on this server'
+        }, status=status.HTTP_411_LENGTH_REQUIRED)
+    reader = streaming.BodyReader(stream, max_bytes)
+    content_type = request.content_type.split(';')[0].strip()
+    chunk = []
+    error = None
+    error_status = status.HTTP_400_BAD_REQUEST
+    try:
+        for index, record in enumerate(streaming.iter_records(reader, content_type)):
+            progress['records'] += 1
+            if isinstance(record, streaming.RecordError):
+                reject(index, record.reason)
+                continue
+            chunk.append((index, record))
+            if len(chunk) >= settings.QUEST_SYNC_CHUNK_SIZE:
+                commit(chunk)
+                chunk = []
+        if chunk:
+            commit(chunk)
+    except streaming.PayloadTooLarge as e:
+        error, error_status = str(e), status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    except streaming.MalformedPayload as e:
+        error = str(e)
+
+    body = {
+        **progress,
+        'synced_count': progress['created'] + progress['updated'],
+        'bytes_read': reader.bytes_read,
+        'rejections': rejections,
+        'rejections_truncated': progress['rejected'] > len(rejections),
+        'complete': error is None,
+    }
+    if error:
+        body['error'] = error
+        return Response(body, status=error_status)
+    return Response(body, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional(stats_validator)
 def quest_stats_view(request):
     """Get user statistics (streak, total XP, momentum hours)"""
-    progress_list = list(QuestProgress.objects.filter(user=request.user).order_by('-date'))
-    
-    total_xp = 0
-    streak = 0
     today = timezone.localdate()
-    
-    # Create a map for quick lookup
-    progress_map = {progress.date: progress for progress in progress_list}
-    
-    for progress in progress_list:
-        completed_count = sum([
-            progress.quest_1_completed,
-            progress.quest_2_completed,
-            progress.quest_3_completed
-        ])
-        total_xp += completed_count
-    
-    # Calculate streak (consecutive days with all 3 quests completed)
-    for i in range(365):  # Check up to a year
-        check_date = date.fromordinal(today.toordinal() - i)
-        progress = progress_map.get(check_date)
+    now = timezone.now()
+
+    def build():
+        try:
+            stats = UserStats.objects.get(pk=request.user.pk)
+        except UserStats.DoesNotExist:
+            # First visit since stats tracking was introduced: build from history
+            stats = services.rebuild_user_stats(request.user)
         
-        if progress:
-            if (progress.quest_1_completed and 
-                progress.quest_2_completed and 
-                progress.quest_3_completed):
-                streak += 1
-            else:
-                break
-        else:
-            # If no progress for this day, streak is broken
-            break
-    
-    # Calculate hours of consistency based on current streak
-    momentum_hours = 0
-    if streak > 0:
-        # Start counting from the beginning of the streak (midnight of first day)
-        streak_start_date = today - timedelta(days=streak - 1)
-        start_datetime = datetime.combine(streak_start_date, datetime.min.time())
+        total_xp = stats.total_xp
+        streak = stats.streak_as_of(today)
         
-        # Ensure timezone awareness matches the current time
-        if timezone.is_naive(start_datetime):
-            start_datetime = timezone.make_aware(start_datetime, timezone.get_default_timezone())
+        # Calculate hours of consistency based on current streak
+        momentum_hours = 0
+        if streak > 0:
+            # Start counting from the beginning of the streak (midnight of first day)
+            start_datetime = datetime.combine(stats.streak_start_date, datetime.min.time())
+            
+            # Ensure timezone awareness matches the current time
+            if timezone.is_naive(start_datetime):
+                start_datetime = timezone.make_aware(start_datetime, timezone.get_default_timezone())
+            
+            momentum_hours = int((now - start_datetime).total_seconds() // 3600)
         
-        now = timezone.now()
-        momentum_hours = int((now - start_datetime).total_seconds() // 3600)
-    
-    return Response({
-        'streak': streak,
-        'total_xp': total_xp,
-        'momentum_hours': momentum_hours,
-    })
+        return {
+            'streak': streak,
+            'total_xp': total_xp,
+            'momentum_hours': momentum_hours,
+        }
+
+    # momentum_hours changes hourly, so the hour is part of the cache key
+    return Response(quest_cache.get_or_build(
+        request.user.pk, 'stats', build, now.strftime('%Y-%m-%dT%H'), state=request.etag
+    ))
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
-@throttle_classes([AnonRateThrottle])
+@throttle_classes([AuthIPRateThrottle, AuthAccountRateThrottle])
 def password_reset_request_view(request):
     """Request password reset - sends email with reset link"""
     email = request.data.get('email')
@@ -463,18 +595,25 @@ def password_reset_request_view(request):
             'error': 'Email or username is required'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    # Find user by email or username
-    try:
-        if email:
-            user = User.objects.get(email=email)
-        else:
-            user = User.objects.get(username=username)
-    except User.DoesNotExist:
-        # Don't reveal if user exists (security best practice)
-        return Response({
-            'message': 'If an account exists with that email/username, a password reset link has been sent.'
-        }, status=status.HTTP_200_OK)
-    
+    # Find the accounts by email or username, ignoring case. Every account
+    # sharing an email gets its own link.
+    if email:
+        users = list(backends.users_with_email(email))
+    else:
+        user = backends.find_user(username)
+        users = [user] if user is not None and user.is_active else []
+
+    for user in users:
+        _send_password_reset_email(user)
+
+    # Always return success message (don't reveal if user exists)
+    return Response({
+        'message': 'If an account exists with that email/username, a password reset link has been sent.'
+    }, status=status.HTTP_200_OK)
+
+
+def _send_password_reset_email(user):
+    """Email the user a link to reset their password"""
     # Generate password reset token
     token = default_token_generator.make_token(user)
     uid = urlsafe_base64_encode(force_bytes(user.pk))
@@ -515,16 +654,11 @@ Top Three Club Team
         import logging
         logger = logging.getLogger(__name__)
         logger.error(f"Failed to send password reset email: {e}")
-    
-    # Always return success message (don't reveal if user exists)
-    return Response({
-        'message': 'If an account exists with that email/username, a password reset link has been sent.'
-    }, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
-@throttle_classes([AnonRateThrottle])
+@throttle_classes([AuthIPRateThrottle])
 def password_reset_confirm_view(request):
     """Confirm password reset with token"""
     uid = request.data.get('uid')
@@ -567,7 +701,7 @@ def password_reset_confirm_view(request):
         }, status=status.HTTP_400_BAD_REQUEST)
     
     # Reset password
-    user.set_password(new_password)
+    hashing.set_password(user, new_password)
     user.save()
     
     return Response({
@@ -577,29 +711,31 @@ def password_reset_confirm_view(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional(subscription_validator)
 def subscription_status_view(request):
     """Get current subscription status"""
-    try:
-        subscription = Subscription.objects.get(user=request.user)
-        return Response({
-            'tier': subscription.tier,
-            'billing_interval': subscription.billing_interval,
-            'status': subscription.status,
-            'is_premium': subscription.is_premium,
-            'current_period_end': subscription.current_period_end.isoformat() if subscription.current_period_end else None,
-        })
-    except Subscription.DoesNotExist:
-        return Response({
-            'tier': 'free',
-            'billing_interval': None,
-            'status': 'active',
-            'is_premium': False,
-            'current_period_end': None,
-        })
+    entitlement = entitlements.get_entitlement(request)
+    return Response({
+        'tier': entitlement.tier,
+        'billing_interval': entitlement.billing_interval,
+        'status': entitlement.status,
+        'is_premium': entitlement.is_premium,
+        'current_period_end': entitlement.current_period_end.isoformat() if entitlement.current_period_end else None,
+    })
+
+
+def _payments_unavailable():
+    """Stripe timed out, is unreachable, or the circuit breaker is open"""
+    return Response(
+        {'error': 'Payments are temporarily unavailable. Please try again shortly.'},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={'Retry-After': str(settings.STRIPE_BREAKER_RESET_SECONDS)},
+    )
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def create_checkout_view(request):
     """Create Stripe checkout session for subscription"""
     billing_interval = request.data.get('billing_interval', 'monthly')
@@ -615,6 +751,8 @@ def create_checkout_view(request):
             cancel_url=cancel_url
         )
         return Response({'checkout_url': checkout_url})
+    except stripe.error.APIConnectionError:
+        return _payments_unavailable()
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -623,7 +761,10 @@ def create_checkout_view(request):
 @permission_classes([IsAuthenticated])
 def cancel_subscription_view(request):
     """Cancel user subscription"""
-    success = stripe_service.cancel_subscription(request.user)
+    try:
+        success = stripe_service.cancel_subscription(request.user)
+    except stripe.error.APIConnectionError:
+        return _payments_unavailable()
     if success:
         return Response({'message': 'Subscription cancelled successfully'})
     return Response({'error': 'No active subscription found'}, status=status.HTTP_400_BAD_REQUEST)
@@ -632,13 +773,25 @@ def cancel_subscription_view(request):
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def stripe_webhook_view(request):
-    """Handle Stripe webhook events"""
+    """Receive Stripe webhook events and queue them for processing"""
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE', '')
 
     try:
-        event_type = stripe_service.handle_webhook_event(payload, sig_header)
-        return Response({'status': 'success', 'event': event_type})
+        # Stored for process_stripe_events; redeliveries are acknowledged but not stored twice
+        event_type, created = stripe_service.record_webhook_event(payload, sig_header)
     except ValueError as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    stripe_service.check_pending_event_backlog()
+    return Response({'status': 'success', 'event': event_type, 'duplicate': not created})
+
 
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def stripe_metrics_view(request):
+    """
+    Stripe API call latency and circuit breaker state for this server process,
+    and the backlog of webhook events waiting for process_stripe_events
+    """
+    return Response({**stripe_client.metrics(), 'events': stripe_service.pending_event_backlog()})
@@ -44,9 +44,12 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'apps.users.entitlements.EntitlementMiddleware',
     'allauth.account.middleware.AccountMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Password hashing pool overload: 503 on admin and allauth logins too
+    'apps.users.hashing.HashingUnavailableMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -106,6 +109,49 @@ else:
             }
         }
 
+# Cache configuration
+# Defaults to a per-process in-memory cache. Multi-worker deployments should point
+# CACHE_BACKEND/CACHE_LOCATION at a shared store, e.g.
+# CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+# CACHE_LOCATION=redis://localhost:6379/0
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'topthree-default'),
+        'TIMEOUT': int(os.environ.get('CACHE_TIMEOUT', '300')),
+    }
+}
+
+# Per-user response cache for quest read endpoints (see apps/users/quest_cache.py)
+QUEST_CACHE_ALIAS = os.environ.get('QUEST_CACHE_ALIAS', 'default')
+QUEST_CACHE_TIMEOUT = int(os.environ.get('QUEST_CACHE_TIMEOUT', '3600'))
+QUEST_CACHE_LOCK_TIMEOUT = float(os.environ.get('QUEST_CACHE_LOCK_TIMEOUT', '5'))
+QUEST_CACHE_POLL_INTERVAL = float(os.environ.get('QUEST_CACHE_POLL_INTERVAL', '0.05'))
+
+# Streaming quest bulk-sync (quests/bulk-sync/stream)
+QUEST_SYNC_MAX_BODY_BYTES = int(os.environ.get('QUEST_SYNC_MAX_BODY_BYTES', str(20 * 1024 * 1024)))
+QUEST_SYNC_CHUNK_SIZE = int(os.environ.get('QUEST_SYNC_CHUNK_SIZE', '500'))
+QUEST_SYNC_MAX_REPORTED_REJECTIONS = int(os.environ.get('QUEST_SYNC_MAX_REPORTED_REJECTIONS', '100'))
+
+# Quest history (quests/history). The default window covers the dashboard heat
+# meter: five past days, each looking back up to ten more days for its streak.
+QUEST_HISTORY_DEFAULT_DAYS = int(os.environ.get('QUEST_HISTORY_DEFAULT_DAYS', '16'))
+QUEST_HISTORY_PAGE_SIZE = int(os.environ.get('QUEST_HISTORY_PAGE_SIZE', '366'))
+
+# Delta sync (quests/changes)
+QUEST_CHANGES_PAGE_SIZE = int(os.environ.get('QUEST_CHANGES_PAGE_SIZE', '500'))
+# Rows written this recently are re-sent on the next sync, covering transactions
+# that committed after a later timestamp was already handed out
+QUEST_CHANGES_SETTLE_SECONDS = int(os.environ.get('QUEST_CHANGES_SETTLE_SECONDS', '5'))
+QUEST_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('QUEST_TOMBSTONE_RETENTION_DAYS', '90'))
+
+# Idempotency-Key support for mutating endpoints
+# Responses are replayed for retries within this window, then purged
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+# A key still unfinished after this long was claimed by a request that died, and
+# a retry may claim it again; keep it above gunicorn's --timeout
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '180'))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -148,6 +194,27 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Reverse proxies in front of Django; throttles take the client IP from
+    # X-Forwarded-For this many hops back, and ignore the header when 0. The
+    # header is only used on requests from a trusted proxy (see below).
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
+}
+
+# Requests count as coming through a trusted proxy when REMOTE_ADDR is in one of
+# these addresses or networks, or when they carry PROXY_SECRET in the
+# X-Proxy-Secret header (added by the frontend's middleware on Vercel). On any
+# other request throttles key on REMOTE_ADDR, so a forged header is ignored.
+TRUSTED_PROXY_IPS = [ip.strip() for ip in os.environ.get('TRUSTED_PROXY_IPS', '').split(',') if ip.strip()]
+PROXY_SECRET = os.environ.get('PROXY_SECRET', '')
+
+# Rate limits shared across worker processes (see apps/users/throttling.py).
+# 'auth_ip' applies per client IP to the register, login and password reset
+# endpoints; 'auth_account' per targeted account and client IP to login and
+# reset requests.
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'database')
+RATE_LIMITS = {
+    'auth_ip': os.environ.get('RATE_LIMIT_AUTH_IP', '30/min'),
+    'auth_account': os.environ.get('RATE_LIMIT_AUTH_ACCOUNT', '10/hour'),
 }
 
 # CORS settings for frontend
@@ -195,7 +262,17 @@ CSRF_COOKIE_SAMESITE = 'Lax'
 SESSION_COOKIE_PATH = '/'  # Ensure cookies work for all paths
 CSRF_COOKIE_PATH = '/'
 # SESSION_COOKIE_DOMAIN set in production.py for Vercel proxy
-SESSION_SAVE_EVERY_REQUEST = True  # Helps maintain session during OAuth
+# Cached sessions that are only re-saved when modified or once per refresh interval,
+# instead of on every request (see apps/users/sessions.py)
+SESSION_ENGINE = 'apps.users.sessions'
+SESSION_SAVE_EVERY_REQUEST = False
+# An active session's expiry is pushed back at most this often
+SESSION_REFRESH_INTERVAL_SECONDS = int(os.environ.get('SESSION_REFRESH_INTERVAL_SECONDS', '3600'))
+# Sessions are only cached when this names a cache shared by all workers (e.g. Redis);
+# with the per-process default they are read from the database on every request
+SESSION_CACHE_ALIAS = os.environ.get('SESSION_CACHE_ALIAS', 'default')
+# Longest a session is served from the cache before being re-read from the database
+SESSION_CACHE_TIMEOUT_SECONDS = int(os.environ.get('SESSION_CACHE_TIMEOUT_SECONDS', '60'))
 
 # CSRF trusted origins for cross-domain requests
 CSRF_TRUSTED_ORIGINS = [
@@ -214,7 +291,23 @@ CSRF_TRUSTED_ORIGINS.extend([
 # Django Allauth settings
 SITE_ID = 1
 
+# scrypt is memory-hard; hashes made with the others are upgraded to it on next login
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+]
+# Password hashing runs on a bounded per-process pool (see apps/users/hashing.py);
+# past workers + queue depth waiting hashes, requests get 503 instead of queueing.
+# Keep the sum below gunicorn's --threads (GUNICORN_THREADS in start.sh).
+PASSWORD_HASHING_WORKERS = int(os.environ.get('PASSWORD_HASHING_WORKERS', '2'))
+PASSWORD_HASHING_QUEUE_DEPTH = int(os.environ.get('PASSWORD_HASHING_QUEUE_DEPTH', '4'))
+PASSWORD_HASHING_TIMEOUT_SECONDS = float(os.environ.get('PASSWORD_HASHING_TIMEOUT_SECONDS', '5'))
+
 AUTHENTICATION_BACKENDS = [
+    # Username or email, case-insensitive; it ends the chain for the credentials it handles
+    'apps.users.backends.UsernameOrEmailBackend',
+    # Kept so sessions logged in through these backends stay valid
     'django.contrib.auth.backends.ModelBackend',
     'allauth.account.auth_backends.AuthenticationBackend',
 ]
@@ -290,6 +383,30 @@ STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
 STRIPE_PREMIUM_MONTHLY_PRICE_ID = os.environ.get('STRIPE_PREMIUM_MONTHLY_PRICE_ID', '')
 STRIPE_PREMIUM_YEARLY_PRICE_ID = os.environ.get('STRIPE_PREMIUM_YEARLY_PRICE_ID', '')
+# Webhook events are stored on receipt and applied by `manage.py process_stripe_events`
+# (started by start.sh, or the Procfile's worker process); an event that keeps
+# failing is parked as failed after this many attempts
+STRIPE_EVENT_MAX_ATTEMPTS = int(os.environ.get('STRIPE_EVENT_MAX_ATTEMPTS', '5'))
+# Failed attempts are retried after this many seconds, doubling each time up to the cap
+STRIPE_EVENT_RETRY_SECONDS = int(os.environ.get('STRIPE_EVENT_RETRY_SECONDS', '30'))
+STRIPE_EVENT_RETRY_MAX_SECONDS = int(os.environ.get('STRIPE_EVENT_RETRY_MAX_SECONDS', '3600'))
+# Webhooks log an error while an event has been pending longer than this, or has failed
+STRIPE_EVENT_ALERT_SECONDS = int(os.environ.get('STRIPE_EVENT_ALERT_SECONDS', '300'))
+# Outbound Stripe API calls (see apps/users/stripe_client.py). Timeouts bound how long
+# a slow Stripe can hold a worker; retries back off exponentially with jitter.
+STRIPE_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('STRIPE_CONNECT_TIMEOUT_SECONDS', '3'))
+STRIPE_READ_TIMEOUT_SECONDS = float(os.environ.get('STRIPE_READ_TIMEOUT_SECONDS', '10'))
+STRIPE_MAX_NETWORK_RETRIES = int(os.environ.get('STRIPE_MAX_NETWORK_RETRIES', '2'))
+# After this many consecutive failed calls, Stripe calls fail fast for the reset period
+STRIPE_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('STRIPE_BREAKER_FAILURE_THRESHOLD', '5'))
+STRIPE_BREAKER_RESET_SECONDS = int(os.environ.get('STRIPE_BREAKER_RESET_SECONDS', '30'))
+# Active subscriptions are treated as lapsed this long after current_period_end
+# without a renewal webhook, and downgraded by `manage.py expire_subscriptions`
+SUBSCRIPTION_EXPIRY_GRACE_HOURS = int(os.environ.get('SUBSCRIPTION_EXPIRY_GRACE_HOURS', '48'))
+# Per-process cache of users' premium entitlements (see apps/users/entitlements.py).
+# The TTL bounds how long a Subscription change made by another process goes unseen.
+ENTITLEMENT_CACHE_MAX_ENTRIES = int(os.environ.get('ENTITLEMENT_CACHE_MAX_ENTRIES', '10000'))
+ENTITLEMENT_CACHE_TTL_SECONDS = int(os.environ.get('ENTITLEMENT_CACHE_TTL_SECONDS', '60'))
 
 # Email Configuration
 # For production, configure SMTP settings via environment variables:
@@ -24,6 +24,12 @@ SECURE_HSTS_INCLUDE_SUBDOMAINS = os.environ.get('SECURE_HSTS_INCLUDE_SUBDOMAINS'
 SECURE_HSTS_PRELOAD = os.environ.get('SECURE_HSTS_PRELOAD', 'False') == 'True'
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
+# Client IP for rate limiting: Vercel's rewrite proxy replaces X-Forwarded-For with
+# the client's address and Render's load balancer appends Vercel's, so the client
+# is two hops back. Render's origin can also be called directly with a forged
+# header, so it is only used on requests carrying PROXY_SECRET (see base.py).
+REST_FRAMEWORK['NUM_PROXIES'] = int(os.environ.get('NUM_PROXIES', '2'))
+
 # Security: Cookie settings for Vercel proxy
 # IMPORTANT: Secure=True requires HTTPS, which Vercel provides
 SESSION_COOKIE_SECURE = True  # Only send over HTTPS
@@ -36,6 +36,9 @@ CACHES = {
     }
 }
 
+# Don't sleep between Stripe retries in tests
+STRIPE_MAX_NETWORK_RETRIES = 0
+
 # Email backend for tests
 EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
 
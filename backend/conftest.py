@@ -24,6 +24,21 @@ def enable_db_access_for_all_tests(db):
     pass
 
 
+@pytest.fixture(autouse=True)
+def clear_entitlement_cache():
+    """Entitlements are cached per process; keep them from leaking between tests"""
+    from apps.users import entitlements
+    entitlements.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_stripe_client():
+    """The Stripe circuit breaker and call metrics are per process; start each test closed"""
+    from apps.users import stripe_client
+    stripe_client.breaker.reset()
+    stripe_client.call_metrics.reset()
+
+
 @pytest.fixture
 def api_client():
     """Create an API client for testing"""
@@ -11,7 +11,36 @@ python manage.py migrate --noinput
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
 
+# Apply stored Stripe webhook events next to the web server; the webhook view only
+# stores them. Restarted if it exits. Deployments that run the Procfile's separate
+# worker process set STRIPE_EVENT_WORKER=external.
+if [ "${STRIPE_EVENT_WORKER:-inline}" = "inline" ]; then
+    echo "Starting Stripe event worker..."
+    (
+        while true; do
+            python manage.py process_stripe_events --loop || echo "Stripe event worker exited; restarting..."
+            sleep 5
+        done
+    ) &
+fi
+
+# Downgrade subscriptions whose period lapsed without a webhook, every 15 minutes.
+# Deployments that run the Procfile's sweeper process set SUBSCRIPTION_SWEEPER=external.
+if [ "${SUBSCRIPTION_SWEEPER:-inline}" = "inline" ]; then
+    echo "Starting subscription expiry sweeper..."
+    (
+        while true; do
+            python manage.py expire_subscriptions --loop --interval 900 || echo "Subscription sweeper exited; restarting..."
+            sleep 5
+        done
+    ) &
+fi
+
 # Start Gunicorn
+# Threaded workers, with more threads than password hashes allowed in flight per
+# process (PASSWORD_HASHING_WORKERS + PASSWORD_HASHING_QUEUE_DEPTH), so a login
+# burst is refused with 503 while threads stay free for other requests
 echo "Starting Gunicorn server..."
-exec gunicorn config.wsgi:application --bind 0.0.0.0:${PORT:-8000} --workers 2 --timeout 120
+exec gunicorn config.wsgi:application --bind 0.0.0.0:${PORT:-8000} --workers 2 \
+    --worker-class gthread --threads ${GUNICORN_THREADS:-8} --timeout 120
 
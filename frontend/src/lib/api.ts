@@ -18,6 +18,33 @@ export interface BrainDumpIdea {
   updated_at: string;
 }
 
+export interface HistoryBitmap {
+  start: string;
+  days: number;
+  bits_per_quest: number;
+  data: string;
+}
+
+// Dates (YYYY-MM-DD, newest first) on which all three quests were completed.
+// Each quest of each day takes bits_per_quest bits, least significant first;
+// the second bit is set when the quest was completed.
+export function decodePerfectDays(bitmap: HistoryBitmap): string[] {
+  const bytes = Uint8Array.from(atob(bitmap.data), (c) => c.charCodeAt(0));
+  const start = Date.parse(`${bitmap.start}T00:00:00Z`);
+  const dates: string[] = [];
+  for (let day = bitmap.days - 1; day >= 0; day--) {
+    let perfect = true;
+    for (let quest = 0; quest < 3 && perfect; quest++) {
+      const bit = (day * 3 + quest) * bitmap.bits_per_quest + 1;
+      perfect = ((bytes[bit >> 3] >> (bit & 7)) & 1) === 1;
+    }
+    if (perfect) {
+      dates.push(new Date(start + day * 86400000).toISOString().slice(0, 10));
+    }
+  }
+  return dates;
+}
+
 class ApiClient {
   private async request<T>(
     endpoint: string,
@@ -136,10 +163,22 @@ class ApiClient {
     });
   }
 
+  // The heat meter's window (the endpoint's default range)
   async getQuestHistory(): Promise<ApiResponse<any>> {
     return this.request('/api/users/quests/history');
   }
 
+  // Perfect days over the last year, from the packed heatmap bitmap (under 1KB)
+  async getPerfectDays(): Promise<ApiResponse<string[]>> {
+    const result = await this.request<HistoryBitmap>('/api/users/quests/history/bitmap');
+    return result.data ? { data: decodePerfectDays(result.data) } : { error: result.error };
+  }
+
+  async getQuestChanges(since?: string): Promise<ApiResponse<any>> {
+    const query = since ? `?since=${encodeURIComponent(since)}` : '';
+    return this.request(`/api/users/quests/changes${query}`);
+  }
+
   async getQuestStats(): Promise<ApiResponse<any>> {
     return this.request('/api/users/quests/stats');
   }
@@ -0,0 +1,28 @@
+// Proxies backend paths to Django with a shared secret, so the backend can tell
+// requests relayed by Vercel (whose X-Forwarded-For it trusts for rate limiting)
+// from ones sent straight to its origin. Without PROXY_SECRET this does nothing
+// and the rewrites in vercel.json proxy the request instead.
+import { NextRequest, NextResponse } from 'next/server';
+
+const BACKEND_URL = process.env.BACKEND_URL || 'https://topthreeclub.onrender.com';
+
+export function middleware(request: NextRequest) {
+  const secret = process.env.PROXY_SECRET;
+  if (!secret) {
+    return NextResponse.next();
+  }
+
+  const { pathname, search } = request.nextUrl;
+  // allauth's URLs end in a slash (see vercel.json)
+  const path = pathname.startsWith('/accounts/') && !pathname.endsWith('/') ? `${pathname}/` : pathname;
+  const headers = new Headers(request.headers);
+  headers.set('X-Proxy-Secret', secret);
+
+  return NextResponse.rewrite(new URL(`${path}${search}`, BACKEND_URL), {
+    request: { headers },
+  });
+}
+
+export const config = {
+  matcher: ['/api/:path*', '/accounts/:path+', '/admin/:path*'],
+};
@@ -55,6 +55,7 @@ export default function Dashboard() {
   const [brainDumpOpen, setBrainDumpOpen] = useState(false);
   const [viewingTomorrow, setViewingTomorrow] = useState(false);
   const [questHistory, setQuestHistory] = useState<QuestHistoryEntry[]>([]);
+  const [perfectDays, setPerfectDays] = useState<string[]>([]);
   const [accountCreatedDate, setAccountCreatedDate] = useState<string>('');
   const [choicesLocked, setChoicesLocked] = useState(false);
   const [lockingChoices, setLockingChoices] = useState(false);
@@ -202,10 +203,16 @@ export default function Dashboard() {
 
   const fetchQuestHistory = useCallback(async () => {
     try {
-      const historyResult = await apiClient.getQuestHistory();
+      const [historyResult, perfectDaysResult] = await Promise.all([
+        apiClient.getQuestHistory(),
+        apiClient.getPerfectDays(),
+      ]);
       if (historyResult.data) {
         setQuestHistory(historyResult.data);
       }
+      if (perfectDaysResult.data) {
+        setPerfectDays(perfectDaysResult.data);
+      }
     } catch (error) {
       // If quest history fails, leave defaults; dashboard still functions
     }
@@ -719,7 +726,7 @@ export default function Dashboard() {
             />
 
             {/* Perfect Days - All 3 Tasks Completed */}
-            {questHistory.filter(q => q.completed).length > 0 && (
+            {perfectDays.length > 0 && (
               <div className="card p-6 mb-8">
                 <div className="flex items-center justify-between mb-4">
                   <div>
@@ -727,25 +734,23 @@ export default function Dashboard() {
                       Perfect Days
                     </h3>
                     <p className="text-sm text-gray-600">
-                      Days you completed all three tasks
+                      Days you completed all three tasks this past year
                     </p>
                   </div>
                   <div className="text-3xl font-bold text-success-600">
-                    {questHistory.filter(q => q.completed).length}
+                    {perfectDays.length}
                   </div>
                 </div>
                 <div className="grid grid-cols-2 sm:grid-cols-3 md:grid-cols-4 lg:grid-cols-5 gap-3">
-                  {questHistory
-                    .filter(q => q.completed)
-                    .sort((a, b) => new Date(b.date).getTime() - new Date(a.date).getTime())
-                    .map((entry) => {
-                      const date = new Date(entry.date);
+                  {perfectDays
+                    .map((day) => {
+                      const date = new Date(day);
                       const monthNames = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
                       const dayNames = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat'];
 
                       return (
                         <div
-                          key={entry.date}
+                          key={day}
                           className="bg-success-50 border-2 border-success-200 rounded-lg p-3 text-center hover:bg-success-100 transition-colors"
                         >
                           <div className="text-xs text-success-700 font-medium mb-1">
@@ -0,0 +1,17 @@
+import { describe, it, expect } from 'vitest';
+import { decodePerfectDays } from '@/lib/api';
+
+describe('decodePerfectDays', () => {
+  it('returns only days with all three quests completed, newest first', () => {
+    // Day 0: quests 1 and 2 completed; day 1: all three have text and are completed
+    const bitmap = { start: '2024-01-01', days: 2, bits_per_quest: 2, data: 'yg8=' };
+
+    expect(decodePerfectDays(bitmap)).toEqual(['2024-01-02']);
+  });
+
+  it('returns nothing for an empty history', () => {
+    const bitmap = { start: '2024-01-01', days: 3, bits_per_quest: 2, data: 'AAAA' };
+
+    expect(decodePerfectDays(bitmap)).toEqual([]);
+  });
+});